@@ -1,3 +1,5 @@
+import os
+
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse
@@ -5,8 +7,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from app.routers import detection
+from app.routers import admin, detection, history, jobs, streams
 from app.utils.cleanup import setup_cleanup_task
+from app.utils.memory import RecycleMiddleware, recycle_policy
+from app.utils.result_cache import ResultFiles, RESULTS_DIR
+from app.utils.upload import UploadSizeLimitMiddleware, MAX_JOB_UPLOAD_BYTES
 
 app = FastAPI(
     title="Object Detection API",
@@ -23,6 +28,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Cap request bodies while they stream in; a job may carry many images
+app.add_middleware(UploadSizeLimitMiddleware, limits={"/jobs": MAX_JOB_UPLOAD_BYTES})
+
+# Recycle the worker after WORKER_MAX_REQUESTS requests or past WORKER_MAX_RSS_MB
+if recycle_policy.enabled:
+    app.add_middleware(RecycleMiddleware, policy=recycle_policy)
+
 # Exception handlers for JSON responses
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request, exc):
@@ -38,15 +50,54 @@ async def validation_exception_handler(request, exc):
         content={"error": "Validation Error", "detail": str(exc)}
     )
 
-# Mount static files
+# Mount static files; result images get caching headers, ranges and resized variants
+os.makedirs(RESULTS_DIR, exist_ok=True)
+app.mount("/static/results", ResultFiles(directory=RESULTS_DIR), name="results")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 # Include routers
 app.include_router(detection.router)
+app.include_router(jobs.router)
+app.include_router(streams.router)
+app.include_router(history.router)
+app.include_router(admin.router)
 
 # Set up file cleanup task
 setup_cleanup_task(app)
 
+# A missing or corrupted model bundle stops startup instead of failing requests
+@app.on_event("startup")
+async def verify_model_bundles():
+    from starlette.concurrency import run_in_threadpool
+    from app.models.registry import registry
+    await run_in_threadpool(registry.verify_bundles)
+
+# Heavy inference modules are imported lazily on the first detection. Inference
+# workers that prefer to pay that cost up front can opt in to a warm start.
+if os.environ.get("PRELOAD_MODEL", "0") == "1":
+    @app.on_event("startup")
+    async def preload_model():
+        from starlette.concurrency import run_in_threadpool
+        from app.models.registry import registry
+        await run_in_threadpool(registry.warmup)
+
+# Write out detections still queued for the history before exiting
+@app.on_event("shutdown")
+async def close_history():
+    from starlette.concurrency import run_in_threadpool
+    from app.utils.history import history
+    await run_in_threadpool(history.close)
+
+# With the in-process broker (BROKER_URL=local-redis) inference workers run on
+# threads of this process; with a Redis broker they run as separate processes
+if int(os.environ.get("BROKER_LOCAL_WORKERS", "0")) > 0:
+    @app.on_event("startup")
+    async def start_local_workers():
+        from app.utils.broker import inference_queue
+        from app.utils.worker import start_local_workers
+        if inference_queue is not None:
+            start_local_workers(inference_queue, int(os.environ["BROKER_LOCAL_WORKERS"]))
+
 @app.get("/")
 async def root():
     """Serve the HTML frontend"""
@@ -59,7 +110,10 @@ async def api_info():
         "message": "Welcome to the Object Detection API",
         "docs": "/docs",
         "endpoints": {
-            "detect": "/detect"
+            "detect": "/detect",
+            "jobs": "/jobs",
+            "streams": "/streams",
+            "history": "/history"
         }
     }
 
@@ -0,0 +1,186 @@
+"""
+Input shape buckets for rectangular inference
+Instead of letterboxing every image to one square size, each image is
+letterboxed to the smallest of a few fixed shapes that fits its aspect ratio
+(e.g. 640x384 for 16:9 frames). A fixed set of shapes keeps batching simple
+and lets TorchScript/torch.compile build one graph per bucket up front
+"""
+import os
+from typing import Any, Dict, List, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+# Landscape buckets as WIDTHxHEIGHT; portrait images use the transposed shapes.
+# Set SHAPE_BUCKETS=none to letterbox everything to a single square size.
+SHAPE_BUCKETS = os.environ.get("SHAPE_BUCKETS", "640x384,640x480,640x640")
+
+# Bucket sides must be multiples of the model stride
+STRIDE = 32
+PAD_COLOR = (114, 114, 114)
+
+Shape = Tuple[int, int]  # (height, width), as ultralytics expects imgsz
+
+
+def parse_buckets(spec: str = SHAPE_BUCKETS) -> List[Shape]:
+    """
+    Parse a bucket list such as "640x384,640x480,640x640"
+
+    Args:
+        spec: Comma separated WIDTHxHEIGHT shapes, or "none"/"" to disable
+
+    Returns:
+        Landscape buckets as (height, width), smallest first
+    """
+    if not spec or spec.strip().lower() == "none":
+        return []
+    buckets = set()
+    for part in spec.split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        width, height = (int(v) for v in part.split("x", 1))
+        if width % STRIDE or height % STRIDE:
+            raise ValueError(f"Shape bucket {part} is not a multiple of {STRIDE}")
+        buckets.add((min(width, height), max(width, height)))
+    return sorted(buckets, key=lambda s: s[0] * s[1])
+
+
+def scale_side(side: int, scale: float) -> int:
+    """Scale an input side length, keeping it a multiple of STRIDE (at least one stride)"""
+    return max(STRIDE, int(round(side * scale / STRIDE)) * STRIDE)
+
+
+def scale_buckets(buckets: List[Shape], scale: float) -> List[Shape]:
+    """Buckets shrunk (or grown) by `scale`, for inference at a reduced resolution"""
+    scaled = {(scale_side(h, scale), scale_side(w, scale)) for h, w in buckets}
+    return sorted(scaled, key=lambda s: s[0] * s[1])
+
+
+def bucket_shapes(buckets: List[Shape]) -> List[Shape]:
+    """All (height, width) input shapes for the buckets, in both orientations"""
+    shapes = set(buckets) | {(w, h) for h, w in buckets}
+    return sorted(shapes, key=lambda s: (s[0] * s[1], s))
+
+
+def select_bucket(width: int, height: int, buckets: List[Shape]) -> Shape:
+    """
+    Pick the smallest bucket that holds an image without shrinking it further
+    than its longest side requires
+
+    Args:
+        width, height: Image dimensions
+        buckets: Landscape buckets from parse_buckets
+
+    Returns:
+        (height, width) input shape for the image
+    """
+    portrait = height > width
+    aspect = min(width, height) / max(width, height)
+    fitting = [b for b in buckets if b[0] / b[1] >= aspect - 1e-6]
+    # Buckets are sorted by area; fall back to the squarest one
+    bucket = fitting[0] if fitting else max(buckets, key=lambda b: b[0] / b[1])
+    return (bucket[1], bucket[0]) if portrait else bucket
+
+
+def load_bgr(image: Union[str, "np.ndarray", "Image.Image"]) -> "np.ndarray":
+    """
+    Convert a detection input to a BGR array (as ultralytics does internally)
+
+    Args:
+        image: File path, BGR numpy array or PIL Image
+
+    Returns:
+        BGR uint8 array; numpy input is returned as is
+    """
+    import numpy as np
+
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, str):
+        import cv2
+        img = cv2.imread(image)
+        if img is None:
+            raise ValueError(f"Could not read image {image}")
+        return img
+    return np.ascontiguousarray(np.asarray(image.convert("RGB"))[:, :, ::-1])
+
+
+def letterbox(img: "np.ndarray", shape: Shape) -> Tuple["np.ndarray", float, Tuple[int, int]]:
+    """
+    Resize and pad an image to exactly `shape`, preserving its aspect ratio
+
+    Matches ultralytics' LetterBox (centred, gray padding), so the model sees
+    the same pixels as with its own preprocessing.
+
+    Args:
+        img: BGR image
+        shape: Target (height, width)
+
+    Returns:
+        (padded image, scale applied, (left, top) padding)
+    """
+    import cv2
+
+    height, width = img.shape[:2]
+    ratio = min(shape[0] / height, shape[1] / width)
+    new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+    dw, dh = (shape[1] - new_w) / 2, (shape[0] - new_h) / 2
+
+    if (new_w, new_h) != (width, height):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    if top or bottom or left or right:
+        img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=PAD_COLOR)
+    return img, ratio, (left, top)
+
+
+def unletterbox_detections(
+    detections: List[Dict[str, Any]],
+    ratio: float,
+    pad: Tuple[int, int],
+    width: int,
+    height: int
+) -> List[Dict[str, Any]]:
+    """
+    Map detection boxes from letterboxed coordinates back to the original image
+
+    Args:
+        detections: Detections in the simplified format returned by the models
+        ratio, pad: As returned by letterbox
+        width, height: Original image dimensions
+
+    Returns:
+        The same list, with bbox coordinates updated in place
+    """
+    left, top = pad
+    for det in detections:
+        bbox = det["bbox"]
+        x1 = min(max((bbox["x1"] - left) / ratio, 0.0), width)
+        y1 = min(max((bbox["y1"] - top) / ratio, 0.0), height)
+        x2 = min(max((bbox["x2"] - left) / ratio, 0.0), width)
+        y2 = min(max((bbox["y2"] - top) / ratio, 0.0), height)
+        bbox.update({
+            "x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2),
+            "width": float(x2 - x1), "height": float(y2 - y1)
+        })
+    return detections
+
+
+def group_by_bucket(sizes: List[Tuple[int, int]], buckets: List[Shape]) -> Dict[Shape, List[int]]:
+    """
+    Group images by the bucket they fall into
+
+    Args:
+        sizes: (width, height) of each image
+        buckets: Landscape buckets from parse_buckets
+
+    Returns:
+        Bucket shape -> indices of the images using it
+    """
+    groups: Dict[Shape, List[int]] = {}
+    for index, (width, height) in enumerate(sizes):
+        groups.setdefault(select_bucket(width, height, buckets), []).append(index)
+    return groups
@@ -0,0 +1,332 @@
+"""
+Offline model bundles for YOLOModel
+A bundle is a directory holding Conv+BN-fused weights as a plain tensor
+archive, optional prebuilt TorchScript engines and a manifest with the
+architecture, class names and a SHA-256 checksum of every file:
+
+    python -m app.models.bundle build app/models/weights/yolov8n.pt bundles/yolov8n.bundle \\
+        --torchscript 640x384,640x480,640x640
+    python -m app.models.bundle verify bundles/yolov8n.bundle
+
+Bundles load without network access or pickle (torch.load weights_only),
+and the weights are memory-mapped read-only so worker processes share the
+same page-cache pages. A missing or corrupted bundle raises BundleError;
+there is no download and no SimpleDetector fallback
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+BUNDLE_SUFFIX = ".bundle"
+MANIFEST = "manifest.json"
+WEIGHTS = "weights.pt"
+FORMAT_VERSION = 1
+
+# full: SHA-256 of every file at load time; size: sizes only (faster for large bundles)
+VERIFY_MODE = os.environ.get("MODEL_BUNDLE_VERIFY", "full").lower()
+
+Shape = Tuple[int, int]
+
+
+class BundleError(Exception):
+    """Raised when a model bundle is missing, corrupted or incompatible"""
+
+
+def is_bundle(path: str) -> bool:
+    """Whether a model path refers to a bundle (it need not exist)"""
+    path = path.rstrip("/")
+    return path.endswith(BUNDLE_SUFFIX) or os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _shape_key(shape: Shape) -> str:
+    return f"{shape[0]}x{shape[1]}"
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    """
+    Read a bundle's manifest without checking its files
+
+    Raises:
+        BundleError: If the bundle or its manifest is missing or unreadable
+    """
+    if not os.path.isdir(path):
+        raise BundleError(f"Model bundle {path} not found")
+    manifest_path = os.path.join(path, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise BundleError(f"Model bundle {path} has no {MANIFEST}")
+    except (OSError, ValueError) as e:
+        raise BundleError(f"Model bundle {path} has an unreadable manifest: {e}")
+    if not isinstance(manifest, dict) or manifest.get("format") != FORMAT_VERSION:
+        raise BundleError(f"Model bundle {path} has an unsupported manifest format (expected {FORMAT_VERSION})")
+    for key in ("architecture", "names", "files", "weights"):
+        if key not in manifest:
+            raise BundleError(f"Model bundle {path} manifest lacks '{key}'")
+    return manifest
+
+
+def verify_bundle(path: str, mode: str = VERIFY_MODE) -> Dict[str, Any]:
+    """
+    Check that every file listed in a bundle's manifest is present and intact
+
+    Args:
+        path: Bundle directory
+        mode: "full" compares SHA-256 checksums, "size" only file sizes
+
+    Returns:
+        The manifest
+
+    Raises:
+        BundleError: Naming the first missing or corrupted file
+    """
+    manifest = read_manifest(path)
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(path, name)
+        if os.path.isabs(name) or ".." in name.split("/"):
+            raise BundleError(f"Model bundle {path} lists a file outside the bundle: {name}")
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            raise BundleError(f"Model bundle {path} is missing {name}")
+        if size != expected["bytes"]:
+            raise BundleError(f"Model bundle {path}: {name} is {size} bytes, expected {expected['bytes']}")
+        if mode == "full" and _sha256(file_path) != expected["sha256"]:
+            raise BundleError(f"Model bundle {path}: checksum mismatch for {name}")
+    if manifest["weights"] not in manifest["files"]:
+        raise BundleError(f"Model bundle {path} does not checksum its weights")
+    return manifest
+
+
+def _wrapper(module):
+    """An ultralytics YOLO object around an already built DetectionModel"""
+    import logging
+    from ultralytics import YOLO
+    from ultralytics.utils import LOGGER
+
+    # The smallest packaged architecture, only to get a configured wrapper
+    # without touching the network; its randomly initialised model is replaced
+    level = LOGGER.level
+    LOGGER.setLevel(logging.WARNING)
+    try:
+        yolo = YOLO("yolov8n.yaml", task="detect")
+    finally:
+        LOGGER.setLevel(level)
+    module.args = yolo.model.args
+    module.task = "detect"
+    yolo.model = module
+    return yolo
+
+
+def load_bundle(path: str, device: str = "cpu", mode: str = VERIFY_MODE) -> Tuple[Any, Dict[Shape, str]]:
+    """
+    Verify a bundle and load its model
+
+    The weights are memory-mapped and assigned to the model as they are, so
+    on CPU the parameters stay backed by the shared, read-only file pages.
+
+    Args:
+        path: Bundle directory
+        device: Device to load the model on
+        mode: Verification mode, as for verify_bundle
+
+    Returns:
+        (ultralytics YOLO object, {(height, width): TorchScript engine path}),
+        engines only if they were built with this torch version
+
+    Raises:
+        BundleError: If the bundle is missing, corrupted or does not match its architecture
+    """
+    import torch
+    from ultralytics.nn.tasks import DetectionModel
+
+    start = time.time()
+    manifest = verify_bundle(path, mode)
+    try:
+        module = DetectionModel(cfg=manifest["architecture"], verbose=False)
+        if manifest.get("fused"):
+            # Give the module the fused layout of the stored weights
+            module.fuse(verbose=False)
+        state = torch.load(os.path.join(path, manifest["weights"]), map_location="cpu",
+                           mmap=True, weights_only=True)
+        module.load_state_dict(state, strict=True, assign=True)
+    except Exception as e:
+        raise BundleError(f"Model bundle {path} could not be loaded: {e}") from e
+    module.names = {int(k): v for k, v in manifest["names"].items()}
+    module.eval()
+    module.requires_grad_(False)
+    if device != "cpu":
+        module.to(device)
+
+    engines = {}
+    torchscript = manifest.get("engines", {}).get("torchscript", {})
+    if torchscript and manifest.get("torch_version") != torch.__version__:
+        print(f"Ignoring TorchScript engines of {path}: built with torch "
+              f"{manifest.get('torch_version')}, running {torch.__version__}")
+    elif torchscript:
+        for key, name in torchscript.items():
+            height, width = (int(v) for v in key.split("x"))
+            engines[(height, width)] = os.path.join(path, name)
+    print(f"Loaded model bundle {manifest.get('name')} {manifest.get('version')} in {time.time() - start:.2f}s")
+    return _wrapper(module), engines
+
+
+@contextmanager
+def _trusted_torch_load():
+    """Allow pickled checkpoints while building (source weights are trusted at build time)"""
+    import inspect
+    import torch
+
+    original = torch.load
+    if "weights_only" in inspect.signature(original).parameters:
+        def patched(*args, **kwargs):
+            kwargs["weights_only"] = False
+            return original(*args, **kwargs)
+        torch.load = patched
+    try:
+        yield
+    finally:
+        torch.load = original
+
+
+def build_bundle(weights: str, output: str, name: Optional[str] = None, version: Optional[str] = None,
+                 torchscript: Optional[List[Shape]] = None) -> Dict[str, Any]:
+    """
+    Build a bundle from an ultralytics checkpoint
+
+    Args:
+        weights: Source .pt checkpoint (must exist; nothing is downloaded)
+        output: Bundle directory to create (replaced if it exists)
+        name: Model name (default: checkpoint file name without extension)
+        version: Version label (default: first 12 hex digits of the weights checksum)
+        torchscript: (height, width) shapes to export TorchScript engines for
+
+    Returns:
+        The manifest
+    """
+    import torch
+    import ultralytics
+    from ultralytics import YOLO
+
+    from app.models.optimize import export_lock
+
+    if not os.path.isfile(weights):
+        raise FileNotFoundError(f"Weights file {weights} not found")
+    source_sha = _sha256(weights)
+    name = name or os.path.splitext(os.path.basename(weights))[0]
+    parent = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".bundle-", dir=parent)
+    os.chmod(staging, 0o755)
+    try:
+        with _trusted_torch_load():
+            yolo = YOLO(weights)
+        module = yolo.model
+        if getattr(yolo, "task", "detect") != "detect":
+            raise ValueError(f"{weights} is a {yolo.task} model; only detection models can be bundled")
+
+        engines = {}
+        if torchscript:
+            os.makedirs(os.path.join(staging, "engines"))
+            for shape in torchscript:
+                print(f"Exporting TorchScript engine for input shape {shape}...")
+                engine = os.path.join("engines", f"torchscript-{_shape_key(shape)}.torchscript")
+                # Serving workers may be exporting from the same weights
+                with export_lock(weights), _trusted_torch_load():
+                    exported = yolo.export(format="torchscript", imgsz=list(shape), verbose=False)
+                    shutil.move(exported, os.path.join(staging, engine))
+                engines[_shape_key(shape)] = engine
+
+        module.fuse(verbose=False)
+        module.float().eval()
+        # Plain tensors in torch's zip format: loadable with weights_only and mmap
+        state = {key: tensor.detach().contiguous() for key, tensor in module.state_dict().items()}
+        torch.save(state, os.path.join(staging, WEIGHTS))
+
+        files = {}
+        for file_name in [WEIGHTS] + sorted(engines.values()):
+            file_path = os.path.join(staging, file_name)
+            files[file_name] = {"sha256": _sha256(file_path), "bytes": os.path.getsize(file_path)}
+        manifest = {
+            "format": FORMAT_VERSION,
+            "name": name,
+            "version": version or source_sha[:12],
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "source": {"file": os.path.basename(weights), "sha256": source_sha},
+            "task": "detect",
+            "torch_version": torch.__version__,
+            "ultralytics_version": ultralytics.__version__,
+            "architecture": module.yaml,
+            "names": {str(k): v for k, v in module.names.items()},
+            "fused": True,
+            "weights": WEIGHTS,
+            "engines": {"torchscript": engines} if engines else {},
+            "files": files
+        }
+        with open(os.path.join(staging, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        if os.path.exists(output):
+            shutil.rmtree(output)
+        os.replace(staging, output)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    print(f"Built model bundle {output} ({name} {manifest['version']})")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and verify offline model bundles")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build a bundle from a .pt checkpoint")
+    build.add_argument("weights", help="Source checkpoint")
+    build.add_argument("output", help=f"Bundle directory to create (conventionally *{BUNDLE_SUFFIX})")
+    build.add_argument("--name", default=None, help="Model name (default: checkpoint stem)")
+    build.add_argument("--version", default=None, help="Version label (default: weights checksum prefix)")
+    build.add_argument("--torchscript", default="",
+                       help="Prebuild TorchScript engines for these shape buckets (SHAPE_BUCKETS syntax, "
+                            "e.g. 640x384,640x480,640x640; both orientations are built)")
+
+    verify = commands.add_parser("verify", help="Check a bundle's files against its manifest")
+    verify.add_argument("bundle", help="Bundle directory")
+    verify.add_argument("--load", action="store_true", help="Also load the weights")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        from app.models.buckets import bucket_shapes, parse_buckets
+        shapes = bucket_shapes(parse_buckets(args.torchscript)) if args.torchscript else None
+        build_bundle(args.weights, args.output, args.name, args.version, shapes)
+        return
+
+    try:
+        if args.load:
+            load_bundle(args.bundle, mode="full")
+        manifest = verify_bundle(args.bundle, mode="full")
+    except BundleError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
+    engines = ", ".join(manifest.get("engines", {}).get("torchscript", {})) or "none"
+    print(f"OK: {manifest['name']} {manifest['version']} (torch {manifest['torch_version']}, "
+          f"{len(manifest['files'])} files, TorchScript engines: {engines})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Speed/accuracy evaluation of YOLOModel configurations
+Runs the detector under a grid of configurations (input size, shape
+buckets, execution mode, pooled preprocessing, confidence threshold) over a
+local labeled dataset, scores it per class with COCO's greedy matching and
+101-point AP, measures latency percentiles and reports the Pareto front:
+
+    python -m app.models.evaluate data/synthetic --grid imgsz=320,640 optimize=eager,torchscript \\
+        conf=0.25,0.4 --min-map 0.3 --output report.json
+
+Datasets are COCO (annotations.json + images/) or YOLO (labels/*.txt +
+images/), e.g. as written by app.utils.synthetic_dataset
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from app.models.buckets import parse_buckets, SHAPE_BUCKETS
+from app.models.yolo_model import YOLOModel, DEFAULT_MODEL_PATH
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# COCO IoU thresholds 0.50:0.05:0.95
+IOU_THRESHOLDS = tuple(round(0.5 + 0.05 * i, 2) for i in range(10))
+
+# Grid axes and how their values are parsed
+GRID_AXES = {
+    "imgsz": int,
+    "buckets": str,
+    "optimize": str,
+    "pooled": lambda value: value.lower() in ("1", "true", "yes", "on"),
+    "conf": float
+}
+
+DEFAULT_CONFIG = {"imgsz": 640, "buckets": "none", "optimize": "eager", "pooled": False, "conf": 0.25}
+
+# One image's ground truth: (n, 4) xyxy boxes and (n,) class ids
+GroundTruth = Tuple["np.ndarray", "np.ndarray"]
+
+
+def load_dataset(dataset_dir: str, limit: Optional[int] = None) -> List[Tuple[str, GroundTruth]]:
+    """
+    Load image paths and ground truth from a COCO or YOLO dataset directory
+
+    Only classes in YOLOModel.CLASS_NAMES are kept.
+
+    Returns:
+        [(image path, (boxes, classes)), ...] sorted by file name
+    """
+    import numpy as np
+
+    images_dir = os.path.join(dataset_dir, "images")
+    coco_path = os.path.join(dataset_dir, "annotations.json")
+    samples = []
+    if os.path.exists(coco_path):
+        with open(coco_path) as f:
+            coco = json.load(f)
+        per_image: Dict[int, List] = {image["id"]: [] for image in coco["images"]}
+        for ann in coco["annotations"]:
+            if ann["category_id"] in YOLOModel.CLASS_NAMES and not ann.get("iscrowd"):
+                x, y, w, h = ann["bbox"]
+                per_image[ann["image_id"]].append((x, y, x + w, y + h, ann["category_id"]))
+        for image in sorted(coco["images"], key=lambda image: image["file_name"]):
+            rows = np.array(per_image[image["id"]], dtype=np.float32).reshape(-1, 5)
+            samples.append((os.path.join(images_dir, image["file_name"]), (rows[:, :4], rows[:, 4].astype(int))))
+    else:
+        from PIL import Image
+
+        labels_dir = os.path.join(dataset_dir, "labels")
+        if not os.path.isdir(labels_dir):
+            raise FileNotFoundError(f"{dataset_dir} has neither annotations.json nor labels/")
+        for file_name in sorted(os.listdir(images_dir)):
+            label_path = os.path.join(labels_dir, os.path.splitext(file_name)[0] + ".txt")
+            rows = np.loadtxt(label_path, dtype=np.float32, ndmin=2).reshape(-1, 5) \
+                if os.path.exists(label_path) else np.zeros((0, 5), np.float32)
+            with Image.open(os.path.join(images_dir, file_name)) as image:
+                width, height = image.size
+            classes = rows[:, 0].astype(int)
+            cx, cy, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+            boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+            keep = np.isin(classes, list(YOLOModel.CLASS_NAMES))
+            samples.append((os.path.join(images_dir, file_name), (boxes[keep], classes[keep])))
+    return samples[:limit] if limit else samples
+
+
+def box_iou(a: "np.ndarray", b: "np.ndarray") -> "np.ndarray":
+    """IoU matrix between (n, 4) and (m, 4) xyxy boxes"""
+    import numpy as np
+
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def match_detections(det_boxes: "np.ndarray", det_scores: "np.ndarray", det_classes: "np.ndarray",
+                     gt_boxes: "np.ndarray", gt_classes: "np.ndarray",
+                     thresholds: Sequence[float] = IOU_THRESHOLDS) -> "np.ndarray":
+    """
+    Mark detections as true positives at each IoU threshold
+
+    Greedy matching as in COCO's evaluation: detections are visited by
+    descending confidence, and each one takes the unmatched same-class
+    ground truth it overlaps most, if that IoU reaches the threshold. All
+    thresholds are matched together, one detection at a time.
+
+    Args:
+        det_boxes: (n, 4) xyxy detection boxes
+        det_scores: (n,) detection confidences
+        det_classes: (n,) detection class ids
+        gt_boxes: (m, 4) xyxy ground-truth boxes
+        gt_classes: (m,) ground-truth class ids
+        thresholds: IoU thresholds
+
+    Returns:
+        (n_detections, n_thresholds) boolean array
+    """
+    import numpy as np
+
+    correct = np.zeros((len(det_boxes), len(thresholds)), dtype=bool)
+    if not len(det_boxes) or not len(gt_boxes):
+        return correct
+    iou = box_iou(det_boxes, gt_boxes)
+    iou[det_classes[:, None] != gt_classes[None, :]] = -1.0
+    minimum = np.asarray(thresholds)[:, None]
+    taken = np.zeros((len(thresholds), len(gt_boxes)), dtype=bool)
+    rows = np.arange(len(thresholds))
+    for d in np.argsort(-det_scores, kind="stable"):
+        candidates = np.where(taken | (iou[d][None, :] < minimum), -1.0, iou[d][None, :])
+        best = candidates.argmax(axis=1)
+        hit = candidates[rows, best] >= 0
+        correct[d] = hit
+        taken[rows[hit], best[hit]] = True
+    return correct
+
+
+def average_precision(scores: "np.ndarray", correct: "np.ndarray", n_gt: int) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    COCO 101-point interpolated AP for one class
+
+    Args:
+        scores: (n,) detection confidences over the whole dataset
+        correct: (n, T) true-positive flags from match_detections
+        n_gt: Ground-truth boxes of the class
+
+    Returns:
+        (AP, recall, precision) per IoU threshold, the last two at the
+        operating point (all detections kept)
+    """
+    import numpy as np
+
+    thresholds = correct.shape[1]
+    if n_gt == 0 or not len(scores):
+        zeros = np.zeros(thresholds)
+        return zeros, zeros, zeros
+    order = np.argsort(-scores, kind="stable")
+    tp = np.cumsum(correct[order], axis=0)
+    fp = np.cumsum(~correct[order], axis=0)
+    recall = tp / n_gt
+    precision = tp / (tp + fp)
+    # Precision envelope, then sample it at recall 0, 0.01, ..., 1
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision, axis=0), axis=0), axis=0)
+    points = np.linspace(0, 1, 101)
+    ap = np.zeros(thresholds)
+    for t in range(thresholds):
+        idx = np.searchsorted(recall[:, t], points, side="left")
+        ap[t] = np.where(idx < len(recall), envelope[np.minimum(idx, len(recall) - 1), t], 0).mean()
+    return ap, recall[-1], precision[-1]
+
+
+def score(predictions: List[Tuple["np.ndarray", "np.ndarray", "np.ndarray"]],
+          ground_truth: List[GroundTruth]) -> Dict[str, Any]:
+    """
+    Per-class and overall accuracy of a set of predictions
+
+    Args:
+        predictions: Per image (boxes, scores, classes)
+        ground_truth: Per image (boxes, classes)
+
+    Returns:
+        map50, map50_95, recall50 and precision50 overall (mean over classes
+        present in the ground truth) and per class name
+    """
+    import numpy as np
+
+    matched = [
+        match_detections(boxes, scores, classes, gt_boxes, gt_classes)
+        for (boxes, scores, classes), (gt_boxes, gt_classes) in zip(predictions, ground_truth)
+    ]
+    all_scores = np.concatenate([scores for _, scores, _ in predictions]) if predictions else np.zeros(0)
+    all_classes = np.concatenate([classes for _, _, classes in predictions]) if predictions else np.zeros(0, int)
+    all_correct = np.concatenate(matched) if matched else np.zeros((0, len(IOU_THRESHOLDS)), bool)
+    gt_classes = np.concatenate([classes for _, classes in ground_truth]) if ground_truth else np.zeros(0, int)
+
+    per_class = {}
+    for class_id, name in YOLOModel.CLASS_NAMES.items():
+        n_gt = int((gt_classes == class_id).sum())
+        mask = all_classes == class_id
+        ap, recall, precision = average_precision(all_scores[mask], all_correct[mask], n_gt)
+        per_class[name] = {
+            "instances": n_gt,
+            "detections": int(mask.sum()),
+            "map50": float(ap[0]),
+            "map50_95": float(ap.mean()),
+            "recall50": float(recall[0]),
+            "precision50": float(precision[0])
+        }
+    present = [metrics for metrics in per_class.values() if metrics["instances"]]
+    overall = {
+        key: float(np.mean([metrics[key] for metrics in present])) if present else 0.0
+        for key in ("map50", "map50_95", "recall50", "precision50")
+    }
+    return {**overall, "per_class": per_class}
+
+
+def parse_grid(items: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    Expand "axis=v1,v2" items into the cartesian product of configurations
+
+    Raises:
+        ValueError: For unknown axes or unparsable values
+    """
+    axes = {}
+    for item in items:
+        axis, _, values = item.partition("=")
+        if axis not in GRID_AXES:
+            raise ValueError(f"Unknown grid axis '{axis}'. Expected one of {sorted(GRID_AXES)}")
+        axes[axis] = [GRID_AXES[axis](value) for value in values.split(",") if value]
+    names = list(axes)
+    return [dict(DEFAULT_CONFIG, **dict(zip(names, combo))) for combo in itertools.product(*axes.values())]
+
+
+def evaluate_config(model_path: str, config: Dict[str, Any], frames: List["np.ndarray"],
+                    ground_truth: List[GroundTruth], warmup: int = 3) -> Dict[str, Any]:
+    """
+    Run one configuration over preloaded frames
+
+    Returns:
+        The configuration with accuracy metrics and latency statistics (ms)
+    """
+    import numpy as np
+
+    buckets = [] if config["buckets"] == "none" else parse_buckets(
+        SHAPE_BUCKETS if config["buckets"] == "default" else config["buckets"]
+    )
+    start = time.perf_counter()
+    model = YOLOModel(model_path, optimize=config["optimize"], imgsz=config["imgsz"],
+                      buckets=buckets, pooled_preprocess=config["pooled"])
+    model.warmup(config["imgsz"])
+    load_ms = (time.perf_counter() - start) * 1000
+    if model.is_fallback:
+        raise RuntimeError(f"Could not load YOLOv8 weights from {model_path}")
+    for frame in frames[:warmup]:
+        model.detect(frame, conf_threshold=config["conf"], render=False)
+
+    predictions, latencies = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        result = model.detect(frame, conf_threshold=config["conf"], render=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+        dets = result["detections"]
+        predictions.append((
+            np.array([[d["bbox"]["x1"], d["bbox"]["y1"], d["bbox"]["x2"], d["bbox"]["y2"]] for d in dets],
+                     dtype=np.float32).reshape(-1, 4),
+            np.array([d["confidence"] for d in dets], dtype=np.float32),
+            np.array([d["class_id"] for d in dets], dtype=int)
+        ))
+
+    return {
+        "config": config,
+        "optimize_applied": model.optimize_applied,
+        "load_ms": load_ms,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50)),
+            "p90": float(np.percentile(latencies, 90)),
+            "p99": float(np.percentile(latencies, 99)),
+            "mean": float(np.mean(latencies))
+        },
+        "images_per_s": len(frames) / (sum(latencies) / 1000),
+        **score(predictions, ground_truth)
+    }
+
+
+def pareto_front(rows: List[Dict[str, Any]], metric: str = "map50_95") -> List[Dict[str, Any]]:
+    """Mark rows no other row beats on both p50 latency and `metric`; returns rows sorted by latency"""
+    rows = sorted(rows, key=lambda row: (row["latency_ms"]["p50"], -row[metric]))
+    best = -1.0
+    for row in rows:
+        row["pareto"] = row[metric] > best
+        best = max(best, row[metric])
+    return rows
+
+
+def evaluate(dataset_dir: str, configs: List[Dict[str, Any]], model_path: str = DEFAULT_MODEL_PATH,
+             limit: Optional[int] = None, metric: str = "map50_95",
+             min_accuracy: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Evaluate every configuration and build the report
+
+    Args:
+        dataset_dir: COCO or YOLO dataset directory
+        configs: Configurations from parse_grid
+        model_path: Weights file
+        limit: Evaluate only the first images
+        metric: Accuracy metric for the Pareto front and the floor
+        min_accuracy: Accuracy floor; the report names the fastest config meeting it
+
+    Returns:
+        Report with dataset info, one row per configuration and the recommendation
+    """
+    import cv2
+
+    samples = load_dataset(dataset_dir, limit)
+    if not samples:
+        raise ValueError(f"No images found in {dataset_dir}")
+    frames = []
+    for path, _ in samples:
+        frame = cv2.imread(path)
+        if frame is None:
+            raise ValueError(f"Could not read image {path}")
+        frames.append(frame)
+    ground_truth = [gt for _, gt in samples]
+
+    rows = []
+    for config in configs:
+        print(f"Evaluating {config}")
+        rows.append(evaluate_config(model_path, config, frames, ground_truth))
+    rows = pareto_front(rows, metric)
+
+    recommended = None
+    if min_accuracy is not None:
+        meeting = [row for row in rows if row[metric] >= min_accuracy]
+        recommended = meeting[0]["config"] if meeting else None
+    return {
+        "dataset": dataset_dir,
+        "images": len(frames),
+        "instances": int(sum(len(classes) for _, classes in ground_truth)),
+        "model": model_path,
+        "metric": metric,
+        "min_accuracy": min_accuracy,
+        "recommended": recommended,
+        "results": rows
+    }
+
+
+def format_table(report: Dict[str, Any]) -> str:
+    """Render the report as a text table, fastest first, Pareto-optimal rows starred"""
+    names = list(YOLOModel.CLASS_NAMES.values())
+    header = (f"  {'imgsz':>5} {'buckets':<20} {'optimize':<11} {'pool':<5} {'conf':>5} "
+              f"{'p50':>7} {'p90':>7} {'p99':>7} {'mAP50':>6} {'mAP':>6} {'R50':>6} "
+              + " ".join(f"{name[:6]:>6}" for name in names))
+    lines = [header]
+    for row in report["results"]:
+        config, latency = row["config"], row["latency_ms"]
+        lines.append(
+            f"{'*' if row['pareto'] else ' '} {config['imgsz']:>5} {config['buckets'][:20]:<20} "
+            f"{row['optimize_applied'] or config['optimize']:<11} {'yes' if config['pooled'] else 'no':<5} "
+            f"{config['conf']:>5.2f} {latency['p50']:>7.1f} {latency['p90']:>7.1f} {latency['p99']:>7.1f} "
+            f"{row['map50']:>6.3f} {row['map50_95']:>6.3f} {row['recall50']:>6.3f} "
+            + " ".join(f"{row['per_class'][name][report['metric']]:>6.3f}" for name in names)
+        )
+    lines.append(f"* Pareto-optimal (latency in ms, per-class columns: {report['metric']})")
+    if report["min_accuracy"] is not None:
+        lines.append(f"Fastest config with {report['metric']} >= {report['min_accuracy']}: {report['recommended']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate speed/accuracy of YOLOModel configurations")
+    parser.add_argument("dataset", help="Dataset directory (COCO annotations.json or YOLO labels/, with images/)")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Weights file")
+    parser.add_argument("--grid", nargs="*", default=[],
+                        help=f"axis=v1,v2 items over {sorted(GRID_AXES)}; buckets takes none, default "
+                             f"or a SHAPE_BUCKETS spec such as 640x384+640x640 (use + between shapes)")
+    parser.add_argument("--limit", type=int, default=None, help="Evaluate only the first N images")
+    parser.add_argument("--metric", default="map50_95", choices=["map50_95", "map50", "recall50"],
+                        help="Accuracy metric for the Pareto front and --min-map")
+    parser.add_argument("--min-map", type=float, default=None, help="Accuracy floor for the recommendation")
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    try:
+        configs = parse_grid(args.grid)
+    except ValueError as e:
+        parser.error(str(e))
+    for config in configs:
+        config["buckets"] = config["buckets"].replace("+", ",")
+    report = evaluate(args.dataset, configs, args.model, args.limit, args.metric, args.min_map)
+
+    print(format_table(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Optimized PyTorch execution paths for YOLOModel
+Fuses Conv+BN and optionally runs a TorchScript-traced or torch.compile'd
+model for a fixed input shape. Compiled artifacts are cached next to the
+weights, keyed by weights fingerprint, torch version and input shape, so
+only the first start pays for compilation
+"""
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+# eager: ultralytics default; fuse: Conv+BN fused at load time;
+# torchscript: traced graph for a fixed shape; compile: torch.compile (inductor)
+OPTIMIZE_MODES = ("eager", "fuse", "torchscript", "compile")
+DEFAULT_MODE = os.environ.get("TORCH_OPTIMIZE", "eager").lower()
+DEFAULT_IMGSZ = int(os.environ.get("OPTIMIZE_IMGSZ", "640"))
+
+ImageSize = Union[int, Tuple[int, int]]
+
+
+def _shape(imgsz: ImageSize) -> Tuple[int, int]:
+    """Normalise an image size to (height, width)"""
+    if isinstance(imgsz, int):
+        return imgsz, imgsz
+    return int(imgsz[0]), int(imgsz[1])
+
+
+def weights_fingerprint(model_path: str) -> str:
+    """Short fingerprint of a weights file (size + modification time)"""
+    stat = os.stat(model_path)
+    return hashlib.sha1(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()[:10]
+
+
+def artifact_path(model_path: str, kind: str, imgsz: ImageSize) -> str:
+    """
+    Cache path for a compiled artifact
+
+    Example: app/models/weights/yolov8n-3f2a9c01de-torchscript-torch2.1.0-640x640.torchscript
+    """
+    import torch
+
+    height, width = _shape(imgsz)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    torch_version = torch.__version__.replace("+", "_")
+    name = (f"{stem}-{weights_fingerprint(model_path)}-{kind}-torch{torch_version}"
+            f"-{height}x{width}.torchscript")
+    return os.path.join(os.path.dirname(model_path) or ".", name)
+
+
+@contextlib.contextmanager
+def export_lock(model_path: str):
+    """
+    Hold an exclusive file lock for exporting from `model_path`
+
+    ultralytics writes every export of a weights file to the same path next to
+    it, whatever the input shape, so workers starting together must take turns.
+    """
+    with open(os.path.splitext(model_path)[0] + ".export.lock", "w") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def fuse_model(yolo) -> None:
+    """Fuse Conv+BN layers of a loaded ultralytics model in place"""
+    module = yolo.model
+    if hasattr(module, "is_fused") and not module.is_fused():
+        module.fuse(verbose=False)
+    module.eval()
+
+
+def load_torchscript(yolo, model_path: str, imgsz: ImageSize, prebuilt: Optional[str] = None):
+    """
+    Return an ultralytics model backed by a TorchScript trace for `imgsz`
+
+    The trace is exported on first use and cached; later starts load it
+    directly. A `prebuilt` trace (e.g. from a model bundle) is used as is.
+    """
+    from ultralytics import YOLO
+
+    if prebuilt:
+        print(f"Using bundled TorchScript model {prebuilt}")
+        return YOLO(prebuilt, task="detect")
+    path = artifact_path(model_path, "torchscript", imgsz)
+    if os.path.exists(path):
+        print(f"Using cached TorchScript model {path}")
+        return YOLO(path, task="detect")
+    with export_lock(model_path):
+        # Another worker may have traced it while we waited for the lock
+        if not os.path.exists(path):
+            print(f"Tracing TorchScript model for input shape {_shape(imgsz)}...")
+            exported = yolo.export(format="torchscript", imgsz=list(_shape(imgsz)), verbose=False)
+            os.replace(exported, path)
+            print(f"Cached TorchScript model at {path}")
+    return YOLO(path, task="detect")
+
+
+def compile_model(yolo, model_path: str, shapes: List[ImageSize], device: str = "cpu") -> None:
+    """
+    torch.compile the model's forward for a fixed set of input shapes
+
+    Inductor's caches are kept in the weights directory (keyed by torch
+    version), so a restart reuses the generated kernels instead of
+    recompiling. Each shape is compiled by a warm-up forward pass below,
+    so failures surface here rather than on the first request.
+    """
+    import torch
+    import torch._dynamo
+
+    cache_dir = os.path.join(
+        os.path.dirname(model_path) or ".",
+        f"inductor-cache-torch{torch.__version__.replace('+', '_')}"
+    )
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    # One static graph per shape; keep all of them instead of falling back to eager
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, len(shapes))
+
+    fuse_model(yolo)
+    module = yolo.model
+    eager_forward = module.forward
+    module.forward = torch.compile(eager_forward, dynamic=False)
+    dtype = next(module.parameters()).dtype
+    try:
+        for shape in shapes:
+            height, width = _shape(shape)
+            dummy = torch.zeros(1, 3, height, width, device=device, dtype=dtype)
+            with torch.inference_mode():
+                module(dummy)
+    except Exception:
+        module.forward = eager_forward
+        raise
+
+
+def optimize_buckets(yolo, model_path: str, mode: str = DEFAULT_MODE,
+                     shapes: Optional[List[ImageSize]] = None,
+                     device: str = "cpu",
+                     engines: Optional[Dict[Tuple[int, int], str]] = None) -> Tuple[Dict[Tuple[int, int], Any], str]:
+    """
+    Apply an optimisation mode to a loaded ultralytics model for each input shape
+
+    eager/fuse/compile share one model across shapes (compile keeps one graph
+    per shape); torchscript needs one trace per shape. Falls back to the
+    eager model for every shape if the optimisation fails.
+
+    Args:
+        yolo: Loaded ultralytics YOLO object
+        model_path: Path of its weights (used for the artifact cache)
+        mode: One of OPTIMIZE_MODES
+        shapes: Input shapes to prepare (default: DEFAULT_IMGSZ)
+        device: Device the model runs on
+        engines: Prebuilt TorchScript traces by (height, width)
+
+    Returns:
+        ({(height, width): model to use}, mode actually applied)
+    """
+    shapes = [_shape(s) for s in (shapes or [DEFAULT_IMGSZ])]
+    eager = {shape: yolo for shape in shapes}
+    mode = (mode or "eager").lower()
+    if mode not in OPTIMIZE_MODES:
+        print(f"Unknown optimisation mode '{mode}', using eager")
+        return eager, "eager"
+    if mode == "eager":
+        return eager, "eager"
+
+    try:
+        if mode == "fuse":
+            fuse_model(yolo)
+            return eager, "fuse"
+        if mode == "torchscript":
+            engines = engines or {}
+            return {
+                shape: load_torchscript(yolo, model_path, shape, engines.get(shape)) for shape in shapes
+            }, "torchscript"
+        compile_model(yolo, model_path, shapes, device)
+        return eager, "compile"
+    except Exception as e:
+        print(f"Model optimisation '{mode}' failed, falling back to eager mode: {e}")
+        return eager, "eager"
+
+
+def optimize_model(yolo, model_path: str, mode: str = DEFAULT_MODE,
+                   imgsz: ImageSize = DEFAULT_IMGSZ, device: str = "cpu") -> Tuple[Any, str]:
+    """
+    Apply an optimisation mode to a loaded ultralytics model for one input shape
+
+    Returns:
+        (model to use, mode actually applied)
+    """
+    models, applied = optimize_buckets(yolo, model_path, mode, [imgsz], device)
+    return models[_shape(imgsz)], applied
+
+
+def benchmark(model_path: str, modes: List[str], imgsz: int = DEFAULT_IMGSZ,
+              runs: int = 20) -> List[Dict]:
+    """
+    Compare inference latency across optimisation modes
+
+    Returns:
+        One row per mode with load time and latency percentiles in milliseconds
+    """
+    import numpy as np
+    from app.models.yolo_model import YOLOModel
+
+    frame = np.random.default_rng(0).integers(0, 255, (imgsz, imgsz, 3), dtype=np.uint8)
+    rows = []
+    for mode in modes:
+        start = time.perf_counter()
+        model = YOLOModel(model_path, optimize=mode, imgsz=imgsz, buckets=[])
+        model.warmup(imgsz)
+        load_ms = (time.perf_counter() - start) * 1000
+        if model.is_fallback:
+            raise RuntimeError(f"Could not load YOLOv8 weights from {model_path}")
+
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            model.predict(frame)
+            samples.append((time.perf_counter() - start) * 1000)
+        rows.append({
+            "mode": mode,
+            "applied": model.optimize_applied,
+            "load_ms": load_ms,
+            "p50_ms": float(np.percentile(samples, 50)),
+            "p95_ms": float(np.percentile(samples, 95)),
+            "mean_ms": float(np.mean(samples))
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark eager vs optimized YOLOv8 inference")
+    parser.add_argument("--model", default="app/models/weights/yolov8n.pt", help="Weights file")
+    parser.add_argument("--modes", nargs="+", default=list(OPTIMIZE_MODES), choices=OPTIMIZE_MODES)
+    parser.add_argument("--imgsz", type=int, default=DEFAULT_IMGSZ, help="Input size")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs per mode")
+
+    args = parser.parse_args()
+    rows = benchmark(args.model, args.modes, args.imgsz, args.runs)
+
+    print(f"{'mode':<12} {'applied':<12} {'load':>9} {'p50':>9} {'p95':>9} {'mean':>9}")
+    for row in rows:
+        print(f"{row['mode']:<12} {row['applied']:<12} {row['load_ms']:>7.0f}ms "
+              f"{row['p50_ms']:>7.1f}ms {row['p95_ms']:>7.1f}ms {row['mean_ms']:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Pooled preprocessing for YOLOModel
+Letterboxing, HWC->CHW transposition, BGR->RGB and /255 normalisation are
+done in place into buffers that are allocated once per shape bucket and
+batch capacity, then reused for every request. The resulting float
+tensor is fed straight to the model, bypassing the per-call allocations of
+the ultralytics predictor. Allocation counters show whether steady state is
+allocation-free
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple, TYPE_CHECKING
+
+from app.models.buckets import PAD_COLOR, Shape
+
+if TYPE_CHECKING:
+    import numpy as np
+    import torch
+
+# Opt-in: PREPROCESS_POOL=1 (requires shape buckets)
+PREPROCESS_POOL = os.environ.get("PREPROCESS_POOL", "0") == "1"
+
+
+class _Buffers:
+    """Preallocated buffers for one shape bucket, up to `capacity` images"""
+
+    def __init__(self, shape: Shape, capacity: int):
+        import numpy as np
+        import torch
+
+        height, width = shape
+        self.shape = shape
+        self.capacity = capacity
+        # Letterboxed uint8 BGR images
+        self.canvas = np.empty((capacity, height, width, 3), dtype=np.uint8)
+        # Normalised float RGB batch, shared with a NumPy view for in-place writes
+        self.tensor = torch.empty((capacity, 3, height, width), dtype=torch.float32)
+        self.array = self.tensor.numpy()
+
+    @property
+    def nbytes(self) -> int:
+        return self.canvas.nbytes + self.array.nbytes
+
+
+class BufferPool:
+    """
+    Preprocessing buffers keyed by shape bucket
+
+    Buffer sets are checked out for the duration of one inference and
+    returned afterwards, so there are only as many per bucket as there are
+    concurrent inferences (INFERENCE_CONCURRENCY), however many threads the
+    server runs them on. A set grows to the largest batch seen and smaller
+    batches use a slice of it, so a steady workload allocates nothing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free: Dict[Shape, List[_Buffers]] = {}
+        self._resident_bytes = 0
+        self.allocations = 0
+        self.allocated_bytes = 0
+        self.batches = 0
+        self.images = 0
+
+    def _checkout(self, shape: Shape, batch: int) -> _Buffers:
+        """Take a free buffer set for `shape`, allocating if none is large enough"""
+        with self._lock:
+            free = self._free.setdefault(shape, [])
+            for index, buffers in enumerate(free):
+                if buffers.capacity >= batch:
+                    return free.pop(index)
+            # Replace the largest too-small set rather than keeping both
+            if free:
+                self._resident_bytes -= free.pop().nbytes
+
+        buffers = _Buffers(shape, batch)
+        with self._lock:
+            self.allocations += 1
+            self.allocated_bytes += buffers.nbytes
+            self._resident_bytes += buffers.nbytes
+        return buffers
+
+    def _checkin(self, buffers: _Buffers):
+        with self._lock:
+            free = self._free.setdefault(buffers.shape, [])
+            free.append(buffers)
+            free.sort(key=lambda b: b.capacity)
+
+    @contextmanager
+    def preprocess(self, frames: List["np.ndarray"], shape: Shape) -> Iterator[Tuple["torch.Tensor", List[Tuple[float, Tuple[int, int]]]]]:
+        """
+        Letterbox BGR frames to `shape` and normalise them into a batch tensor
+
+        The tensor is a view into pooled memory and must only be used inside
+        the with block.
+
+        Args:
+            frames: BGR uint8 images
+            shape: Bucket (height, width)
+
+        Yields:
+            (float32 RGB tensor of shape (len(frames), 3, height, width) in [0, 1],
+             (ratio, (left, top) padding) per frame, as buckets.letterbox returns)
+        """
+        buffers = self._checkout(shape, len(frames))
+        try:
+            boxes = self._fill(buffers, frames)
+            with self._lock:
+                self.batches += 1
+                self.images += len(frames)
+            yield buffers.tensor[:len(frames)], boxes
+        finally:
+            self._checkin(buffers)
+
+    def _fill(self, buffers: _Buffers, frames: List["np.ndarray"]) -> List[Tuple[float, Tuple[int, int]]]:
+        """Letterbox and normalise frames into a buffer set"""
+        import cv2
+        import numpy as np
+
+        height, width = buffers.shape
+        boxes = []
+        for index, frame in enumerate(frames):
+            canvas = buffers.canvas[index]
+            src_h, src_w = frame.shape[:2]
+            ratio = min(height / src_h, width / src_w)
+            new_w, new_h = int(round(src_w * ratio)), int(round(src_h * ratio))
+            dw, dh = (width - new_w) / 2, (height - new_h) / 2
+            top, left = int(round(dh - 0.1)), int(round(dw - 0.1))
+
+            # Resize straight into the canvas region, then repaint the borders
+            roi = canvas[top:top + new_h, left:left + new_w]
+            if (new_w, new_h) == (src_w, src_h):
+                np.copyto(roi, frame)
+            else:
+                cv2.resize(frame, (new_w, new_h), dst=roi, interpolation=cv2.INTER_LINEAR)
+            canvas[:top] = PAD_COLOR
+            canvas[top + new_h:] = PAD_COLOR
+            canvas[top:top + new_h, :left] = PAD_COLOR
+            canvas[top:top + new_h, left + new_w:] = PAD_COLOR
+
+            # BGR HWC uint8 -> RGB CHW float in [0, 1], one channel at a time
+            for channel in range(3):
+                np.multiply(canvas[:, :, 2 - channel], 1 / 255, out=buffers.array[index, channel],
+                            casting="unsafe")
+            boxes.append((ratio, (left, top)))
+        return boxes
+
+    def stats(self) -> Dict:
+        """Allocation counters; allocations should stop growing after warm-up"""
+        with self._lock:
+            return {
+                "enabled": PREPROCESS_POOL,
+                "allocations": self.allocations,
+                "allocated_bytes": self.allocated_bytes,
+                "resident_bytes": self._resident_bytes,
+                "batches": self.batches,
+                "images": self.images,
+                "allocations_per_batch": self.allocations / self.batches if self.batches else 0.0
+            }
+
+
+# Process-wide pool
+buffer_pool = BufferPool()
@@ -0,0 +1,313 @@
+"""
+Model registry for the Object Detection API
+Keeps several named YOLOv8 models, loads them on demand, hot-swaps weights
+without downtime and unloads idle models to stay under a memory cap
+"""
+import gc
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from app.models.bundle import is_bundle, verify_bundle
+from app.models.yolo_model import YOLOModel, DEFAULT_MODEL_PATH
+
+
+class ModelNotFoundError(KeyError):
+    """Raised when a request names a model that is not registered"""
+
+
+class SwapNotAllowed(PermissionError):
+    """Raised when a hot-swap is disabled or names weights outside the swap directory"""
+
+
+# Hot-swap modes: off, replace registered models only, or also register new names
+SWAP_MODES = ("off", "replace", "register")
+
+
+class ModelEntry:
+    """A named model slot in the registry"""
+
+    def __init__(self, name: str, model_path: str, version: Optional[str] = None):
+        self.name = name
+        self.model = YOLOModel(model_path)
+        self.version = version or os.path.basename(model_path)
+        self.last_used = 0.0
+        self.loaded_at: Optional[float] = None
+        self.in_use = 0
+        self.memory_bytes = 0
+        self.load_lock = threading.Lock()
+
+    def info(self) -> Dict:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "model_path": self.model.model_path,
+            "loaded": self.model.is_loaded,
+            "memory_mb": round(self.memory_bytes / (1024 * 1024), 2),
+            "in_use": self.in_use,
+            "last_used": self.last_used or None,
+            "loaded_at": self.loaded_at
+        }
+
+
+class ModelRegistry:
+    """
+    Registry of named YOLOv8 models
+
+    Models are loaded lazily on first use. When the total memory of loaded
+    models exceeds `max_memory_mb`, the least recently used models that are
+    not currently serving a request are unloaded (the default model is kept).
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, str],
+        default: Optional[str] = None,
+        max_memory_mb: Optional[float] = None,
+        swap_mode: str = "off",
+        swap_dir: Optional[str] = None
+    ):
+        """
+        Args:
+            models: Mapping of model name to weights path
+            default: Name of the model used when a request does not pick one
+            max_memory_mb: Cap on the memory of loaded models, None for no cap
+            swap_mode: What swap() may do: "off", "replace" or "register" (see SWAP_MODES)
+            swap_dir: Directory that swapped-in weights and bundles must lie in
+                      (default: the directory of the default weights)
+        """
+        if swap_mode not in SWAP_MODES:
+            raise ValueError(f"Invalid swap mode '{swap_mode}'. Expected one of {', '.join(SWAP_MODES)}")
+        if not models:
+            raise ValueError("At least one model must be registered")
+        self._lock = threading.RLock()
+        self._entries: Dict[str, ModelEntry] = {
+            name: ModelEntry(name, path) for name, path in models.items()
+        }
+        self.default = default or next(iter(models))
+        if self.default not in self._entries:
+            raise ValueError(f"Default model '{self.default}' is not registered")
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024) if max_memory_mb else None
+        self.evictions = 0
+        self.swaps = 0
+        self.swap_mode = swap_mode
+        self.swap_dir = os.path.realpath(swap_dir or os.path.dirname(DEFAULT_MODEL_PATH))
+
+    @classmethod
+    def from_env(cls) -> "ModelRegistry":
+        """
+        Build the registry from environment variables
+
+        - MODEL_REGISTRY: comma-separated `name=path` pairs
+          (default: `yolov8n=app/models/weights/yolov8n.pt`)
+        - DEFAULT_MODEL: name of the default model (default: first entry)
+        - MODEL_MEMORY_LIMIT_MB: memory cap for loaded models
+        - MODEL_SWAP: "off" (default), "replace" to allow hot-swapping registered
+          models, or "register" to also allow adding new model names
+        - MODEL_SWAP_DIR: directory swapped-in weights must be in
+          (default: app/models/weights)
+        """
+        spec = os.environ.get("MODEL_REGISTRY", f"yolov8n={DEFAULT_MODEL_PATH}")
+        models = {}
+        for item in spec.split(","):
+            if not item.strip():
+                continue
+            name, _, path = item.partition("=")
+            models[name.strip()] = path.strip()
+
+        limit = os.environ.get("MODEL_MEMORY_LIMIT_MB")
+        return cls(
+            models,
+            default=os.environ.get("DEFAULT_MODEL") or None,
+            max_memory_mb=float(limit) if limit else None,
+            swap_mode=os.environ.get("MODEL_SWAP", "off").lower(),
+            swap_dir=os.environ.get("MODEL_SWAP_DIR") or None
+        )
+
+    def names(self):
+        return list(self._entries)
+
+    def _entry(self, name: Optional[str]) -> ModelEntry:
+        name = name or self.default
+        try:
+            return self._entries[name]
+        except KeyError:
+            raise ModelNotFoundError(
+                f"Unknown model '{name}'. Available models: {', '.join(self._entries)}"
+            ) from None
+
+    def get(self, name: Optional[str] = None) -> YOLOModel:
+        """Return the current model instance for `name` without forcing a load"""
+        return self._entry(name).model
+
+    def version(self, name: Optional[str] = None) -> str:
+        return self._entry(name).version
+
+    @contextmanager
+    def acquire(self, name: Optional[str] = None) -> Iterator[YOLOModel]:
+        """
+        Load (if needed) and hold a model for the duration of an inference
+
+        A held model is never unloaded. If the model is hot-swapped while held,
+        the caller keeps using the previous version until it releases it.
+        """
+        entry = self._entry(name)
+        with self._lock:
+            entry.in_use += 1
+            entry.last_used = time.time()
+            model = entry.model
+        try:
+            if not model.is_loaded:
+                with entry.load_lock:
+                    if not model.is_loaded:
+                        model.model  # Trigger lazy loading
+                        self._account(entry, model)
+            yield model
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.time()
+
+    def verify_bundles(self):
+        """
+        Check the files of every registered model bundle against its manifest
+
+        Raises:
+            BundleError: For the first missing or corrupted bundle
+        """
+        for entry in list(self._entries.values()):
+            if is_bundle(entry.model.model_path):
+                verify_bundle(entry.model.model_path)
+
+    def warmup(self, name: Optional[str] = None):
+        """Load a model and run a warm-up inference (e.g. at worker startup)"""
+        with self.acquire(name) as model:
+            model.warmup()
+
+    def _account(self, entry: ModelEntry, model: YOLOModel):
+        """Record memory of a freshly loaded model and enforce the memory cap"""
+        with self._lock:
+            if entry.model is model:
+                entry.memory_bytes = model.memory_bytes()
+                entry.loaded_at = time.time()
+            self._enforce_memory_limit(keep=entry.name)
+
+    def total_memory_bytes(self) -> int:
+        with self._lock:
+            return sum(e.memory_bytes for e in self._entries.values() if e.model.is_loaded)
+
+    def _enforce_memory_limit(self, keep: Optional[str] = None):
+        if self.max_memory_bytes is None:
+            return
+        # Least recently used first
+        candidates = sorted(
+            (e for e in self._entries.values()
+             if e.model.is_loaded and e.in_use == 0
+             and e.name not in (keep, self.default)),
+            key=lambda e: e.last_used
+        )
+        for entry in candidates:
+            if self.total_memory_bytes() <= self.max_memory_bytes:
+                break
+            print(f"Unloading idle model '{entry.name}' to stay under the memory limit")
+            self._unload(entry)
+            self.evictions += 1
+
+    def _unload(self, entry: ModelEntry):
+        entry.model = YOLOModel(entry.model.model_path)
+        entry.memory_bytes = 0
+        entry.loaded_at = None
+        gc.collect()
+        try:
+            # Only touch torch if it has already been imported by a loaded model
+            torch = sys.modules.get("torch")
+            if torch is not None and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except Exception as e:
+            print(f"Could not release CUDA cache: {e}")
+
+    def unload(self, name: str) -> bool:
+        """Unload a model now. Returns False if it is currently serving requests."""
+        with self._lock:
+            entry = self._entry(name)
+            if entry.in_use:
+                return False
+            self._unload(entry)
+            return True
+
+    def swap(self, name: str, model_path: str, version: Optional[str] = None) -> Dict:
+        """
+        Atomically replace (or add) a model with new weights
+
+        The new weights are loaded and warmed up before cut-over, so requests
+        keep being served by the old version until the new one is ready.
+
+        Args:
+            name: Model name to replace or register
+            model_path: Path to the new weights file
+            version: Version label, defaults to the weights file name
+
+        Returns:
+            Info about the model after the swap
+
+        Raises:
+            SwapNotAllowed: If swapping is off, the name is new and registering is
+                            not allowed, or the weights resolve outside swap_dir
+            FileNotFoundError: If the weights do not exist
+            BundleError: If a bundle fails verification
+        """
+        if self.swap_mode == "off":
+            raise SwapNotAllowed("Model hot-swap is disabled (set MODEL_SWAP=replace or register)")
+        if self.swap_mode != "register" and name not in self._entries:
+            raise SwapNotAllowed(f"Unknown model '{name}' and registering new models is disabled")
+        # Weights are unpickled when loaded, so only trusted files may be swapped in
+        resolved = os.path.realpath(model_path)
+        if os.path.commonpath([resolved, self.swap_dir]) != self.swap_dir:
+            raise SwapNotAllowed(f"Weights must be inside {self.swap_dir}")
+        if not os.path.exists(resolved):
+            raise FileNotFoundError(f"Weights file not found: {model_path}")
+        if is_bundle(resolved):
+            verify_bundle(resolved)
+        model_path = resolved
+
+        candidate = YOLOModel(model_path)
+        candidate.warmup()
+        if candidate.is_fallback:
+            raise RuntimeError(f"Could not load YOLOv8 weights from {model_path}")
+
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = ModelEntry(name, model_path, version)
+                self._entries[name] = entry
+            entry.model = candidate
+            entry.version = version or os.path.basename(model_path)
+            entry.memory_bytes = candidate.memory_bytes()
+            entry.loaded_at = time.time()
+            entry.last_used = time.time()
+            self.swaps += 1
+            self._enforce_memory_limit(keep=name)
+            print(f"Model '{name}' now serving version {entry.version}")
+            return entry.info()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "default": self.default,
+                "total_memory_mb": round(self.total_memory_bytes() / (1024 * 1024), 2),
+                "memory_limit_mb": (
+                    round(self.max_memory_bytes / (1024 * 1024), 2)
+                    if self.max_memory_bytes else None
+                ),
+                "evictions": self.evictions,
+                "swaps": self.swaps,
+                "swap_mode": self.swap_mode,
+                "models": [e.info() for e in self._entries.values()]
+            }
+
+
+# Shared registry (models are loaded lazily on first detection)
+registry = ModelRegistry.from_env()
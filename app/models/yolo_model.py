@@ -2,33 +2,75 @@ import os
 import time
 import uuid
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Tuple, Union, TYPE_CHECKING
 import sys
 
-import torch
-import numpy as np
-from PIL import Image
-from ultralytics import YOLO
+from app.models.bundle import BundleError, is_bundle, load_bundle
+from app.models.buckets import (
+    bucket_shapes, group_by_bucket, letterbox, load_bgr, parse_buckets, scale_buckets, scale_side,
+    unletterbox_detections
+)
+from app.models.preprocess import PREPROCESS_POOL
+
+# torch, ultralytics, OpenCV and PIL are imported on first use so that
+# importing this module (and the API that wraps it) stays cheap. Health
+# checks and freshly spawned workers should not pay for inference imports.
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+
+class _MinimalDetector:
+    """Minimal stand-in used when SimpleDetector itself cannot be imported"""
+
+    def __init__(self):
+        print("Using minimal fallback detector")
+        self.classes = {0: "person", 2: "car", 5: "bus", 7: "truck"}
+
+    def detect(self, image, conf_threshold=0.25, classes=None, render=True, **render_options):
+        from PIL import Image
+
+        print("Simple fallback detection - no actual detection performed")
+        if not render:
+            return {"detections": [], "image_path": None}
+        result_filename = f"{uuid.uuid4()}_fallback.jpg"
+        result_path = f"app/static/results/{result_filename}"
+
+        if isinstance(image, Image.Image):
+            image.save(result_path)
+
+        return {"detections": [], "image_path": result_path}
+
+
+_simple_detector_cls = None
+
+
+def _simple_detector_class():
+    """Import our simple detector fallback on first use (it pulls in OpenCV)"""
+    global _simple_detector_cls
+    if _simple_detector_cls is None:
+        try:
+            from app.utils.simple_detector import SimpleDetector
+            _simple_detector_cls = SimpleDetector
+        except ImportError:
+            # Use a simplified version if the import fails
+            _simple_detector_cls = _MinimalDetector
+    return _simple_detector_cls
+
+
+def _new_simple_detector():
+    """Create the fallback detector, importing it lazily"""
+    return _simple_detector_class()()
 
-# Import our simple detector fallback
-try:
-    from app.utils.simple_detector import SimpleDetector
-except ImportError:
-    # Define a simplified version if the import fails
-    class SimpleDetector:
-        def __init__(self):
-            print("Using minimal fallback detector")
-            self.classes = {0: "person", 2: "car", 5: "bus", 7: "truck"}
-        
-        def detect(self, image, conf_threshold=0.25, classes=None):
-            print("Simple fallback detection - no actual detection performed")
-            result_filename = f"{uuid.uuid4()}_fallback.jpg"
-            result_path = f"app/static/results/{result_filename}"
-            
-            if isinstance(image, Image.Image):
-                image.save(result_path)
-            
-            return {"detections": [], "image_path": result_path}
+
+DEFAULT_MODEL_PATH = "app/models/weights/yolov8n.pt"
+
+# Maximum number of images per forward pass in detect_batch
+BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", "8"))
+
+# Non-maximum suppression settings (ultralytics predictor defaults)
+NMS_IOU = 0.7
+MAX_DETECTIONS = 300
 
 
 class YOLOModel:
@@ -42,24 +84,72 @@ class YOLOModel:
         7: "truck"         # Vehicle
     }
     
-    def __init__(self):
-        """Initialize the model (lazy loading)"""
-        self._model = None
+    def __init__(
+        self,
+        model_path: Optional[str] = None,
+        optimize: Optional[str] = None,
+        imgsz: Optional[int] = None,
+        buckets: Optional[List[Tuple[int, int]]] = None,
+        pooled_preprocess: Optional[bool] = None
+    ):
+        """
+        Initialize the model (lazy loading)
         
-        # Safely determine device
-        try:
-            import torch
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        except Exception as e:
-            print(f"Error importing torch or checking CUDA: {e}")
-            self.device = "cpu"  # Fall back to CPU if there's any issue
+        Args:
+            model_path: Path to the YOLOv8 weights file. If the file does not exist,
+                        the weights with the same file name are downloaded on first use.
+                        A model bundle directory (see app.models.bundle) is loaded
+                        offline instead, and raises BundleError if it is unusable.
+            optimize: Execution mode: eager, fuse, torchscript or compile
+                      (default from TORCH_OPTIMIZE, see app.models.optimize)
+            imgsz: Fixed inference size; required for torchscript/compile
+                   (default from OPTIMIZE_IMGSZ for those modes). Ignored by
+                   detect when shape buckets are enabled
+            buckets: Landscape (height, width) shape buckets for rectangular
+                     inference (default from SHAPE_BUCKETS, [] to disable)
+            pooled_preprocess: Preprocess bucketed inputs into reused buffers and
+                               call the network directly (default from PREPROCESS_POOL)
+        """
+        self._model = None
+        self._device = None
+        self._torch_prepared = False
             
-        self.model_path = "app/models/weights/yolov8n.pt"
+        self.model_path = model_path or DEFAULT_MODEL_PATH
+        self.optimize = (optimize or os.environ.get("TORCH_OPTIMIZE", "eager")).lower()
+        self.optimize_applied = None
+        self.imgsz = imgsz
+        if self.imgsz is None and self.optimize in ("torchscript", "compile"):
+            self.imgsz = int(os.environ.get("OPTIMIZE_IMGSZ", "640"))
+        self.buckets = parse_buckets() if buckets is None else list(buckets)
+        # (height, width) -> model prepared for that input shape
+        self._bucket_models: Dict[Tuple[int, int], Any] = {}
+        # Prebuilt TorchScript traces shipped in a model bundle
+        self._engines: Dict[Tuple[int, int], str] = {}
+        self.pooled_preprocess = PREPROCESS_POOL if pooled_preprocess is None else pooled_preprocess
         
         # Create directories if they don't exist
         os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
         os.makedirs("app/static/results", exist_ok=True)
         os.makedirs("app/static/uploads", exist_ok=True)
+    
+    @property
+    def device(self):
+        """Inference device, resolved on first access (importing torch)"""
+        if self._device is None:
+            # Safely determine device
+            try:
+                import torch
+                self._device = "cuda" if torch.cuda.is_available() else "cpu"
+            except Exception as e:
+                print(f"Error importing torch or checking CUDA: {e}")
+                self._device = "cpu"  # Fall back to CPU if there's any issue
+        return self._device
+    
+    def _prepare_torch(self):
+        """One-time torch setup, deferred until the model is actually loaded"""
+        if self._torch_prepared:
+            return
+        self._torch_prepared = True
         
         # Fix for PyTorch 2.6+ security changes
         try:
@@ -75,16 +165,149 @@ class YOLOModel:
                     print("Could not import DetectionModel, using weights_only=False fallback")
         except Exception as e:
             print(f"Could not configure torch serialization safety: {e}")
+        
+        # Thread counts and CPU pinning must be set before torch spins up its pools
+        if self.device == "cpu":
+            try:
+                from app.utils.cpu_config import apply_cpu_config
+                config = apply_cpu_config()
+                print(f"CPU config: {config['effective_threads']} intra-op threads, "
+                      f"CPUs {config['pinned_cpus'] or 'unpinned'}")
+            except Exception as e:
+                print(f"Could not apply CPU configuration: {e}")
+    
+    def _optimize_loaded_model(self):
+        """Apply execution optimisations to a freshly loaded YOLOv8 model"""
+        if self.is_fallback:
+            return
+        
+        if self.device == "cpu" and self.optimize != "torchscript":
+            try:
+                from app.utils.cpu_config import applied_config
+                config = applied_config()
+                if config and config.get("channels_last"):
+                    import torch
+                    # Fuse Conv+BN first: fusing reshapes weights with .view(),
+                    # which fails on channels-last tensors
+                    self._model.model.fuse(verbose=False)
+                    self._model.model.to(memory_format=torch.channels_last)
+                    print("Converted model to channels-last memory format")
+            except Exception as e:
+                print(f"Could not convert model to channels-last: {e}")
+        
+        # Conv+BN fusion, TorchScript trace or torch.compile (cached per shape),
+        # prepared for every bucket shape so no request pays for compilation
+        from app.models.optimize import optimize_buckets
+        shapes = bucket_shapes(self.buckets) if self.buckets else [self.imgsz or 640]
+        models, self.optimize_applied = optimize_buckets(
+            self._model, self.model_path, self.optimize, shapes, self.device, self._engines
+        )
+        if self.buckets:
+            self._bucket_models = models
+        # The largest shape (square) serves unbucketed calls
+        self._model = list(models.values())[-1]
+    
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the underlying model has been loaded yet"""
+        return self._model is not None
+    
+    @property
+    def is_fallback(self) -> bool:
+        """Whether loading failed and the SimpleDetector fallback is in use"""
+        return self._model is not None and isinstance(self._model, _simple_detector_class())
+    
+    @property
+    def dynamic_shapes(self) -> bool:
+        """Whether the loaded network accepts input shapes it was not prepared for"""
+        # TorchScript traces are fixed-shape and torch.compile would recompile
+        return self.optimize_applied in (None, "eager", "fuse")
+    
+    def _input_shapes(self, input_scale: float) -> Tuple[List[Tuple[int, int]], Optional[int]]:
+        """
+        Shape buckets and square input size for a call at `input_scale`
+        
+        Returns the configured shapes when the scale is 1 or the network is fixed-shape.
+        """
+        if input_scale >= 1.0 or not self.dynamic_shapes:
+            return self.buckets, self.imgsz
+        return scale_buckets(self.buckets, input_scale), scale_side(self.imgsz or 640, input_scale)
+    
+    def memory_bytes(self) -> int:
+        """
+        Approximate memory held by the loaded model
+        
+        Returns:
+            Bytes used by parameters and buffers, the weights file size if the
+            model is not a torch module, or 0 when nothing is loaded
+        """
+        if self._model is None or self.is_fallback:
+            return 0
+        try:
+            module = self._model.model
+            tensors = list(module.parameters()) + list(module.buffers())
+            return sum(t.numel() * t.element_size() for t in tensors)
+        except Exception:
+            if os.path.exists(self.model_path):
+                return os.path.getsize(self.model_path)
+            return 0
+    
+    def warmup(self, imgsz: int = 640):
+        """
+        Load the model and run one dummy inference so the first real request
+        does not pay for lazy initialisation (CUDA context, kernel selection...)
+        
+        Args:
+            imgsz: Side length of the blank warm-up image (each bucket shape
+                   is warmed instead when shape buckets are enabled)
+        """
+        self.model  # Trigger lazy loading
+        if self.is_fallback:
+            return
+        import numpy as np
+        if self._bucket_models:
+            for height, width in self._bucket_models:
+                self.predict(np.zeros((height, width, 3), dtype=np.uint8), bucket=(height, width))
+        else:
+            self.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8))
+    
+    def predict(self, image, bucket: Optional[Tuple[int, int]] = None, **kwargs):
+        """
+        Run the underlying ultralytics model under torch.inference_mode
+        
+        Args:
+            image: Image(s) accepted by ultralytics
+            bucket: (height, width) input shape; selects the model prepared for it
+            **kwargs: Prediction arguments (conf, classes, imgsz...)
+        
+        Returns:
+            List of ultralytics Results
+        """
+        import torch
+        model = self.model
+        if bucket is not None:
+            model = self._bucket_models.get(bucket, model)
+            kwargs["imgsz"] = list(bucket)
+        elif self.imgsz and "imgsz" not in kwargs:
+            kwargs["imgsz"] = self.imgsz
+        kwargs.setdefault("verbose", False)
+        with torch.inference_mode():
+            return model(image, **kwargs)
     
     @property
     def model(self):
         """Lazy load the model only when needed"""
         if self._model is None:
+            self._prepare_torch()
             print(f"Loading YOLOv8 model on {self.device}...")
             
+            if is_bundle(self.model_path):
+                # Verified, memory-mapped and offline; a bad bundle is a deployment
+                # error, so there is no download and no SimpleDetector fallback
+                self._model, self._engines = load_bundle(self.model_path, self.device)
             # Check if model file exists, if not download it
-            if not os.path.exists(self.model_path):
-                print("Downloading YOLOv8n model...")
+            elif not os.path.exists(self.model_path):
+                print(f"Downloading {os.path.basename(self.model_path)} model...")
                 try:
                     # Make sure torch is available
                     try:
@@ -93,7 +316,7 @@ class YOLOModel:
                     except ImportError as e:
                         print(f"Error importing torch: {e}")
                         print("Using SimpleDetector fallback")
-                        self._model = SimpleDetector()
+                        self._model = _new_simple_detector()
                         return self._model
                         
                     # Try to load with proper safe globals
@@ -115,10 +338,10 @@ class YOLOModel:
                             # Try to load the model
                             try:
                                 from ultralytics import YOLO
-                                self._model = YOLO("yolov8n.pt")
+                                self._model = YOLO(os.path.basename(self.model_path))
                             except ImportError as e:
                                 print(f"Error importing YOLO: {e}")
-                                self._model = SimpleDetector()
+                                self._model = _new_simple_detector()
                                 return self._model
                             
                             # Restore original torch.load
@@ -127,20 +350,20 @@ class YOLOModel:
                             # Older torch version doesn't have this parameter
                             try:
                                 from ultralytics import YOLO
-                                self._model = YOLO("yolov8n.pt")
+                                self._model = YOLO(os.path.basename(self.model_path))
                             except ImportError as e:
                                 print(f"Error importing YOLO: {e}")
-                                self._model = SimpleDetector()
+                                self._model = _new_simple_detector()
                                 return self._model
                     except Exception as e:
                         print(f"Error with weights_only workaround: {e}")
                         # Try normal loading
                         try:
                             from ultralytics import YOLO
-                            self._model = YOLO("yolov8n.pt")
+                            self._model = YOLO(os.path.basename(self.model_path))
                         except ImportError as e:
                             print(f"Error importing YOLO: {e}")
-                            self._model = SimpleDetector()
+                            self._model = _new_simple_detector()
                             return self._model
                 except Exception as e:
                     print(f"Error loading model with default settings: {e}")
@@ -149,13 +372,13 @@ class YOLOModel:
                     try:
                         # Try to load with a direct YOLO class
                         from ultralytics.models.yolo.model import YOLO as YOLO_Alternative
-                        self._model = YOLO_Alternative("yolov8n.pt")
+                        self._model = YOLO_Alternative(os.path.basename(self.model_path))
                     except Exception as e2:
                         print(f"Alternative method also failed: {e2}")
                         
                         # If all else fails, use a SimpleDetector
                         print("Using fallback detection mode")
-                        self._model = SimpleDetector()
+                        self._model = _new_simple_detector()
                 
                 # Try to save the model if it was loaded successfully
                 try:
@@ -180,7 +403,7 @@ class YOLOModel:
                     except ImportError as e:
                         print(f"Error importing torch: {e}")
                         print("Using SimpleDetector fallback")
-                        self._model = SimpleDetector()
+                        self._model = _new_simple_detector()
                         return self._model
                     
                     # Try with weights_only=False if needed
@@ -204,7 +427,7 @@ class YOLOModel:
                                 self._model = YOLO(self.model_path)
                             except ImportError as e:
                                 print(f"Error importing YOLO: {e}")
-                                self._model = SimpleDetector()
+                                self._model = _new_simple_detector()
                                 return self._model
                             
                             # Restore original torch.load
@@ -215,7 +438,7 @@ class YOLOModel:
                                 self._model = YOLO(self.model_path)
                             except ImportError as e:
                                 print(f"Error importing YOLO: {e}")
-                                self._model = SimpleDetector()
+                                self._model = _new_simple_detector()
                                 return self._model
                     except Exception as e:
                         print(f"Error with weights_only workaround for saved model: {e}")
@@ -225,21 +448,27 @@ class YOLOModel:
                             self._model = YOLO(self.model_path)
                         except ImportError as e:
                             print(f"Error importing YOLO: {e}")
-                            self._model = SimpleDetector()
+                            self._model = _new_simple_detector()
                             return self._model
                 except Exception as e:
                     print(f"Error loading saved model: {e}")
                     print("Using SimpleDetector fallback")
-                    self._model = SimpleDetector()
+                    self._model = _new_simple_detector()
                 
+            self._optimize_loaded_model()
             print("Model loaded successfully")
         return self._model
     
     def detect(
         self, 
-        image: Union[str, np.ndarray, Image.Image],
+        image: Union[str, "np.ndarray", "Image.Image"],
         conf_threshold: float = 0.25,
-        classes: Optional[List[int]] = None
+        classes: Optional[List[int]] = None,
+        result_format: Optional[str] = None,
+        result_quality: Optional[int] = None,
+        preview_width: Optional[int] = None,
+        render: bool = True,
+        input_scale: float = 1.0
     ) -> Dict[str, Any]:
         """
         Perform object detection on an image
@@ -248,20 +477,24 @@ class YOLOModel:
             image: Input image (file path, numpy array, or PIL Image)
             conf_threshold: Confidence threshold (0-1)
             classes: List of class IDs to detect, if None detect all supported classes
+            result_format: Annotated image format, "jpeg" or "webp" (default from RESULT_FORMAT)
+            result_quality: Annotated image encoder quality (default from RESULT_QUALITY)
+            preview_width: Downscale the annotated image to this width
+            render: Whether to draw and save the annotated image ("image_path" is None if not)
+            input_scale: Run the network at this fraction of the configured input size
+                         (shape buckets are scaled alike); ignored by fixed-shape
+                         torchscript/compile models
         
         Returns:
             Dictionary with detection results
         """
+        render_options = {
+            "fmt": result_format,
+            "quality": result_quality,
+            "preview_width": preview_width
+        }
         try:
-            # Filter classes to only include people and vehicles if not specified
-            if classes is None:
-                classes = list(self.CLASS_NAMES.keys())
-            else:
-                # Make sure classes is a list of integers
-                classes = [int(c) for c in classes if int(c) in self.CLASS_NAMES]
-                if not classes:
-                    print("Warning: No valid classes specified, using all supported classes")
-                    classes = list(self.CLASS_NAMES.keys())
+            classes = self._resolve_classes(classes)
             
             print(f"Running detection with confidence threshold: {conf_threshold}, classes: {classes}")
             
@@ -269,84 +502,267 @@ class YOLOModel:
             if self._model is None:
                 try:
                     self._model = self.model
+                except BundleError:
+                    raise
                 except Exception as e:
                     print(f"Error loading model: {e}")
-                    self._model = SimpleDetector()
+                    self._model = _new_simple_detector()
             
             # Run inference
-            if isinstance(self._model, SimpleDetector):
+            if isinstance(self._model, _simple_detector_class()):
                 # Use the simple detector
-                results = self._model.detect(image, conf_threshold, classes)
+                results = self._model.detect(image, conf_threshold, classes, render=render, **render_options)
                 return results
             else:
                 # Use the YOLOv8 model
                 try:
-                    results = self.model(
-                        image, 
-                        conf=conf_threshold,
-                        classes=classes,
-                        verbose=False
-                    )
+                    buckets, imgsz = self._input_shapes(input_scale)
+                    if buckets:
+                        # Rectangular inference at the image's shape bucket
+                        canvas = load_bgr(image)
+                        detections = self._detect_bucketed([canvas], conf_threshold, classes, buckets)[0]
+                    else:
+                        results = self.predict(
+                            image, 
+                            conf=conf_threshold,
+                            classes=classes,
+                            **({"imgsz": imgsz} if imgsz else {})
+                        )
+                        canvas = results[0].orig_img
+                        detections = self._extract_detections(results[0])
                 except Exception as e:
                     print(f"YOLOv8 inference failed: {e}")
                     print("Falling back to SimpleDetector")
-                    simple_detector = SimpleDetector()
-                    return simple_detector.detect(image, conf_threshold, classes)
+                    simple_detector = _new_simple_detector()
+                    return simple_detector.detect(image, conf_threshold, classes, render=render, **render_options)
                 
-                # Process results
-                result = results[0]  # Get first image result
-                
-                # Create a unique filename for the result
-                result_filename = f"{uuid.uuid4()}.jpg"
-                result_path = f"app/static/results/{result_filename}"
-                
-                # Save the result image with bounding boxes
-                if hasattr(result, "plot"):
-                    result_img = result.plot()
-                    Image.fromarray(result_img).save(result_path)
+                result_path = None
+                if render:
+                    # Draw only the returned detections onto the decoded BGR frame
+                    from app.utils.render import render_result
+                    if canvas is image:
+                        # Never draw on an array owned by the caller
+                        canvas = canvas.copy()
+                    result_path = render_result(canvas, detections, **render_options)
                     print(f"Result image saved to {result_path}")
-                else:
-                    print("Warning: Could not plot detection results")
-                
-                # Extract detections in a simplified format
-                detections = []
-                if hasattr(result, "boxes"):
-                    for box in result.boxes:
-                        x1, y1, x2, y2 = box.xyxy[0].tolist()
-                        conf = float(box.conf[0])
-                        class_id = int(box.cls[0])
-                        
-                        # Only include classes we're interested in
-                        if class_id in self.CLASS_NAMES:
-                            detections.append({
-                                "class_id": class_id,
-                                "class_name": self.CLASS_NAMES.get(class_id, "unknown"),
-                                "confidence": conf,
-                                "bbox": {
-                                    "x1": float(x1),
-                                    "y1": float(y1),
-                                    "x2": float(x2),
-                                    "y2": float(y2),
-                                    "width": float(x2 - x1),
-                                    "height": float(y2 - y1)
-                                }
-                            })
             
                 print(f"Detection completed with {len(detections)} objects found")
                 return {
                     "detections": detections,
                     "image_path": result_path
                 }
+        except BundleError:
+            raise
         except Exception as e:
             import traceback
             print(f"Error in YOLO detection: {str(e)}")
             print(traceback.format_exc())
             
             # Return fallback simple detection if the main model fails
-            return self._generate_fallback_response(image, classes)
+            return self._generate_fallback_response(image, classes, render)
+    
+    def detect_batch(
+        self,
+        images: List[Union[str, "np.ndarray", "Image.Image"]],
+        conf_threshold: float = 0.25,
+        classes: Optional[List[int]] = None,
+        result_format: Optional[str] = None,
+        result_quality: Optional[int] = None,
+        preview_width: Optional[int] = None,
+        render: bool = True,
+        input_scale: float = 1.0
+    ) -> List[Dict[str, Any]]:
+        """
+        Perform object detection on several images with batched inference
+        
+        Images are grouped by shape bucket so each forward pass runs on a
+        batch of identically shaped inputs (at most BATCH_SIZE images).
+        
+        Args:
+            images: Input images (file paths, numpy arrays, or PIL Images)
+            conf_threshold, classes, result_format, result_quality, preview_width, render,
+            input_scale: As for detect
+        
+        Returns:
+            One detection result dictionary per image, in input order
+        """
+        render_options = {
+            "fmt": result_format,
+            "quality": result_quality,
+            "preview_width": preview_width
+        }
+        classes = self._resolve_classes(classes)
+        model = self.model
+        if self.is_fallback:
+            return [model.detect(image, conf_threshold, classes, render=render, **render_options) for image in images]
+        
+        frames = [load_bgr(image) for image in images]
+        buckets, imgsz = self._input_shapes(input_scale)
+        if buckets:
+            all_detections = self._detect_bucketed(frames, conf_threshold, classes, buckets)
+        else:
+            size = {"imgsz": imgsz} if imgsz else {}
+            all_detections = []
+            for start in range(0, len(frames), BATCH_SIZE):
+                results = self.predict(frames[start:start + BATCH_SIZE], conf=conf_threshold, classes=classes, **size)
+                all_detections.extend(self._extract_detections(result) for result in results)
+        
+        from app.utils.render import render_result
+        outputs = []
+        for image, frame, detections in zip(images, frames, all_detections):
+            result_path = None
+            if render:
+                # Never draw on an array owned by the caller
+                canvas = frame.copy() if frame is image else frame
+                result_path = render_result(canvas, detections, **render_options)
+            outputs.append({"detections": detections, "image_path": result_path})
+        print(f"Batch detection completed for {len(images)} images")
+        return outputs
+    
+    def _detect_bucketed(
+        self,
+        frames: List["np.ndarray"],
+        conf_threshold: float,
+        classes: List[int],
+        buckets: Optional[List[Tuple[int, int]]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Run rectangular inference on BGR frames, batched per shape bucket
+        
+        Each frame is letterboxed to exactly its bucket shape, so every batch
+        has one fixed input shape, and boxes are mapped back to the frame.
+        
+        Args:
+            buckets: Buckets to use instead of the configured ones
+        
+        Returns:
+            Detections for each frame, in input order
+        """
+        sizes = [(frame.shape[1], frame.shape[0]) for frame in frames]
+        all_detections: List[List[Dict[str, Any]]] = [[] for _ in frames]
+        for bucket, indices in group_by_bucket(sizes, buckets or self.buckets).items():
+            for start in range(0, len(indices), BATCH_SIZE):
+                chunk = indices[start:start + BATCH_SIZE]
+                if self.pooled_preprocess:
+                    outputs = self._infer_pooled([frames[i] for i in chunk], bucket, conf_threshold, classes)
+                else:
+                    boxed = [letterbox(frames[i], bucket) for i in chunk]
+                    results = self.predict(
+                        [padded for padded, _, _ in boxed],
+                        bucket=bucket,
+                        conf=conf_threshold,
+                        classes=classes
+                    )
+                    outputs = [
+                        (self._extract_detections(result), ratio, pad)
+                        for (_, ratio, pad), result in zip(boxed, results)
+                    ]
+                for i, (detections, ratio, pad) in zip(chunk, outputs):
+                    width, height = sizes[i]
+                    all_detections[i] = unletterbox_detections(detections, ratio, pad, width, height)
+        return all_detections
+    
+    def _infer_pooled(
+        self,
+        frames: List["np.ndarray"],
+        bucket: Tuple[int, int],
+        conf_threshold: float,
+        classes: List[int]
+    ) -> List[Tuple[List[Dict[str, Any]], float, Tuple[int, int]]]:
+        """
+        Run one batch through the network using pooled preprocessing buffers
+        
+        Skips the ultralytics predictor's preprocessing; only the network
+        (through the predictor's backend, so TorchScript works too) and NMS run.
+        
+        Returns:
+            (detections in letterboxed coordinates, ratio, pad) per frame
+        """
+        import torch
+        from ultralytics.utils.ops import non_max_suppression
+        from app.models.preprocess import buffer_pool
+        
+        model = self._bucket_models.get(bucket, self.model)
+        if model.predictor is None:
+            # The predictor builds the inference backend on its first call
+            import numpy as np
+            self.predict(np.zeros((bucket[0], bucket[1], 3), dtype=np.uint8), bucket=bucket)
+        backend = model.predictor.model
+        
+        with buffer_pool.preprocess(frames, bucket) as (batch, boxes), torch.inference_mode():
+            preds = backend(batch.to(backend.device))
+            preds = non_max_suppression(
+                preds, conf_threshold, NMS_IOU, classes=classes, max_det=MAX_DETECTIONS
+            )
+        return [
+            (self._to_detections(pred[:, :4], pred[:, 4], pred[:, 5]), ratio, pad)
+            for pred, (ratio, pad) in zip(preds, boxes)
+        ]
+    
+    def _resolve_classes(self, classes: Optional[List[int]]) -> List[int]:
+        """Filter classes to only include people and vehicles if not specified"""
+        if classes is None:
+            return list(self.CLASS_NAMES.keys())
+        # Make sure classes is a list of integers
+        classes = [int(c) for c in classes if int(c) in self.CLASS_NAMES]
+        if not classes:
+            print("Warning: No valid classes specified, using all supported classes")
+            classes = list(self.CLASS_NAMES.keys())
+        return classes
+    
+    def _extract_detections(self, result) -> List[Dict[str, Any]]:
+        """
+        Convert an ultralytics result to our simplified detection format
+        
+        Args:
+            result: A single ultralytics Results object
+        
+        Returns:
+            List of detections for the classes in CLASS_NAMES
+        """
+        boxes = getattr(result, "boxes", None)
+        if boxes is None or len(boxes) == 0:
+            return []
+        return self._to_detections(boxes.xyxy, boxes.conf, boxes.cls)
+    
+    def _to_detections(self, xyxy, confs, class_ids) -> List[Dict[str, Any]]:
+        """
+        Build detections from box, confidence and class tensors
+        
+        Args:
+            xyxy: (n, 4) box corners
+            confs: (n,) confidences
+            class_ids: (n,) class ids
+        
+        Returns:
+            List of detections for the classes in CLASS_NAMES
+        """
+        detections = []
+        # One device->host transfer for all boxes instead of one per box
+        xyxy = xyxy.cpu().numpy().tolist()
+        confs = confs.cpu().numpy().tolist()
+        class_ids = class_ids.cpu().numpy().astype(int).tolist()
+        
+        for (x1, y1, x2, y2), conf, class_id in zip(xyxy, confs, class_ids):
+            # Only include classes we're interested in
+            if class_id in self.CLASS_NAMES:
+                detections.append({
+                    "class_id": class_id,
+                    "class_name": self.CLASS_NAMES.get(class_id, "unknown"),
+                    "confidence": float(conf),
+                    "bbox": {
+                        "x1": float(x1),
+                        "y1": float(y1),
+                        "x2": float(x2),
+                        "y2": float(y2),
+                        "width": float(x2 - x1),
+                        "height": float(y2 - y1)
+                    }
+                })
+        return detections
     
-    def _generate_fallback_response(self, image, classes):
+    def _generate_fallback_response(self, image, classes, render=True):
         """Generate a fallback response when model fails"""
         print("Generating fallback detection response")
-        simple_detector = SimpleDetector()
-        return simple_detector.detect(image, 0.25, classes) 
\ No newline at end of file
+        simple_detector = _new_simple_detector()
+        return simple_detector.detect(image, 0.25, classes, render=render) 
\ No newline at end of file
@@ -0,0 +1,71 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Form, HTTPException, Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.models.registry import registry
+from app.utils.memory import heap_stats, memory_tracer, recycle_policy, torch_stats
+from app.utils.prefork import supervisor_stats, worker_memory
+from app.utils.utils import has_bearer_token
+
+# Bearer token for the admin endpoints; unset disables them
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+
+
+def require_admin(request: Request):
+    """Reject admin requests unless ADMIN_TOKEN is set and the request carries it"""
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not has_bearer_token(request, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="A valid bearer token is required")
+
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+def _memory_report(top: int, key: str, diff: bool):
+    """Collect the memory report (called in the threadpool; walks the heap)"""
+    tracing = {"tracing": memory_tracer.tracing}
+    if diff and memory_tracer.tracing:
+        tracing.update(memory_tracer.diff(top, key))
+    return {
+        "process": worker_memory(),
+        "heap": heap_stats(),
+        "torch": torch_stats(),
+        "models_bytes": registry.total_memory_bytes(),
+        "tracemalloc": tracing,
+        "recycle": {**recycle_policy.stats(), "supervisor": supervisor_stats()}
+    }
+
+
+@router.get("/memory")
+async def memory(top: int = 20, key: str = "lineno", diff: bool = True):
+    """
+    Memory of this worker: RSS (unique and shared), Python heap and allocator statistics,
+    torch caches and the recycle policy.
+
+    While tracemalloc is tracing (`MEMORY_TRACE=1` or `POST /admin/memory/trace`), each call
+    takes a snapshot and lists the `top` allocation sites that grew most since the previous
+    call (`key`: `lineno`, `filename` or `traceback`). Pass `diff=false` to skip the snapshot.
+    """
+    if key not in ("lineno", "filename", "traceback"):
+        return JSONResponse(status_code=400, content={"error": "key must be lineno, filename or traceback"})
+    return await run_in_threadpool(_memory_report, max(1, top), key, diff)
+
+
+@router.post("/memory/trace")
+async def memory_trace(enabled: bool = Form(True), frames: Optional[int] = Form(1)):
+    """
+    Start (or with `enabled=false` stop) tracemalloc in this worker.
+
+    - **frames**: Stack frames kept per allocation (more shows callers, but costs more)
+
+    Tracing slows every allocation down; turn it off once the leak is found.
+    """
+    if enabled:
+        await run_in_threadpool(memory_tracer.start, max(1, frames or 1))
+    else:
+        await run_in_threadpool(memory_tracer.stop)
+    return {"tracing": memory_tracer.tracing}
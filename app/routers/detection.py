@@ -1,33 +1,134 @@
 import os
 import uuid
 import time
-from pathlib import Path
 from typing import List, Optional, Union
 
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks, Request
-from fastapi.responses import JSONResponse, FileResponse
-import numpy as np
-from PIL import Image
+from fastapi.responses import JSONResponse, Response
 import io
 
-from app.models.yolo_model import YOLOModel
-from app.utils.utils import save_uploaded_file
-from app.utils.test_image_generator import generate_test_image
+from starlette.concurrency import run_in_threadpool
+
+from app.models.preprocess import buffer_pool
+from app.models.buckets import load_bgr
+from app.models.bundle import BundleError
+from app.models.registry import registry, ModelNotFoundError, SwapNotAllowed
+from app.utils.admission import admission, AdmissionRejected, DeadlineExceeded
+from app.utils import binary_protocol
+from app.utils.broker import inference_queue, BROKER_TIMEOUT_S
+from app.utils.cpu_config import applied_config
+from app.utils.decode import MODEL_INPUT_SIZE
+from app.utils.history import history
+from app.utils.jobs import jobs
+from app.utils.motion_gate import motion_gate
+from app.utils.phash_cache import detection_cache
+from app.utils.memory import recycle_policy
+from app.utils.prefork import supervisor_stats, worker_memory
+from app.utils.quality import quality, QualityLevel
+from app.utils.render import render_result, validate_render_options
+from app.utils.stream_stats import stream_stats
+from app.utils.result_cache import result_cache, result_response
+from app.utils.upload import read_upload, read_all, open_image, UploadRejected, MAX_IMAGE_SIDE, MAX_UPLOAD_BYTES
+from app.utils.utils import save_uploaded_file, rescale_detections, has_bearer_token
 
 router = APIRouter(tags=["Detection"])
 
-# Initialize the YOLO model (lazy loading - will be loaded on first detection)
-model = YOLOModel()
+# Frames accepted in one binary request
+MAX_BINARY_FRAMES = int(os.environ.get("MAX_BINARY_FRAMES", "32"))
+
+# Bearer token required by the model hot-swap endpoint, if set
+MODEL_SWAP_TOKEN = os.environ.get("MODEL_SWAP_TOKEN") or None
+
+# Models are registered by name in app.models.registry and loaded lazily
+# on first detection
+
+def _detect_with_model(model_name, image, conf, classes, **options):
+    """Run detection on a registered model (called in the threadpool)"""
+    with registry.acquire(model_name) as detector:
+        return detector.detect(image, conf_threshold=conf, classes=classes, **options)
+
+def _detect_on_workers(model_name, image_bytes, conf, classes, fast_decode, timeout, **options):
+    """Run detection on the broker's inference workers (called in the threadpool)"""
+    return inference_queue.detect_many(
+        [image_bytes],
+        params={"model": model_name, "conf": conf, "classes": classes, **options},
+        decode={"max_side": MAX_IMAGE_SIDE, "target_side": MODEL_INPUT_SIZE if fast_decode else None},
+        timeout=timeout
+    )[0]
+
+def _detect_frames(model_name, images, conf, classes, input_scale=1.0):
+    """Detect without rendering, batching several frames (called in the threadpool)"""
+    options = {"conf_threshold": conf, "classes": classes, "render": False, "input_scale": input_scale}
+    with registry.acquire(model_name) as detector:
+        if len(images) == 1:
+            return [detector.detect(images[0], **options)]
+        return detector.detect_batch(images, **options)
+
+def _render_cached(image, detections, image_scale, **render_options):
+    """Render this request's result image from cached detections (called in the threadpool)"""
+    # Cached boxes are in uploaded-image coordinates; draw them on the decoded image
+    boxes = rescale_detections([dict(det, bbox=dict(det["bbox"])) for det in detections], 1 / image_scale)
+    return render_result(load_bgr(image), boxes, **render_options)
+
+def _detect_frames_on_workers(model_name, payloads, conf, classes, target_side, timeout, input_scale=1.0):
+    """Detect without rendering on the broker's inference workers (called in the threadpool)"""
+    return inference_queue.detect_many(
+        payloads,
+        params={"model": model_name, "conf": conf, "classes": classes, "render": False, "input_scale": input_scale,
+                "result_format": None, "result_quality": None, "preview_width": None},
+        decode={"max_side": MAX_IMAGE_SIDE, "target_side": target_side},
+        timeout=timeout
+    )
+
+def _record_frame(stream, response, source, scale=1.0):
+    """Count a served frame for its stream and queue it for the detection history"""
+    if stream:
+        stream_stats.record(stream, response["objects_detected"])
+    history.record(
+        stream, response["objects_detected"], source, response.get("model"), response.get("model_version"),
+        response.get("original_image_url"), response.get("result_image_url"), scale
+    )
+
+def _quality_model(level: QualityLevel, requested: Optional[str], model_name: str) -> str:
+    """Model to run at a quality level; a model named in the request is always honoured"""
+    if level.model and requested is None and level.model in registry.names():
+        return level.model
+    return model_name
+
+def _parse_deadline(request: Request, deadline_ms: Optional[int], received: float) -> Optional[float]:
+    """
+    Resolve the request deadline from the `X-Request-Deadline-Ms` header or the
+    `deadline_ms` form field (a budget in milliseconds from arrival)
+    """
+    value = request.headers.get("x-request-deadline-ms")
+    if value is None and deadline_ms is None:
+        return None
+    budget_ms = float(value) if value is not None else float(deadline_ms)
+    if budget_ms <= 0:
+        raise ValueError("Deadline must be a positive number of milliseconds")
+    return received + budget_ms / 1000
 
 @router.get("/test")
 async def test_endpoint():
     """Simple test endpoint to verify the API is working"""
     return {"status": "ok", "message": "Detection API is working"}
 
+@router.get("/health")
+async def health():
+    """
+    Lightweight liveness check.
+    
+    Never imports torch/ultralytics/OpenCV, so it answers immediately even in a
+    freshly started worker that has not loaded the model yet.
+    """
+    return {"status": "ok", "model_loaded": registry.get().is_loaded}
+
 @router.get("/test-model")
 async def test_model():
     """Test the YOLO model initialization"""
     try:
+        model = registry.get()
+        
         # Try to initialize the model
         result = {
             "model_initialized": model is not None,
@@ -42,7 +143,8 @@ async def test_model():
             result["model_loaded"] = False
             # Try to load the model
             try:
-                test_model = model.model  # This will trigger lazy loading
+                with registry.acquire() as loaded:  # This will trigger lazy loading
+                    test_model = loaded.model
                 result["model_load_success"] = True
                 result["model_instance_type"] = str(type(test_model))
             except Exception as e:
@@ -62,39 +164,81 @@ async def test_model():
 async def detect_objects(
     request: Request,
     file: UploadFile = File(...),
-    conf: Optional[float] = Form(0.25)
+    conf: Optional[float] = Form(0.25),
+    model: Optional[str] = Form(None),
+    priority: Optional[str] = Form(None),
+    deadline_ms: Optional[int] = Form(None),
+    fast_decode: bool = Form(False),
+    result_format: Optional[str] = Form(None),
+    result_quality: Optional[int] = Form(None),
+    preview_width: Optional[int] = Form(None),
+    stream_id: Optional[str] = Form(None)
 ):
     """
     Detect pedestrians and vehicles in an uploaded image.
     
     - **file**: Image file to analyze
     - **conf**: Confidence threshold (0-1)
+    - **model**: Name of a registered model (see `/models`), defaults to the default model
+    - **priority**: `live` (default) or `batch`; also accepted as the `X-Priority` header
+    - **deadline_ms**: Drop the request if inference has not started within this many
+                       milliseconds; also accepted as the `X-Request-Deadline-Ms` header
+    - **fast_decode**: Decode JPEGs near the model input size instead of full resolution.
+                       Boxes are still returned in original image coordinates, but the
+                       annotated result image is rendered at the reduced size.
+    - **result_format**: Annotated image format, `jpeg` (default) or `webp`
+    - **result_quality**: Annotated image encoder quality (1-100)
+    - **preview_width**: Downscale the annotated image to this width
+    - **stream_id**: Camera/stream the frame belongs to; also accepted as the `X-Stream-Id`
+                     header. Frames that barely differ from the stream's last detected frame
+                     reuse its detections without running the model (`skipped: true`).
+                     Per-class counts of every frame are aggregated over time for the
+                     stream (see `/streams/{stream_id}/counts`)
+    
+    With `ADAPTIVE_QUALITY=1`, requests are served at a cheaper quality level under load
+    (smaller input, no result image, lighter model); `quality_level` names the level used
+    and `result_image_url` is null when no image was rendered.
+    
+    With `PHASH_CACHE=1`, near-duplicates of recently processed images (e.g. re-encoded
+    copies) reuse the cached detections, rescaled to this image (`cache_hit: true`).
     - **classes**: List of class IDs to detect (0=person, 2=car, 5=bus, 7=truck)
                    If None, detects all classes
     """
+    received = time.time()
     try:
-        # Check if file is an image
-        content_type = file.content_type or ""
-        if not content_type.startswith("image/"):
-            return JSONResponse(
-                status_code=400,
-                content={"error": "Uploaded file is not an image"}
-            )
+        # Check the requested model exists before doing any work
+        model_name = model or registry.default
+        try:
+            model_version = registry.version(model_name)
+        except ModelNotFoundError as e:
+            return JSONResponse(status_code=400, content={"error": str(e.args[0])})
         
-        # Read the image file
-        image_content = await file.read()
+        # Resolve scheduling class and deadline
+        try:
+            priority_class = admission.parse_priority(request.headers.get("x-priority") or priority)
+            deadline = _parse_deadline(request, deadline_ms, received)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
         
-        # Try to open the image
+        # Validate rendering options
         try:
-            image = Image.open(io.BytesIO(image_content))
-        except Exception as e:
-            return JSONResponse(
-                status_code=400,
-                content={"error": f"Invalid image file: {str(e)}"}
+            validate_render_options(result_format, result_quality, preview_width)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        
+        # Check the spooled upload's size and reject non-images from their first
+        # bytes, then check dimensions before decoding any pixels
+        try:
+            image_buffer, _ = await read_upload(file)
+            image, image_scale = open_image(
+                image_buffer,
+                target_side=MODEL_INPUT_SIZE if fast_decode else None
             )
+        except UploadRejected as e:
+            return JSONResponse(status_code=e.status_code, content={"error": e.message})
         
-        # Save the uploaded file
-        file_path = save_uploaded_file(file, image_content)
+        # Save the uploaded file (copied straight from the spooled upload)
+        file_path = save_uploaded_file(file, image_buffer)
         
         # Extract classes from form data 
         final_classes = None
@@ -110,15 +254,107 @@ async def detect_objects(
                         print(f"Error parsing classes from form: {e}")
         except Exception as form_error:
             print(f"Error processing form data: {form_error}")
+        
+        # Static scene on a known stream: reuse the last detections
+        stream = request.headers.get("x-stream-id") or stream_id
+        motion = None
+        if stream:
+            gate_params = (
+                model_name, model_version, conf,
+                tuple(final_classes) if final_classes else None,
+                fast_decode, result_format, result_quality, preview_width
+            )
+            cached, gate_signature, motion = await run_in_threadpool(
+                motion_gate.check, stream, image, gate_params
+            )
+            if cached is not None:
+                cached.update({
+                    "inference_time": "0.0000s",
+                    "queue_time": "0.0000s",
+                    "skipped": True,
+                    "motion": motion,
+                    "original_image_url": f"/static/uploads/{os.path.basename(file_path)}"
+                })
+                _record_frame(stream, cached, "detect")
+                return cached
+        
+        # Near-duplicate of an image we already processed: reuse its detections
+        cache_hash = None
+        if detection_cache.enabled:
+            original_size = (round(image.size[0] * image_scale), round(image.size[1] * image_scale))
+            cache_params = (model_name, model_version, conf, tuple(final_classes) if final_classes else None)
+            cache_hash = await run_in_threadpool(detection_cache.hash, image)
+            hit = detection_cache.get(cache_hash, *original_size, cache_params)
+            if hit is not None:
+                cached, distance = hit
+                # The cached entry's image belongs to another upload (and may be
+                # cleaned up already), so draw this one
+                result_path = await run_in_threadpool(
+                    _render_cached, image, cached["detections"], image_scale,
+                    fmt=result_format, quality=result_quality, preview_width=preview_width
+                )
+                response = {
+                    "message": "Detection completed successfully",
+                    "objects_detected": cached["detections"],
+                    "inference_time": "0.0000s",
+                    "queue_time": "0.0000s",
+                    "image_scale": image_scale,
+                    "model": model_name,
+                    "model_version": model_version,
+                    "result_image_url": f"/static/results/{os.path.basename(result_path)}",
+                    "original_image_url": f"/static/uploads/{os.path.basename(file_path)}",
+                    "skipped": False,
+                    "motion": motion,
+                    "cache_hit": True,
+                    "cache_distance": distance,
+                    "quality_level": quality.levels[0].name
+                }
+                if stream:
+                    motion_gate.record(stream, gate_signature, gate_params, response)
+                _record_frame(stream, response, "detect")
+                return response
             
-        # Perform detection
-        start_time = time.time()
-        results = model.detect(
-            image, 
-            conf_threshold=conf,
-            classes=final_classes
-        )
-        inference_time = time.time() - start_time
+        # Perform detection once admitted; queued work past its deadline is dropped
+        queued_at = time.time()
+        try:
+            async with admission.admit(priority_class, deadline):
+                start_time = time.time()
+                # Cheaper quality while the queue behind us is long or latency is high
+                level = quality.select(admission.queue_depth())
+                model_name = _quality_model(level, model, model_name)
+                model_version = registry.version(model_name)
+                options = {
+                    "result_format": result_format,
+                    "result_quality": result_quality,
+                    "preview_width": preview_width,
+                    "render": level.render,
+                    "input_scale": level.input_scale
+                }
+                if inference_queue is not None:
+                    # Workers decode the upload themselves; only the encoded bytes travel
+                    timeout = deadline - start_time if deadline is not None else BROKER_TIMEOUT_S
+                    results = await run_in_threadpool(
+                        _detect_on_workers, model_name, read_all(image_buffer), conf, final_classes,
+                        fast_decode, timeout, **options
+                    )
+                else:
+                    results = await run_in_threadpool(
+                        _detect_with_model, model_name, image, conf, final_classes, **options
+                    )
+                inference_time = time.time() - start_time
+            quality.record(time.time() - queued_at)
+        except AdmissionRejected as e:
+            return JSONResponse(
+                status_code=e.status_code,
+                content={"error": e.message},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        except (DeadlineExceeded, TimeoutError) as e:
+            return JSONResponse(
+                status_code=504,
+                content={"error": "Deadline exceeded", "message": str(e)}
+            )
+        queue_time = start_time - queued_at
         
         # Check for valid results
         if not results or "image_path" not in results:
@@ -130,17 +366,37 @@ async def detect_objects(
                 }
             )
         
+        # Map boxes back to the uploaded image if it was downscaled
+        rescale_detections(results["detections"], image_scale)
+        
         # Get the result image path
         result_image_path = results["image_path"]
         
         # Return the results
-        return {
+        response = {
             "message": "Detection completed successfully",
             "objects_detected": results["detections"],
             "inference_time": f"{inference_time:.4f}s",
-            "result_image_url": f"/static/results/{os.path.basename(result_image_path)}",
-            "original_image_url": f"/static/uploads/{os.path.basename(file_path)}"
+            "queue_time": f"{queue_time:.4f}s",
+            "image_scale": image_scale,
+            "model": model_name,
+            "model_version": model_version,
+            "result_image_url": f"/static/results/{os.path.basename(result_image_path)}" if result_image_path else None,
+            "original_image_url": f"/static/uploads/{os.path.basename(file_path)}",
+            "skipped": False,
+            "motion": motion,
+            "cache_hit": False,
+            "quality_level": level.name
         }
+        # Degraded results are not reused for later requests
+        if cache_hash is not None and level is quality.levels[0]:
+            detection_cache.put(cache_hash, *original_size, cache_params, {
+                "detections": [dict(det, bbox=dict(det["bbox"])) for det in results["detections"]]
+            })
+        if stream:
+            motion_gate.record(stream, gate_signature, gate_params, response)
+        _record_frame(stream, response, "detect")
+        return response
         
     except Exception as e:
         import traceback
@@ -157,13 +413,212 @@ async def detect_objects(
             }
         )
 
+@router.post("/detect/binary")
+async def detect_binary(request: Request):
+    """
+    Low-overhead detection for internal callers, msgpack in and out.
+    
+    The body is a msgpack map with `frames`, a list of `{"image": <encoded bytes>}` or
+    `{"pixels": <uint8 bytes>, "width": w, "height": h, "format": "bgr" | "rgb" | "gray"}`
+    (up to `MAX_BINARY_FRAMES`), and optionally `conf`, `classes`, `model`, `fast_decode` and
+    `stream_id` (or the `X-Stream-Id` header; each frame's counts are aggregated for the stream).
+    The response holds, per frame, `boxes`: a little-endian float32 array of
+    `(x1, y1, x2, y2, confidence, class_id)` rows in original image coordinates.
+    No result image is rendered. `X-Priority` and `X-Request-Deadline-Ms` work as for `/detect`,
+    and the response names the `quality_level` used, as `/detect` does.
+    """
+    received = time.time()
+    try:
+        priority_class = admission.parse_priority(request.headers.get("x-priority"))
+        deadline = _parse_deadline(request, None, received)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    
+    # Read the body with a cap (chunked requests have no Content-Length)
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_UPLOAD_BYTES:
+            return JSONResponse(status_code=413, content={"error": f"Body exceeds the {MAX_UPLOAD_BYTES} byte limit"})
+    
+    try:
+        message = binary_protocol.unpack(bytes(body))
+        frames = message.get("frames", [message])
+        if not isinstance(frames, list) or not frames:
+            raise UploadRejected(400, "frames must be a non-empty list")
+        if len(frames) > MAX_BINARY_FRAMES:
+            raise UploadRejected(400, f"At most {MAX_BINARY_FRAMES} frames per request")
+        model_name = message.get("model") or registry.default
+        conf = float(message.get("conf", 0.25))
+        classes = [int(c) for c in message["classes"]] if message.get("classes") else None
+        target_side = MODEL_INPUT_SIZE if message.get("fast_decode") else None
+        stream = request.headers.get("x-stream-id") or message.get("stream_id")
+        if stream is not None and not isinstance(stream, str):
+            raise ValueError("stream_id must be a string")
+        decoded = [binary_protocol.decode_frame(frame, target_side) for frame in frames]
+    except UploadRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+    except RuntimeError as e:
+        # msgpack is not installed
+        return JSONResponse(status_code=501, content={"error": str(e)})
+    except (TypeError, ValueError) as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid request: {e}"})
+    
+    try:
+        model_version = registry.version(model_name)
+    except ModelNotFoundError as e:
+        return JSONResponse(status_code=400, content={"error": str(e.args[0])})
+    
+    try:
+        queued_at = time.time()
+        try:
+            async with admission.admit(priority_class, deadline):
+                start_time = time.time()
+                level = quality.select(admission.queue_depth())
+                model_name = _quality_model(level, message.get("model"), model_name)
+                model_version = registry.version(model_name)
+                if inference_queue is not None:
+                    # Workers decode encoded frames themselves; raw pixels travel as lossless
+                    # BMP, already downscaled here like on the local path
+                    payloads = [
+                        frame["image"] if "image" in frame else binary_protocol.encode_bmp(image)
+                        for frame, (image, _) in zip(frames, decoded)
+                    ]
+                    sent_scales = [1.0 if "image" in frame else scale for frame, (_, scale) in zip(frames, decoded)]
+                    timeout = deadline - start_time if deadline is not None else BROKER_TIMEOUT_S
+                    results = await run_in_threadpool(
+                        _detect_frames_on_workers, model_name, payloads, conf, classes, target_side, timeout,
+                        level.input_scale
+                    )
+                    # Boxes are in the coordinates of the image each worker decoded
+                    scales = [result["image_scale"] * sent for result, sent in zip(results, sent_scales)]
+                else:
+                    results = await run_in_threadpool(
+                        _detect_frames, model_name, [image for image, _ in decoded], conf, classes, level.input_scale
+                    )
+                    scales = [scale for _, scale in decoded]
+                inference_time = time.time() - start_time
+            quality.record(time.time() - queued_at)
+        except AdmissionRejected as e:
+            return JSONResponse(
+                status_code=e.status_code,
+                content={"error": e.message},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        except (DeadlineExceeded, TimeoutError) as e:
+            return JSONResponse(
+                status_code=504,
+                content={"error": "Deadline exceeded", "message": str(e)}
+            )
+        
+        for result, scale in zip(results, scales):
+            _record_frame(stream, {"objects_detected": result["detections"], "model": model_name,
+                                   "model_version": model_version}, "binary", scale)
+        
+        return Response(
+            content=binary_protocol.pack({
+                "model": model_name,
+                "model_version": model_version,
+                "inference_time": inference_time,
+                "queue_time": start_time - queued_at,
+                "quality_level": level.name,
+                "fields": binary_protocol.BOX_FIELDS,
+                "results": [
+                    {
+                        "boxes": binary_protocol.pack_detections(result["detections"], scale),
+                        "count": len(result["detections"]),
+                        "image_scale": scale
+                    }
+                    for result, scale in zip(results, scales)
+                ]
+            }),
+            media_type=binary_protocol.CONTENT_TYPE
+        )
+        
+    except Exception as e:
+        import traceback
+        error_traceback = traceback.format_exc()
+        print(f"Error in detect_binary: {str(e)}")
+        print(error_traceback)
+        
+        return JSONResponse(
+            status_code=500,
+            content={
+                "error": "Detection failed",
+                "message": str(e),
+                "traceback": error_traceback.split("\n")
+            }
+        )
+
+@router.get("/metrics")
+async def metrics():
+    """Runtime metrics: admission, quality, models, CPU configuration, memory, recycling, preprocessing, motion gating, stream counts, history, caches, jobs and workers"""
+    return {
+        "admission": admission.stats(),
+        "quality": quality.stats(),
+        "models": registry.stats(),
+        "cpu": applied_config(),
+        "memory": worker_memory(),
+        "recycle": {**recycle_policy.stats(), "supervisor": supervisor_stats()},
+        "preprocess": buffer_pool.stats(),
+        "motion_gate": motion_gate.stats(),
+        "streams": stream_stats.stats(),
+        "history": history.stats(),
+        "detection_cache": detection_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "jobs": jobs.stats(),
+        "broker": await run_in_threadpool(inference_queue.stats) if inference_queue is not None else None
+    }
+
+@router.get("/models")
+async def list_models():
+    """List registered models, their versions, load state and memory use"""
+    return registry.stats()
+
+@router.post("/models/{name}/swap")
+async def swap_model(
+    request: Request,
+    name: str,
+    model_path: str = Form(...),
+    version: Optional[str] = Form(None)
+):
+    """
+    Hot-swap (or register) a model with new weights without downtime.
+    
+    The new weights are loaded and warmed up before requests are switched over.
+    Disabled unless `MODEL_SWAP` is `replace` or `register`; the weights must be
+    inside `MODEL_SWAP_DIR`, and if `MODEL_SWAP_TOKEN` is set the request needs
+    `Authorization: Bearer <token>`.
+    
+    - **name**: Model name to replace or add
+    - **model_path**: Path to the weights file or bundle on the server
+    - **version**: Optional version label (defaults to the weights file name)
+    """
+    if MODEL_SWAP_TOKEN is not None:
+        if not has_bearer_token(request, MODEL_SWAP_TOKEN):
+            return JSONResponse(status_code=401, content={"error": "A valid bearer token is required"})
+    try:
+        info = await run_in_threadpool(registry.swap, name, model_path, version)
+    except SwapNotAllowed as e:
+        return JSONResponse(status_code=403, content={"error": str(e)})
+    except BundleError as e:
+        return JSONResponse(status_code=422, content={"error": str(e)})
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Model swap failed: {str(e)}")
+    return {"message": f"Model '{name}' swapped successfully", "model": info}
+
 @router.get("/result/{filename}")
-async def get_result_image(filename: str):
-    """Get a result image by filename"""
-    file_path = Path(f"app/static/results/{filename}")
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Result image not found")
-    return FileResponse(file_path)
+async def get_result_image(filename: str, request: Request):
+    """
+    Get a result image by filename
+    
+    Responses are cacheable forever (`ETag`, `Cache-Control: immutable`), answer
+    `If-None-Match` with 304 and support byte ranges. `?w=320` returns a downscaled
+    variant (the width is rounded up to one of `RESULT_VARIANT_WIDTHS`).
+    """
+    return await result_response(filename, request.headers, request.query_params, request.method)
 
 @router.api_route("/generate-test-image", methods=["GET", "POST"])
 async def create_test_image(
@@ -179,6 +634,8 @@ async def create_test_image(
     - **num_shapes**: Number of shapes to generate (default: 5)
     """
     try:
+        from app.utils.test_image_generator import generate_test_image
+        
         # Create a unique filename for the test image
         filename = f"test_image_{uuid.uuid4()}.jpg"
         output_path = f"app/static/test_images/{filename}"
@@ -283,11 +740,12 @@ async def test_detect():
         # 3. Run detection
         start_time = time.time()
         try:
-            results = model.detect(
-                img, 
-                conf_threshold=0.25,
-                classes=None  # Detect all supported classes
-            )
+            with registry.acquire() as detector:
+                results = detector.detect(
+                    img, 
+                    conf_threshold=0.25,
+                    classes=None  # Detect all supported classes
+                )
             inference_time = time.time() - start_time
             
             return {
@@ -0,0 +1,80 @@
+import time
+from typing import List, Optional
+
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.models.yolo_model import YOLOModel
+from app.utils.history import history
+
+router = APIRouter(tags=["History"])
+
+_CLASS_IDS = {name: class_id for class_id, name in YOLOModel.CLASS_NAMES.items()}
+
+
+def _parse_classes(values: Optional[List[str]]) -> Optional[List[int]]:
+    """Class IDs from IDs or names (e.g. "7" or "truck")"""
+    if not values:
+        return None
+    classes = []
+    for value in values:
+        for item in value.split(","):
+            item = item.strip().lower()
+            if item.isdigit():
+                classes.append(int(item))
+            elif item in _CLASS_IDS:
+                classes.append(_CLASS_IDS[item])
+            elif item:
+                raise ValueError(f"Unknown class '{item}'. Known classes: {', '.join(_CLASS_IDS)}")
+    return classes or None
+
+
+def _parse_region(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        x1, y1, x2, y2 = (float(v) for v in value.split(","))
+    except ValueError:
+        raise ValueError("region must be x1,y1,x2,y2") from None
+    return x1, y1, x2, y2
+
+
+@router.get("/history")
+async def search_history(
+    stream_id: Optional[str] = None,
+    classes: Optional[List[str]] = Query(None),
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    since_s: Optional[float] = None,
+    region: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None
+):
+    """
+    Search past detections (needs `DETECTION_HISTORY_DB`), newest frames first.
+
+    - **stream_id**: Only frames of this camera/stream
+    - **classes**: Class IDs or names (`person`, `car`, `bus`, `truck`); repeat or comma-separate
+    - **start** / **end**: Time range as epoch seconds
+    - **since_s**: Only the last this many seconds (instead of `start`)
+    - **region**: `x1,y1,x2,y2` in original image pixels; a detection matches if its box overlaps it
+    - **min_confidence**: Ignore detections below this confidence
+    - **limit**: Frames per page (at most 1000)
+    - **cursor**: `next_cursor` of the previous page
+
+    A frame matches when one of its detections meets all detection filters; each frame
+    lists all of its detections. `next_cursor` is null on the last page.
+    """
+    if not history.enabled:
+        return JSONResponse(status_code=404, content={"error": "Detection history is disabled (set DETECTION_HISTORY_DB)"})
+    try:
+        if since_s is not None:
+            start = time.time() - since_s
+        return await run_in_threadpool(
+            history.query, stream_id, _parse_classes(classes), start, end, _parse_region(region),
+            min_confidence, limit, cursor
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
@@ -0,0 +1,172 @@
+import io
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.models.registry import registry, ModelNotFoundError
+from app.utils.admission import admission
+from app.utils.broker import inference_queue, BROKER_TIMEOUT_S
+from app.utils.jobs import jobs, JobsBusy
+from app.utils.render import validate_render_options
+from app.utils.upload import read_upload, open_image, UploadRejected, MAX_IMAGE_SIDE
+from app.utils.decode import MODEL_INPUT_SIZE
+from app.utils.utils import save_uploaded_file, rescale_detections
+
+router = APIRouter(tags=["Jobs"])
+
+# Images accepted in one job
+MAX_JOB_FILES = int(os.environ.get("MAX_JOB_FILES", "100"))
+
+
+def _run_detection_job(model_name, file_paths, conf, classes, target_side=None, **options) -> List[Dict[str, Any]]:
+    """Detect objects in all images of a job (called in the threadpool)"""
+    # Pending jobs only hold the paths of the saved uploads; decode them now
+    images, scales, encoded = [], [], []
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            data = f.read()
+        image, scale = open_image(io.BytesIO(data), target_side=target_side)
+        images.append(image)
+        scales.append(scale)
+        encoded.append(data)
+
+    if inference_queue is not None:
+        # Workers decode the encoded uploads and batch them across jobs and requests
+        results = inference_queue.detect_many(
+            encoded,
+            params={"model": model_name, "conf": conf, "classes": classes, **options},
+            decode={"max_side": MAX_IMAGE_SIDE, "target_side": target_side},
+            timeout=BROKER_TIMEOUT_S * len(encoded)
+        )
+    else:
+        with registry.acquire(model_name) as detector:
+            if len(images) == 1:
+                results = [detector.detect(images[0], conf_threshold=conf, classes=classes, **options)]
+            else:
+                results = detector.detect_batch(images, conf_threshold=conf, classes=classes, **options)
+
+    outputs = []
+    for result, scale, file_path in zip(results, scales, file_paths):
+        image_path = result.get("image_path")
+        outputs.append({
+            "objects_detected": rescale_detections(result["detections"], scale),
+            "image_scale": scale,
+            "result_image_url": f"/static/results/{os.path.basename(image_path)}" if image_path else None,
+            "original_image_url": f"/static/uploads/{os.path.basename(file_path)}"
+        })
+    return outputs
+
+@router.on_event("startup")
+async def start_jobs():
+    jobs.start()
+
+# Let accepted jobs finish when the worker shuts down or is recycled
+@router.on_event("shutdown")
+async def drain_jobs():
+    unfinished = await jobs.drain(float(os.environ.get("JOB_DRAIN_TIMEOUT_S", "30")))
+    if unfinished:
+        print(f"Shutting down with {unfinished} unfinished jobs")
+
+@router.post("/jobs", status_code=202)
+async def submit_job(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    conf: Optional[float] = Form(0.25),
+    model: Optional[str] = Form(None),
+    priority: Optional[str] = Form("batch"),
+    webhook_url: Optional[str] = Form(None),
+    fast_decode: bool = Form(False),
+    result_format: Optional[str] = Form(None),
+    result_quality: Optional[int] = Form(None),
+    preview_width: Optional[int] = Form(None)
+):
+    """
+    Submit images for detection in the background and return a job ID immediately.
+
+    - **files**: One or more image files (up to `MAX_JOB_FILES`)
+    - **conf**, **model**, **fast_decode**, **result_format**, **result_quality**,
+      **preview_width**, **classes**: As for `/detect`
+    - **priority**: `batch` (default) or `live`
+    - **webhook_url**: URL that receives the finished job as a JSON POST
+
+    Poll `GET /jobs/{job_id}` for the status and result.
+    """
+    model_name = model or registry.default
+    try:
+        model_version = registry.version(model_name)
+    except ModelNotFoundError as e:
+        return JSONResponse(status_code=400, content={"error": str(e.args[0])})
+
+    try:
+        priority_class = admission.parse_priority(priority)
+        validate_render_options(result_format, result_quality, preview_width)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if webhook_url is not None:
+        try:
+            await run_in_threadpool(jobs.check_webhook, webhook_url)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+    if len(files) > MAX_JOB_FILES:
+        return JSONResponse(status_code=400, content={"error": f"At most {MAX_JOB_FILES} files per job"})
+
+    # Validate every upload now so bad input fails the submission, not the job.
+    # Only the header is checked (no downscaling, so no pixels are decoded); the
+    # saved files are decoded when the job runs
+    file_paths = []
+    for file in files:
+        try:
+            image_buffer, _ = await read_upload(file)
+            open_image(image_buffer, max_side=sys.maxsize)
+        except UploadRejected as e:
+            return JSONResponse(status_code=e.status_code, content={"error": f"{file.filename}: {e.message}"})
+        file_paths.append(save_uploaded_file(file, image_buffer))
+
+    classes = None
+    form = await request.form()
+    if form.getlist("classes"):
+        try:
+            classes = [int(c) for c in form.getlist("classes")]
+        except (ValueError, TypeError):
+            return JSONResponse(status_code=400, content={"error": "classes must be integers"})
+
+    try:
+        job = await jobs.submit(
+            lambda: _run_detection_job(
+                model_name, file_paths, conf, classes,
+                target_side=MODEL_INPUT_SIZE if fast_decode else None,
+                result_format=result_format,
+                result_quality=result_quality,
+                preview_width=preview_width
+            ),
+            kind="detect",
+            priority=priority_class,
+            webhook_url=webhook_url,
+            model=model_name,
+            model_version=model_version,
+            images=len(file_paths)
+        )
+    except JobsBusy as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": e.message},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"},
+        headers={"Location": f"/jobs/{job['id']}"}
+    )
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Return a job's status, and its result once finished (kept for `JOB_TTL_S` seconds)"""
+    job = await jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found or expired"})
+    return job
@@ -0,0 +1,41 @@
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.utils.stream_stats import stream_stats
+
+router = APIRouter(tags=["Streams"])
+
+
+@router.get("/streams")
+async def list_streams():
+    """List the streams with aggregated detection counts, and the aggregator's memory use"""
+    return {**stream_stats.stats(), "stream_ids": stream_stats.streams()}
+
+
+@router.get("/streams/{stream_id}/counts")
+async def stream_counts(
+    stream_id: str,
+    resolution: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    limit: int = 60
+):
+    """
+    Per-class detection counts of a stream over time.
+
+    - **resolution**: Bucket size, e.g. `1s`, `1m` or `1h` (see `/streams`); defaults to the finest
+    - **start** / **end**: Window as epoch seconds; defaults to the last `limit` buckets up to now
+    - **limit**: Buckets returned when `start` is not given (default 60)
+
+    Buckets are returned oldest first as arrays: `frames` counted per bucket, `counts` (objects
+    per class summed over those frames) and `max` (most objects of a class in a single frame).
+    Windows reaching back beyond what a resolution keeps start at its oldest bucket.
+    """
+    try:
+        return stream_stats.query(stream_id, resolution, start, end, limit)
+    except KeyError:
+        return JSONResponse(status_code=404, content={"error": f"No counts recorded for stream '{stream_id}'"})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
@@ -0,0 +1,268 @@
+"""
+Admission control for the Object Detection API
+Queues inference work by priority class, sheds load when queues are full
+and drops queued work whose deadline has passed
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional
+
+# Lower value = served first
+PRIORITIES = {
+    "live": 0,
+    "batch": 1
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be queued (queue full)"""
+
+    def __init__(self, status_code: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before inference starts"""
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "future", "deadline", "enqueued_at")
+
+    def __init__(self, priority: int, seq: int, future: asyncio.Future,
+                 deadline: Optional[float], enqueued_at: float):
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.deadline = deadline
+        self.enqueued_at = enqueued_at
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _ClassStats:
+    """Counters and recent queue wait times for one priority class"""
+
+    def __init__(self, window: int = 1000):
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.queued = 0
+        self.wait_times: Deque[float] = deque(maxlen=window)
+        self.total_wait = 0.0
+
+    def to_dict(self) -> Dict:
+        waits = sorted(self.wait_times)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))]
+
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "queued": self.queued,
+            "queue_wait_ms": {
+                "mean": (self.total_wait / self.admitted * 1000) if self.admitted else 0.0,
+                "p50": percentile(0.50) * 1000,
+                "p95": percentile(0.95) * 1000,
+                "p99": percentile(0.99) * 1000,
+                "max": (waits[-1] * 1000) if waits else 0.0
+            }
+        }
+
+
+class AdmissionController:
+    """
+    Priority admission queue in front of the model
+
+    At most `concurrency` requests run inference at a time. Others wait in a
+    priority queue (live before batch, FIFO within a class). Each class has a
+    queue length limit; beyond it requests are rejected with a Retry-After
+    hint. Waiting requests whose deadline passes are dropped.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        max_queue: Optional[Dict[str, int]] = None
+    ):
+        """
+        Args:
+            concurrency: Number of inferences allowed to run at the same time
+            max_queue: Maximum number of waiting requests per priority class
+        """
+        self.concurrency = max(1, concurrency)
+        self.max_queue = {"live": 32, "batch": 256}
+        if max_queue:
+            self.max_queue.update(max_queue)
+        self._active = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._stats = {name: _ClassStats() for name in PRIORITIES}
+        # Exponentially weighted average inference time, used for Retry-After
+        self._service_time = 0.5
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """
+        Build the controller from environment variables
+
+        - INFERENCE_CONCURRENCY: concurrent inferences per process (default: 1)
+        - MAX_QUEUE_LIVE / MAX_QUEUE_BATCH: queue limits per priority class
+        """
+        return cls(
+            concurrency=int(os.environ.get("INFERENCE_CONCURRENCY", "1")),
+            max_queue={
+                "live": int(os.environ.get("MAX_QUEUE_LIVE", "32")),
+                "batch": int(os.environ.get("MAX_QUEUE_BATCH", "256"))
+            }
+        )
+
+    @staticmethod
+    def parse_priority(value: Optional[str]) -> str:
+        """Normalise a priority class name, defaulting to 'live'"""
+        if not value:
+            return "live"
+        value = value.strip().lower()
+        if value not in PRIORITIES:
+            raise ValueError(
+                f"Unknown priority '{value}'. Expected one of: {', '.join(PRIORITIES)}"
+            )
+        return value
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        if priority is None:
+            return sum(s.queued for s in self._stats.values())
+        return self._stats[priority].queued
+
+    def _retry_after(self) -> int:
+        backlog = self.queue_depth() + self._active
+        return max(1, math.ceil(backlog * self._service_time / self.concurrency))
+
+    @asynccontextmanager
+    async def admit(self, priority: str = "live", deadline: Optional[float] = None):
+        """
+        Wait for an inference slot
+
+        Args:
+            priority: Priority class name (see PRIORITIES)
+            deadline: Absolute time.time() after which the request is dropped
+
+        Raises:
+            AdmissionRejected: The class queue is full
+            DeadlineExceeded: The deadline passed before a slot became free
+        """
+        stats = self._stats[priority]
+        now = time.time()
+        if deadline is not None and deadline <= now:
+            stats.expired += 1
+            raise DeadlineExceeded("Request deadline already passed")
+
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+        else:
+            if stats.queued >= self.max_queue[priority]:
+                stats.rejected += 1
+                # Live traffic is shed because we are overloaded (503); batch
+                # clients are asked to slow down (429)
+                status_code = 503 if priority == "live" else 429
+                raise AdmissionRejected(
+                    status_code,
+                    f"Too many queued {priority} requests, try again later",
+                    self._retry_after()
+                )
+            await self._wait(priority, deadline, now)
+
+        stats.admitted += 1
+        wait = time.time() - now
+        stats.wait_times.append(wait)
+        stats.total_wait += wait
+
+        started = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - started
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            self._release()
+
+    async def _wait(self, priority: str, deadline: Optional[float], now: float):
+        stats = self._stats[priority]
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(PRIORITIES[priority], next(self._seq), future, deadline, now)
+        heapq.heappush(self._waiters, waiter)
+        stats.queued += 1
+        # A slot may be free if the queue only holds abandoned waiters
+        self._dispatch()
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if self._granted(future):
+                # Granted a slot at the same moment the deadline hit: give it back
+                self._release()
+            future.cancel()
+            stats.expired += 1
+            raise DeadlineExceeded("Request deadline passed while queued")
+        except DeadlineExceeded:
+            # Dropped by _dispatch because it expired in the queue
+            stats.expired += 1
+            raise
+        except BaseException:
+            # Client disconnected or task cancelled while waiting
+            if self._granted(future):
+                self._release()
+            future.cancel()
+            raise
+        finally:
+            stats.queued -= 1
+
+    @staticmethod
+    def _granted(future: asyncio.Future) -> bool:
+        return future.done() and not future.cancelled() and future.exception() is None
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to the highest-priority waiters that are still alive"""
+        now = time.time()
+        while self._active < self.concurrency and self._waiters:
+            waiter = heapq.heappop(self._waiters)
+            if waiter.future.done():
+                continue  # Cancelled or timed out already
+            if waiter.deadline is not None and waiter.deadline <= now:
+                # Expired in the queue: drop it without spending inference time
+                waiter.future.set_exception(
+                    DeadlineExceeded("Request deadline passed while queued")
+                )
+                continue
+            self._active += 1
+            waiter.future.set_result(True)
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "queue_depth": self.queue_depth(),
+            "max_queue": dict(self.max_queue),
+            "service_time_ms": self._service_time * 1000,
+            "classes": {name: s.to_dict() for name, s in self._stats.items()}
+        }
+
+
+# Shared controller for this process
+admission = AdmissionController.from_env()
@@ -0,0 +1,304 @@
+"""
+Distributed inference queue for the Object Detection API
+With BROKER_URL set, the API publishes detection tasks to a Redis-protocol
+broker instead of running the model itself, and inference workers
+(python -m app.utils.worker, on any host) consume them in batches.
+
+Delivery is at least once: a worker atomically moves each task from the
+shared queue to its own processing list and only removes it after the
+result is published. Workers heartbeat into a key with a TTL; when a
+heartbeat expires, the tasks the worker had claimed go back to the queue.
+Because idle workers pull work rather than having it assigned, load
+rebalances itself as workers join and leave
+"""
+import json
+import math
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.job_store import redis_client
+from app.utils.result_cache import RESULTS_DIR, result_cache
+
+# Redis URL, or "local-redis" for the in-process stand-in; unset runs inference in the API process
+BROKER_URL = os.environ.get("BROKER_URL")
+# Seconds the API waits for a worker when the request has no deadline
+BROKER_TIMEOUT_S = float(os.environ.get("BROKER_TIMEOUT_S", "30"))
+
+Task = Dict[str, Any]
+
+
+def _px(seconds: float) -> int:
+    return max(1, math.ceil(seconds * 1000))
+
+
+class InferenceQueue:
+    """
+    Detection tasks and their results on a Redis-protocol broker
+
+    Keys (under `prefix`):
+        queue: Task list; producers push on the left, workers take from the right
+        processing:<worker>: Tasks a worker has claimed but not finished
+        payload:<task>: Encoded image of a task
+        reply:<task> / image:<task>: Result and rendered image of a task
+        workers: IDs of registered workers
+        worker:<worker>: Heartbeat, expires when the worker stops reporting
+        attempts: Delivery count per task
+
+    Args:
+        client: redis.Redis or LocalRedis
+        prefix: Key prefix, so several deployments can share a broker
+        task_ttl: Seconds tasks and results are kept
+        heartbeat_ttl: Seconds without a heartbeat before a worker counts as dead
+        max_attempts: Deliveries before a task is failed instead of retried
+    """
+
+    def __init__(self, client, prefix: str = "detect", task_ttl: float = 300.0,
+                 heartbeat_ttl: float = 15.0, max_attempts: int = 3):
+        self.client = client
+        self.prefix = prefix
+        self.task_ttl = task_ttl
+        self.heartbeat_ttl = heartbeat_ttl
+        self.max_attempts = max_attempts
+        self.queue_key = f"{prefix}:queue"
+        self.workers_key = f"{prefix}:workers"
+        self.attempts_key = f"{prefix}:attempts"
+        self.counts = {"submitted": 0, "completed": 0, "timeouts": 0}
+
+    @classmethod
+    def from_env(cls, url: Optional[str] = None) -> "InferenceQueue":
+        """
+        Create a queue configured from environment variables
+
+        - BROKER_URL: redis://host:port/db or local-redis
+        - BROKER_PREFIX: key prefix (default "detect")
+        - BROKER_TASK_TTL_S: seconds tasks and results are kept (default 300)
+        - WORKER_HEARTBEAT_TTL_S: seconds before a silent worker's tasks are requeued (default 15)
+        - BROKER_MAX_ATTEMPTS: deliveries per task (default 3)
+        """
+        return cls(
+            client=redis_client(url or BROKER_URL),
+            prefix=os.environ.get("BROKER_PREFIX", "detect"),
+            task_ttl=float(os.environ.get("BROKER_TASK_TTL_S", "300")),
+            heartbeat_ttl=float(os.environ.get("WORKER_HEARTBEAT_TTL_S", "15")),
+            max_attempts=int(os.environ.get("BROKER_MAX_ATTEMPTS", "3"))
+        )
+
+    def _key(self, kind: str, name: str) -> str:
+        return f"{self.prefix}:{kind}:{name}"
+
+    # Producer side
+
+    def submit(self, task: Task, image: bytes) -> str:
+        """
+        Publish a detection task
+
+        Args:
+            task: JSON-serialisable detection parameters
+            image: Encoded image bytes
+
+        Returns:
+            Task ID to wait on
+        """
+        task_id = uuid.uuid4().hex
+        task = dict(task, id=task_id, submitted_at=time.time())
+        # Payload first, so a worker never sees a task without its image
+        self.client.set(self._key("payload", task_id), image, px=_px(self.task_ttl))
+        self.client.lpush(self.queue_key, json.dumps(task))
+        self.counts["submitted"] += 1
+        return task_id
+
+    def wait(self, task_id: str, timeout: float) -> Tuple[Dict[str, Any], Optional[bytes]]:
+        """
+        Block until a task's result is published
+
+        Args:
+            task_id: ID returned by submit
+            timeout: Seconds to wait
+
+        Returns:
+            (result, rendered image bytes or None)
+
+        Raises:
+            TimeoutError: If no result arrived in time; the task is abandoned
+        """
+        popped = self.client.blpop([self._key("reply", task_id)], timeout=max(timeout, 0.01))
+        if popped is None:
+            # Drop the payload so a worker that picks the task up later skips it
+            self.client.delete(self._key("payload", task_id))
+            self.counts["timeouts"] += 1
+            raise TimeoutError(f"No worker finished task {task_id} within {timeout:.1f}s")
+        image_key = self._key("image", task_id)
+        image = self.client.get(image_key)
+        self.client.delete(image_key)
+        self.counts["completed"] += 1
+        return json.loads(popped[1]), image
+
+    def detect_many(
+        self,
+        images: List[bytes],
+        params: Dict[str, Any],
+        decode: Dict[str, Any],
+        timeout: float,
+        results_dir: str = RESULTS_DIR
+    ) -> List[Dict[str, Any]]:
+        """
+        Run detection on workers and wait for the results (blocking)
+
+        Args:
+            images: Encoded images
+            params: model, conf, classes, result_format, result_quality, preview_width
+                    and optionally render and input_scale
+            decode: open_image arguments (max_side, target_side), so workers
+                    decode exactly as the API validated
+            timeout: Seconds to wait for all results
+            results_dir: Where rendered images are saved
+
+        Returns:
+            Per image: detections (in decoded image coordinates), image_path,
+            image_scale, worker and batch_size
+
+        Raises:
+            TimeoutError: If the workers did not finish in time
+            RuntimeError: If a worker reported an error
+        """
+        deadline = time.time() + timeout
+        task_ids = [self.submit({"params": params, "decode": decode}, image) for image in images]
+        results = []
+        for task_id in task_ids:
+            reply, rendered = self.wait(task_id, deadline - time.time())
+            if "error" in reply:
+                raise RuntimeError(f"Worker error: {reply['error']}")
+            image_path = None
+            if rendered is not None:
+                os.makedirs(results_dir, exist_ok=True)
+                image_path = os.path.join(results_dir, f"{task_id}{reply['result_extension']}")
+                with open(image_path, "wb") as f:
+                    f.write(rendered)
+                if results_dir == RESULTS_DIR:
+                    result_cache.put(image_path, rendered)
+            results.append({
+                "detections": reply["detections"],
+                "image_path": image_path,
+                "image_scale": reply["image_scale"],
+                "worker": reply["worker"],
+                "batch_size": reply["batch_size"]
+            })
+        return results
+
+    # Worker side
+
+    def claim(self, worker_id: str, batch_size: int, timeout: float) -> List[bytes]:
+        """
+        Move up to `batch_size` tasks to a worker's processing list
+
+        Blocks up to `timeout` seconds for the first task, then takes only
+        what is already queued, so a busy worker never hoards work.
+
+        Returns:
+            Raw task entries, to pass to load and complete
+        """
+        processing = self._key("processing", worker_id)
+        first = self.client.blmove(self.queue_key, processing, timeout, "RIGHT", "LEFT")
+        if first is None:
+            return []
+        claimed = [first]
+        while len(claimed) < batch_size:
+            raw = self.client.lmove(self.queue_key, processing, "RIGHT", "LEFT")
+            if raw is None:
+                break
+            claimed.append(raw)
+        return claimed
+
+    def load(self, raw: bytes) -> Tuple[Task, Optional[bytes], int]:
+        """
+        Decode a claimed task and count the delivery
+
+        Returns:
+            (task, encoded image or None if the task was abandoned or expired, delivery number)
+        """
+        task = json.loads(raw)
+        attempt = self.client.hincrby(self.attempts_key, task["id"], 1)
+        return task, self.client.get(self._key("payload", task["id"])), attempt
+
+    def complete(self, worker_id: str, raw: bytes, task: Task, result: Optional[Dict[str, Any]] = None,
+                 image: Optional[bytes] = None):
+        """
+        Publish a task's result (if any) and remove it from the worker's processing list
+
+        Args:
+            worker_id: Worker that claimed the task
+            raw: Raw entry returned by claim
+            task: Decoded task
+            result: JSON-serialisable result; None only acknowledges the task
+            image: Rendered result image
+        """
+        task_id = task["id"]
+        if result is not None:
+            if image is not None:
+                self.client.set(self._key("image", task_id), image, px=_px(self.task_ttl))
+            reply = self._key("reply", task_id)
+            self.client.rpush(reply, json.dumps(result))
+            self.client.pexpire(reply, _px(self.task_ttl))
+        self.client.delete(self._key("payload", task_id))
+        self.client.hdel(self.attempts_key, task_id)
+        self.client.lrem(self._key("processing", worker_id), 1, raw)
+
+    def heartbeat(self, worker_id: str, info: Dict[str, Any]):
+        """Register a worker and report it alive for heartbeat_ttl seconds"""
+        self.client.sadd(self.workers_key, worker_id)
+        self.client.set(self._key("worker", worker_id), json.dumps(info), px=_px(self.heartbeat_ttl))
+
+    def requeue(self, worker_id: str) -> int:
+        """Return a worker's claimed tasks to the front of the queue; returns how many moved"""
+        processing = self._key("processing", worker_id)
+        moved = 0
+        while self.client.lmove(processing, self.queue_key, "RIGHT", "RIGHT") is not None:
+            moved += 1
+        return moved
+
+    def requeue_dead_workers(self) -> int:
+        """Requeue the tasks of workers whose heartbeat expired and forget them"""
+        moved = 0
+        for member in self.client.smembers(self.workers_key):
+            worker_id = member.decode() if isinstance(member, bytes) else member
+            if self.client.exists(self._key("worker", worker_id)):
+                continue
+            count = self.requeue(worker_id)
+            self.client.srem(self.workers_key, worker_id)
+            if count:
+                print(f"Requeued {count} tasks of dead worker {worker_id}")
+            moved += count
+        return moved
+
+    def deregister(self, worker_id: str):
+        """Remove a stopping worker, returning anything it still holds to the queue"""
+        self.requeue(worker_id)
+        self.client.delete(self._key("worker", worker_id))
+        self.client.srem(self.workers_key, worker_id)
+
+    def stats(self) -> Dict:
+        workers = {}
+        for member in self.client.smembers(self.workers_key):
+            worker_id = member.decode() if isinstance(member, bytes) else member
+            info = self.client.get(self._key("worker", worker_id))
+            workers[worker_id] = {
+                **(json.loads(info) if info is not None else {"alive": False}),
+                "in_flight": self.client.llen(self._key("processing", worker_id))
+            }
+        return {
+            "prefix": self.prefix,
+            "queue_depth": self.client.llen(self.queue_key),
+            "workers": workers,
+            **self.counts
+        }
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+# Shared queue for this process (None: inference runs locally)
+inference_queue: Optional[InferenceQueue] = InferenceQueue.from_env() if BROKER_URL else None
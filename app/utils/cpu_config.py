@@ -0,0 +1,346 @@
+"""
+CPU execution configuration for the Object Detection API
+Controls torch intra-/inter-op thread counts, optional CPU affinity pinning
+per worker and channels-last memory format, and can auto-tune the number
+of workers x threads for the current host
+"""
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+CONFIG_PATH = os.environ.get("CPU_CONFIG_PATH", "app/models/weights/cpu_config.json")
+
+_applied: Optional[Dict] = None
+_slot_lock = None  # Keeps the claimed worker slot lock file open
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Parse a CPU list such as "0-3,8,10-11" into [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def load_cpu_config() -> Dict:
+    """
+    Resolve the CPU configuration
+
+    Values come from the auto-tuned config file (CPU_CONFIG_PATH) if it
+    exists, overridden by environment variables:
+
+    - TORCH_NUM_THREADS: intra-op threads per worker
+    - TORCH_INTEROP_THREADS: inter-op threads per worker
+    - CPU_AFFINITY: "none", "auto" (split the CPUs evenly between WORKERS
+      workers) or an explicit list such as "0-3"
+    - WORKERS: number of workers sharing the host (used by "auto")
+    - CHANNELS_LAST: "1" to convert the model to channels-last memory format
+    """
+    config = {
+        "torch_num_threads": None,
+        "interop_threads": None,
+        "cpu_affinity": "none",
+        "workers": 1,
+        "channels_last": False
+    }
+    if os.path.exists(CONFIG_PATH):
+        try:
+            with open(CONFIG_PATH) as f:
+                saved = json.load(f)
+            config.update({k: v for k, v in saved.items() if k in config})
+        except Exception as e:
+            print(f"Could not read CPU config {CONFIG_PATH}: {e}")
+
+    env = os.environ
+    if env.get("TORCH_NUM_THREADS"):
+        config["torch_num_threads"] = int(env["TORCH_NUM_THREADS"])
+    if env.get("TORCH_INTEROP_THREADS"):
+        config["interop_threads"] = int(env["TORCH_INTEROP_THREADS"])
+    if env.get("CPU_AFFINITY"):
+        config["cpu_affinity"] = env["CPU_AFFINITY"]
+    if env.get("WORKERS"):
+        config["workers"] = int(env["WORKERS"])
+    if env.get("CHANNELS_LAST"):
+        config["channels_last"] = env["CHANNELS_LAST"] == "1"
+    return config
+
+
+def claim_worker_slot(slots: int) -> int:
+    """
+    Claim a free worker slot in [0, slots) for this process
+
+    Uses WORKER_SLOT if set, otherwise takes an exclusive lock on one of
+    `slots` lock files, so sibling workers started by uvicorn/gunicorn each
+    get a different slot. The lock is held for the life of the process.
+    """
+    global _slot_lock
+    if os.environ.get("WORKER_SLOT"):
+        return int(os.environ["WORKER_SLOT"]) % slots
+
+    lock_dir = os.path.join(tempfile.gettempdir(), "cv-object-detection-slots")
+    os.makedirs(lock_dir, exist_ok=True)
+    for slot in range(slots):
+        handle = open(os.path.join(lock_dir, f"slot-{slot}.lock"), "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _slot_lock = handle
+        return slot
+    # More workers than slots: share by pid
+    return os.getpid() % slots
+
+
+def affinity_cpus(config: Dict) -> Optional[List[int]]:
+    """CPUs this worker should be pinned to, or None for no pinning"""
+    spec = str(config.get("cpu_affinity") or "none").strip().lower()
+    if spec == "none":
+        return None
+    if spec != "auto":
+        return parse_cpu_list(spec)
+
+    cpus = available_cpus()
+    workers = max(1, int(config.get("workers") or 1))
+    per_worker = max(1, len(cpus) // workers)
+    slot = claim_worker_slot(workers)
+    start = (slot * per_worker) % len(cpus)
+    return cpus[start:start + per_worker]
+
+
+def apply_cpu_config(config: Optional[Dict] = None) -> Dict:
+    """
+    Apply the CPU configuration to this process (once)
+
+    Must run before torch starts its thread pools, i.e. before the first
+    inference. Called when the model is loaded.
+
+    Returns:
+        The configuration actually applied
+    """
+    global _applied
+    if _applied is not None:
+        return _applied
+
+    config = dict(config or load_cpu_config())
+    cpus = affinity_cpus(config)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+            print(f"Pinned worker {os.getpid()} to CPUs {cpus}")
+        except OSError as e:
+            print(f"Could not set CPU affinity {cpus}: {e}")
+            cpus = None
+    config["pinned_cpus"] = cpus
+
+    # Default intra-op threads to the CPUs we are pinned to, so workers do not
+    # oversubscribe the host
+    if config["torch_num_threads"] is None and cpus:
+        config["torch_num_threads"] = len(cpus)
+
+    import torch
+
+    if config["torch_num_threads"]:
+        torch.set_num_threads(int(config["torch_num_threads"]))
+    if config["interop_threads"]:
+        try:
+            torch.set_num_interop_threads(int(config["interop_threads"]))
+        except RuntimeError as e:
+            # Can only be set once, before any inter-op work has started
+            print(f"Could not set inter-op threads: {e}")
+    config["effective_threads"] = torch.get_num_threads()
+    config["effective_interop_threads"] = torch.get_num_interop_threads()
+
+    _applied = config
+    return config
+
+
+def applied_config() -> Optional[Dict]:
+    """The configuration applied to this process, if any"""
+    return _applied
+
+
+def reset_cpu_config():
+    """
+    Forget the applied configuration, so a forked worker can apply its own
+
+    The parent's worker slot lock (if any) stays with the parent.
+    """
+    global _applied, _slot_lock
+    _applied = None
+    _slot_lock = None
+
+
+def _bench_worker(threads: int, duration: float, imgsz: int, model_path: Optional[str]):
+    """
+    Time YOLOModel.detect() in a loop over a window shared with the other workers
+
+    Prints {"ready": true} once warmed up, then reads the window's start time
+    (a wall-clock timestamp) from stdin, so every worker of a combination is
+    timed over the same interval. Prints the images finished in the window.
+    """
+    import numpy as np
+    from app.models.yolo_model import YOLOModel
+
+    apply_cpu_config({
+        "torch_num_threads": threads,
+        "interop_threads": 1,
+        "cpu_affinity": os.environ.get("CPU_AFFINITY", "auto"),
+        "workers": int(os.environ.get("WORKERS", "1")),
+        "channels_last": os.environ.get("CHANNELS_LAST") == "1"
+    })
+    model = YOLOModel(model_path, imgsz=imgsz, buckets=[])
+    model.warmup(imgsz)
+    if model.is_fallback:
+        raise RuntimeError("YOLOv8 model could not be loaded; cannot tune")
+
+    frame = np.random.default_rng(0).integers(0, 255, (imgsz, imgsz, 3), dtype=np.uint8)
+    # detect() logs every call; keep that out of the pipe the parent only reads at the end
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # The serving path: preprocessing, inference_mode forward pass and extraction, no rendering
+        model.detect(frame, render=False)
+        print(json.dumps({"ready": True}), file=sys.__stdout__, flush=True)
+
+        start = float(sys.stdin.readline())
+        end = start + duration
+        time.sleep(max(0.0, start - time.time()))
+        count = 0
+        while True:
+            model.detect(frame, render=False)
+            if time.time() > end:
+                break
+            count += 1
+    print(json.dumps({"images": count}))
+
+
+def autotune(workers_options: List[int], threads_options: List[int], duration: float,
+             imgsz: int, model_path: Optional[str]) -> Dict:
+    """
+    Measure throughput for each workers x threads combination that fits the host
+
+    Each combination starts `workers` processes, pinned to disjoint CPU slices.
+    Once all of them have loaded and warmed up the model, they time detect()
+    over the same `duration` second window, so the figure is their combined
+    throughput while competing for the host.
+
+    Returns:
+        Best configuration plus all measurements
+    """
+    ncpu = len(available_cpus())
+    results = []
+    for workers in workers_options:
+        for threads in threads_options:
+            if workers * threads > ncpu:
+                continue
+            procs = []
+            for slot in range(workers):
+                env = dict(os.environ, WORKERS=str(workers), WORKER_SLOT=str(slot),
+                           CPU_AFFINITY="auto")
+                cmd = [sys.executable, "-m", "app.utils.cpu_config", "_bench",
+                       "--threads", str(threads), "--duration", str(duration),
+                       "--imgsz", str(imgsz)]
+                if model_path:
+                    cmd += ["--model", model_path]
+                procs.append(subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                              stderr=subprocess.DEVNULL, text=True))
+            try:
+                # Barrier: start the timed windows together once every worker is warm
+                for proc in procs:
+                    while True:
+                        line = proc.stdout.readline()
+                        if not line:
+                            raise RuntimeError(f"Benchmark worker failed for {workers}x{threads}")
+                        if line.startswith("{") and json.loads(line).get("ready"):
+                            break
+                start = time.time() + 0.5
+                for proc in procs:
+                    proc.stdin.write(f"{start}\n")
+                    proc.stdin.flush()
+                images = 0
+                for proc in procs:
+                    out, _ = proc.communicate()
+                    lines = [line for line in out.splitlines() if line.startswith("{")]
+                    if proc.returncode != 0 or not lines:
+                        raise RuntimeError(f"Benchmark worker failed for {workers}x{threads}")
+                    images += json.loads(lines[-1])["images"]
+            finally:
+                for proc in procs:
+                    if proc.poll() is None:
+                        proc.kill()
+            throughput = images / duration
+            print(f"workers={workers} threads={threads}: {throughput:.2f} images/s")
+            results.append({"workers": workers, "threads": threads, "throughput": throughput})
+
+    if not results:
+        raise RuntimeError("No workers x threads combination fits on this host")
+    best = max(results, key=lambda r: r["throughput"])
+    return {
+        "workers": best["workers"],
+        "torch_num_threads": best["threads"],
+        "interop_threads": 1,
+        "cpu_affinity": "auto",
+        "channels_last": os.environ.get("CHANNELS_LAST") == "1",
+        "throughput": best["throughput"],
+        "host_cpus": ncpu,
+        "imgsz": imgsz,
+        "measurements": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU inference configuration")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    show = sub.add_parser("show", help="Print the resolved configuration")
+
+    tune = sub.add_parser("autotune", help="Find the best workers x threads for this host")
+    tune.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to try")
+    tune.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="Threads per worker to try")
+    tune.add_argument("--duration", type=float, default=10.0, help="Seconds per measurement")
+    tune.add_argument("--imgsz", type=int, default=640, help="Inference image size")
+    tune.add_argument("--model", default=None, help="Weights file (default: yolov8n)")
+    tune.add_argument("--output", default=CONFIG_PATH, help="Where to write the best config")
+
+    bench = sub.add_parser("_bench")  # Internal: one benchmark worker
+    bench.add_argument("--threads", type=int, required=True)
+    bench.add_argument("--duration", type=float, required=True)
+    bench.add_argument("--imgsz", type=int, default=640)
+    bench.add_argument("--model", default=None)
+
+    args = parser.parse_args()
+    if args.command == "show":
+        print(json.dumps(load_cpu_config(), indent=2))
+    elif args.command == "_bench":
+        _bench_worker(args.threads, args.duration, args.imgsz, args.model)
+    else:
+        config = autotune(args.workers, args.threads, args.duration, args.imgsz, args.model)
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(config, f, indent=2)
+        print(f"Best: {config['workers']} workers x {config['torch_num_threads']} threads "
+              f"({config['throughput']:.2f} images/s), written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
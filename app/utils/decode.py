@@ -0,0 +1,175 @@
+"""
+Reduced-resolution image decoding for the Object Detection API
+The model resizes its input to ~640px anyway, so JPEGs can be decoded
+directly near that size using DCT scaling (1/2, 1/4 or 1/8) instead of
+decoding every pixel of a multi-megapixel photo
+"""
+import argparse
+import io
+import time
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+# Default inference input size of YOLOv8
+MODEL_INPUT_SIZE = 640
+
+# DCT scale factors supported by libjpeg and the matching OpenCV flags
+_CV2_REDUCED_FLAGS = {
+    8: "IMREAD_REDUCED_COLOR_8",
+    4: "IMREAD_REDUCED_COLOR_4",
+    2: "IMREAD_REDUCED_COLOR_2"
+}
+
+# Typical camera resolutions used by the benchmark
+CAMERA_RESOLUTIONS = {
+    "VGA": (640, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+    "12MP": (4000, 3000)
+}
+
+
+def reduced_decode(image: "Image.Image", target_side: int = MODEL_INPUT_SIZE) -> Tuple["Image.Image", float]:
+    """
+    Decode a lazily opened PIL image near the model input size
+
+    For JPEGs, draft mode picks the largest DCT reduction that still keeps the
+    longest side >= target_side, so no detail the model would see is lost.
+    Other formats are returned unchanged.
+
+    Args:
+        image: Image returned by Image.open (not yet loaded)
+        target_side: Longest side the model will resize to
+
+    Returns:
+        (image, scale) where scale = original width / decoded width
+    """
+    width, height = image.size
+    longest = max(width, height)
+    if image.format != "JPEG" or longest <= target_side:
+        return image, 1.0
+
+    ratio = target_side / longest
+    image.draft("RGB", (int(width * ratio), int(height * ratio)))
+    return image, width / image.size[0]
+
+
+def reduced_decode_cv2(data: bytes, width: int, height: int,
+                       target_side: int = MODEL_INPUT_SIZE) -> Tuple["np.ndarray", float]:
+    """
+    Decode a JPEG with OpenCV's reduced decoding flags
+
+    Args:
+        data: Encoded image bytes
+        width, height: Original dimensions (e.g. from the PIL header)
+        target_side: Longest side the model will resize to
+
+    Returns:
+        (BGR array, scale) where scale = original width / decoded width
+    """
+    import cv2
+    import numpy as np
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    longest = max(width, height)
+    flag = cv2.IMREAD_COLOR
+    for factor, name in _CV2_REDUCED_FLAGS.items():
+        if longest / factor >= target_side:
+            flag = getattr(cv2, name)
+            break
+    img = cv2.imdecode(buf, flag)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img, width / img.shape[1]
+
+
+def _encode_test_jpeg(width: int, height: int, quality: int = 90) -> bytes:
+    """Create a JPEG with camera-like content (gradients plus texture)"""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[..., 0] = (x * 255 // max(1, width - 1))
+    img[..., 1] = (y * 255 // max(1, height - 1))
+    img[..., 2] = rng.integers(0, 64, (height, width), dtype=np.uint8) + 96
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def benchmark(resolutions: Dict[str, Tuple[int, int]] = CAMERA_RESOLUTIONS,
+              repeats: int = 5, target_side: int = MODEL_INPUT_SIZE) -> List[Dict]:
+    """
+    Compare full and reduced decoding for each resolution
+
+    Returns:
+        One row per resolution with median decode times in milliseconds
+    """
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    def timed(fn) -> float:
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return float(np.median(samples))
+
+    rows = []
+    for name, (width, height) in resolutions.items():
+        data = _encode_test_jpeg(width, height)
+
+        def pil_full():
+            img = Image.open(io.BytesIO(data))
+            img.load()
+
+        def pil_draft():
+            img, _ = reduced_decode(Image.open(io.BytesIO(data)), target_side)
+            img.load()
+
+        def cv2_full():
+            cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        def cv2_reduced():
+            reduced_decode_cv2(data, width, height, target_side)
+
+        decoded, scale = reduced_decode(Image.open(io.BytesIO(data)), target_side)
+        rows.append({
+            "resolution": name,
+            "size": f"{width}x{height}",
+            "decoded_size": f"{decoded.size[0]}x{decoded.size[1]}",
+            "scale": scale,
+            "pil_full_ms": timed(pil_full),
+            "pil_draft_ms": timed(pil_draft),
+            "cv2_full_ms": timed(cv2_full),
+            "cv2_reduced_ms": timed(cv2_reduced)
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full vs reduced JPEG decoding")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per measurement")
+    parser.add_argument("--target", type=int, default=MODEL_INPUT_SIZE, help="Model input size")
+
+    args = parser.parse_args()
+    rows = benchmark(repeats=args.repeats, target_side=args.target)
+
+    header = f"{'resolution':<10} {'size':>10} {'decoded':>10} {'PIL full':>9} {'PIL draft':>9} {'cv2 full':>9} {'cv2 reduced':>11}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['resolution']:<10} {row['size']:>10} {row['decoded_size']:>10} "
+              f"{row['pil_full_ms']:>7.1f}ms {row['pil_draft_ms']:>7.1f}ms "
+              f"{row['cv2_full_ms']:>7.1f}ms {row['cv2_reduced_ms']:>9.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
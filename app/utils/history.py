@@ -0,0 +1,395 @@
+"""
+Detection history for the Object Detection API
+Every served frame (with its stream, time, model and detections) can be kept
+in a SQLite database so past results are searchable without re-running
+inference, e.g. "frames from camera X with a truck in this region in the
+last hour". Frames are handed to a background writer thread through a
+bounded queue and written in batches, one transaction per batch, so
+requests never wait on the disk; when the queue is full frames are dropped
+and counted instead. Boxes are also kept in an R-tree for region searches
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.models.yolo_model import YOLOModel
+
+# Region as (x1, y1, x2, y2) in original image pixels
+Region = Tuple[float, float, float, float]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    id INTEGER PRIMARY KEY,
+    stream TEXT,
+    ts REAL NOT NULL,
+    source TEXT NOT NULL,
+    model TEXT,
+    model_version TEXT,
+    image_url TEXT,
+    result_image_url TEXT,
+    objects INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS frames_stream_ts ON frames (stream, ts);
+CREATE INDEX IF NOT EXISTS frames_ts ON frames (ts);
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    frame_id INTEGER NOT NULL REFERENCES frames (id),
+    class_id INTEGER NOT NULL,
+    confidence REAL NOT NULL,
+    x1 REAL NOT NULL,
+    y1 REAL NOT NULL,
+    x2 REAL NOT NULL,
+    y2 REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_frame ON detections (frame_id);
+CREATE INDEX IF NOT EXISTS detections_class_frame ON detections (class_id, frame_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS detection_boxes USING rtree (id, x1, x2, y1, y2);
+"""
+
+# Queue item that stops the writer
+_STOP = object()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Several workers may write the same file
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def _frame_dict(row: Sequence) -> Dict[str, Any]:
+    frame_id, stream, ts, source, model, model_version, image_url, result_image_url, objects = row
+    return {
+        "id": frame_id,
+        "stream_id": stream,
+        "time": ts,
+        "source": source,
+        "model": model,
+        "model_version": model_version,
+        "original_image_url": image_url,
+        "result_image_url": result_image_url,
+        "objects": objects,
+        "objects_detected": []
+    }
+
+
+class DetectionHistory:
+    """
+    Persistent, indexed store of served detections
+
+    Args:
+        path: SQLite database file, None to disable the history
+        batch_size: Most frames written per transaction
+        flush_interval: Seconds the writer waits for a batch to fill up
+        queue_size: Frames buffered for the writer before new ones are dropped
+        retention_days: Frames older than this are deleted (0 keeps everything)
+    """
+
+    def __init__(self, path: Optional[str] = None, batch_size: int = 500, flush_interval: float = 0.5,
+                 queue_size: int = 10000, retention_days: float = 7.0):
+        self.path = path
+        self.enabled = bool(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+        self._reader: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.counts = {"recorded": 0, "written": 0, "dropped": 0, "batches": 0, "errors": 0, "purged": 0}
+
+    @classmethod
+    def from_env(cls) -> "DetectionHistory":
+        """
+        Create a history configured from environment variables
+
+        - DETECTION_HISTORY_DB: SQLite file to keep detections in (default: no history)
+        - HISTORY_BATCH_SIZE: most frames per write transaction (default 500)
+        - HISTORY_FLUSH_INTERVAL_S: how long the writer waits to fill a batch (default 0.5)
+        - HISTORY_QUEUE_SIZE: frames buffered before dropping (default 10000)
+        - HISTORY_RETENTION_DAYS: age after which frames are deleted (default 7, 0 keeps all)
+        """
+        return cls(
+            path=os.environ.get("DETECTION_HISTORY_DB") or None,
+            batch_size=int(os.environ.get("HISTORY_BATCH_SIZE", "500")),
+            flush_interval=float(os.environ.get("HISTORY_FLUSH_INTERVAL_S", "0.5")),
+            queue_size=int(os.environ.get("HISTORY_QUEUE_SIZE", "10000")),
+            retention_days=float(os.environ.get("HISTORY_RETENTION_DAYS", "7"))
+        )
+
+    def _open(self) -> sqlite3.Connection:
+        """Connect and create the schema if needed"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = _connect(self.path)
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _ensure_writer(self):
+        # Threads do not survive fork(): a pre-forked worker starts its own writer
+        if self._writer is not None and self._writer_pid == os.getpid() and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._writer is not None and self._writer_pid == os.getpid() and self._writer.is_alive():
+                return
+            self._writer = threading.Thread(target=self._run, name="detection-history-writer", daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+
+    def record(
+        self,
+        stream_id: Optional[str],
+        detections: List[Dict[str, Any]],
+        source: str,
+        model: Optional[str] = None,
+        model_version: Optional[str] = None,
+        image_url: Optional[str] = None,
+        result_image_url: Optional[str] = None,
+        scale: float = 1.0,
+        now: Optional[float] = None
+    ) -> bool:
+        """
+        Queue one served frame for writing; never blocks
+
+        Args:
+            stream_id: Camera/stream the frame belongs to, if any
+            detections: Detections of the frame
+            source: Endpoint that served it ("detect", "binary")
+            model: Model name
+            model_version: Model version
+            image_url: URL of the uploaded image, if kept
+            result_image_url: URL of the annotated image, if rendered
+            scale: Factor mapping the boxes to original image coordinates
+            now: Frame time as time.time() (default: now)
+
+        Returns:
+            Whether the frame was queued (False if disabled or the queue is full)
+        """
+        if not self.enabled:
+            return False
+        boxes = [
+            (det["class_id"], det["confidence"], det["bbox"]["x1"] * scale, det["bbox"]["y1"] * scale,
+             det["bbox"]["x2"] * scale, det["bbox"]["y2"] * scale)
+            for det in detections
+        ]
+        frame = (stream_id, time.time() if now is None else now, source, model, model_version,
+                 image_url, result_image_url, len(boxes))
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((frame, boxes))
+        except queue.Full:
+            self.counts["dropped"] += 1
+            return False
+        self.counts["recorded"] += 1
+        return True
+
+    def _run(self):
+        """Writer thread: drain the queue in batches until stopped"""
+        conn = self._open()
+        last_purge = float("-inf")
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                pass  # Idle: only check whether a purge is due
+            else:
+                # Collect a batch for up to flush_interval seconds
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+            if batch:
+                self._write(conn, batch)
+            if self.retention_days and time.monotonic() - last_purge >= 3600:
+                last_purge = time.monotonic()
+                self._purge(conn)
+        conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: List[Tuple[Tuple, List[Tuple]]]):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for frame, boxes in batch:
+                frame_id = conn.execute(
+                    "INSERT INTO frames (stream, ts, source, model, model_version, image_url, "
+                    "result_image_url, objects) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", frame
+                ).lastrowid
+                for class_id, confidence, x1, y1, x2, y2 in boxes:
+                    detection_id = conn.execute(
+                        "INSERT INTO detections (frame_id, class_id, confidence, x1, y1, x2, y2) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", (frame_id, class_id, confidence, x1, y1, x2, y2)
+                    ).lastrowid
+                    conn.execute("INSERT INTO detection_boxes (id, x1, x2, y1, y2) VALUES (?, ?, ?, ?, ?)",
+                                 (detection_id, x1, x2, y1, y2))
+            conn.execute("COMMIT")
+            self.counts["written"] += len(batch)
+            self.counts["batches"] += 1
+        except sqlite3.Error as e:
+            print(f"Could not write {len(batch)} frames to the detection history: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.counts["errors"] += 1
+
+    def _purge(self, conn: sqlite3.Connection):
+        """Delete frames older than the retention period"""
+        cutoff = time.time() - self.retention_days * 86400
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            old = "SELECT id FROM frames WHERE ts < ?"
+            conn.execute(f"DELETE FROM detection_boxes WHERE id IN "
+                         f"(SELECT id FROM detections WHERE frame_id IN ({old}))", (cutoff,))
+            conn.execute(f"DELETE FROM detections WHERE frame_id IN ({old})", (cutoff,))
+            purged = conn.execute("DELETE FROM frames WHERE ts < ?", (cutoff,)).rowcount
+            conn.execute("COMMIT")
+            self.counts["purged"] += purged
+        except sqlite3.Error as e:
+            print(f"Could not purge the detection history: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    def close(self, timeout: float = 10.0):
+        """Write out the queued frames and stop the writer"""
+        writer = self._writer
+        if writer is None or self._writer_pid != os.getpid() or not writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        writer.join(timeout)
+        self._writer = None
+
+    def query(
+        self,
+        stream_id: Optional[str] = None,
+        classes: Optional[List[int]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        region: Optional[Region] = None,
+        min_confidence: Optional[float] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Find past frames, newest first
+
+        A frame matches when it has at least one detection of the given
+        classes, at or above `min_confidence`, whose box overlaps `region`;
+        without class, confidence or region filters every frame in the
+        stream and time range matches. Each frame lists all of its detections.
+
+        Args:
+            stream_id: Only frames of this stream
+            classes: Class IDs to look for
+            start: Earliest frame time (epoch seconds)
+            end: Latest frame time (epoch seconds)
+            region: (x1, y1, x2, y2) in original image pixels
+            min_confidence: Lowest detection confidence that counts
+            limit: Frames per page
+            cursor: next_cursor of the previous page
+
+        Returns:
+            {"frames": [...], "next_cursor": str or None when there are no more}
+
+        Raises:
+            RuntimeError: If the history is disabled
+            ValueError: For a malformed cursor or region
+        """
+        if not self.enabled:
+            raise RuntimeError("Detection history is disabled (set DETECTION_HISTORY_DB)")
+        where, args = [], []
+        if stream_id is not None:
+            where.append("f.stream = ?")
+            args.append(stream_id)
+        if start is not None:
+            where.append("f.ts >= ?")
+            args.append(start)
+        if end is not None:
+            where.append("f.ts <= ?")
+            args.append(end)
+        if cursor:
+            try:
+                cursor_ts, cursor_id = cursor.split("_")
+                cursor_ts, cursor_id = float(cursor_ts), int(cursor_id)
+            except ValueError:
+                raise ValueError(f"Invalid cursor '{cursor}'") from None
+            where.append("(f.ts < ? OR (f.ts = ? AND f.id < ?))")
+            args.extend([cursor_ts, cursor_ts, cursor_id])
+
+        detection_where, detection_args = [], []
+        if classes:
+            detection_where.append(f"d.class_id IN ({', '.join('?' * len(classes))})")
+            detection_args.extend(classes)
+        if min_confidence is not None:
+            detection_where.append("d.confidence >= ?")
+            detection_args.append(min_confidence)
+        if region is not None:
+            x1, y1, x2, y2 = region
+            if x2 < x1 or y2 < y1:
+                raise ValueError("Region must be x1,y1,x2,y2 with x1 <= x2 and y1 <= y2")
+            detection_where.append("b.x1 <= ? AND b.x2 >= ? AND b.y1 <= ? AND b.y2 >= ?")
+            detection_args.extend([x2, x1, y2, y1])
+        if detection_where:
+            boxes = "JOIN detection_boxes b ON b.id = d.id" if region is not None else ""
+            if region is not None and stream_id is None and start is None:
+                # Nothing narrows the frames down: let the R-tree find the boxes first
+                where.append(f"f.id IN (SELECT d.frame_id FROM detections d {boxes} "
+                             f"WHERE {' AND '.join(detection_where)})")
+            else:
+                # Walk the stream/time index and check each frame's boxes by id
+                where.append(f"EXISTS (SELECT 1 FROM detections d {boxes} "
+                             f"WHERE d.frame_id = f.id AND {' AND '.join(detection_where)})")
+            args.extend(detection_args)
+
+        limit = max(1, min(int(limit), 1000))
+        sql = ("SELECT f.id, f.stream, f.ts, f.source, f.model, f.model_version, f.image_url, "
+               "f.result_image_url, f.objects FROM frames f"
+               + (f" WHERE {' AND '.join(where)}" if where else "")
+               + " ORDER BY f.ts DESC, f.id DESC LIMIT ?")
+        with self._lock:
+            if self._reader is None:
+                self._reader = self._open()
+            rows = self._reader.execute(sql, args + [limit + 1]).fetchall()
+            frames = [_frame_dict(row) for row in rows[:limit]]
+            by_id = {frame["id"]: frame for frame in frames}
+            if by_id:
+                detections = self._reader.execute(
+                    f"SELECT frame_id, class_id, confidence, x1, y1, x2, y2 FROM detections "
+                    f"WHERE frame_id IN ({', '.join('?' * len(by_id))}) ORDER BY id", list(by_id)
+                ).fetchall()
+                for frame_id, class_id, confidence, x1, y1, x2, y2 in detections:
+                    by_id[frame_id]["objects_detected"].append({
+                        "class_id": class_id,
+                        "class_name": YOLOModel.CLASS_NAMES.get(class_id, "unknown"),
+                        "confidence": confidence,
+                        "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2, "width": x2 - x1, "height": y2 - y1}
+                    })
+        next_cursor = None
+        if len(rows) > limit:
+            last = frames[-1]
+            next_cursor = f"{last['time']!r}_{last['id']}"
+        return {"frames": frames, "next_cursor": next_cursor}
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "retention_days": self.retention_days,
+            **self.counts
+        }
+
+
+# Shared history for this process
+history = DetectionHistory.from_env()
@@ -0,0 +1,221 @@
+"""
+Job state storage for the asynchronous job API
+Jobs are JSON-serialisable dicts. Finished jobs carry an expiry time and are
+dropped after their TTL. The backend is chosen with JOB_STORE:
+
+- "memory" (default): this process only
+- "sqlite:///path/to/jobs.db": survives restarts, shared by workers on one host
+- "redis://host:port/db": shared by all workers (needs the redis package)
+- "local-redis": the Redis store on an in-process stand-in (development/tests)
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+JOB_STORE = os.environ.get("JOB_STORE", "memory")
+
+Job = Dict[str, Any]
+
+
+class JobStore(ABC):
+    """Interface of a job store"""
+
+    @abstractmethod
+    def save(self, job: Job, ttl: Optional[float] = None):
+        """
+        Insert or replace a job
+
+        Args:
+            job: Job record with an "id"
+            ttl: Seconds to keep the job from now (None keeps it until it is saved with a TTL)
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return a job, or None if it does not exist or has expired"""
+
+    @abstractmethod
+    def delete(self, job_id: str) -> bool:
+        """Remove a job; returns whether it existed"""
+
+    @abstractmethod
+    def unfinished(self) -> List[Job]:
+        """Return the jobs saved without a TTL, i.e. not finished yet"""
+
+    def purge_expired(self) -> int:
+        """Remove expired jobs; returns how many were removed"""
+        return 0
+
+
+def _expires_at(ttl: Optional[float]) -> Optional[float]:
+    return time.time() + ttl if ttl is not None else None
+
+
+class MemoryJobStore(JobStore):
+    """Jobs kept in a dict in this process"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._expiry: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: Job, ttl: Optional[float] = None):
+        with self._lock:
+            # Store a serialised copy so callers cannot mutate stored state
+            self._jobs[job["id"]] = json.loads(json.dumps(job))
+            expires_at = _expires_at(ttl)
+            if expires_at is None:
+                self._expiry.pop(job["id"], None)
+            else:
+                self._expiry[job["id"]] = expires_at
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            expires_at = self._expiry.get(job_id)
+            if expires_at is not None and expires_at <= time.time():
+                self._jobs.pop(job_id, None)
+                del self._expiry[job_id]
+                return None
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job is not None else None
+
+    def delete(self, job_id: str) -> bool:
+        with self._lock:
+            self._expiry.pop(job_id, None)
+            return self._jobs.pop(job_id, None) is not None
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            return [json.loads(json.dumps(job)) for job_id, job in self._jobs.items() if job_id not in self._expiry]
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, expires_at in self._expiry.items() if expires_at <= now]
+            for job_id in expired:
+                self._jobs.pop(job_id, None)
+                del self._expiry[job_id]
+        return len(expired)
+
+
+class SQLiteJobStore(JobStore):
+    """Jobs kept in a SQLite database file"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+
+    def save(self, job: Job, ttl: Optional[float] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, data, expires_at) VALUES (?, ?, ?)",
+                (job["id"], json.dumps(job), _expires_at(ttl))
+            )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (job_id, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, job_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM jobs WHERE expires_at IS NULL").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            ).rowcount
+
+
+class RedisJobStore(JobStore):
+    """
+    Jobs kept in Redis (or a compatible client); Redis expires them itself.
+    A set indexes the jobs saved without a TTL
+    """
+
+    def __init__(self, client, prefix: str = "job:"):
+        self.client = client
+        self.prefix = prefix
+        self.unfinished_key = prefix + "unfinished"
+
+    def save(self, job: Job, ttl: Optional[float] = None):
+        px = max(1, math.ceil(ttl * 1000)) if ttl is not None else None
+        self.client.set(self.prefix + job["id"], json.dumps(job), px=px)
+        if ttl is None:
+            self.client.sadd(self.unfinished_key, job["id"])
+        else:
+            self.client.srem(self.unfinished_key, job["id"])
+
+    def get(self, job_id: str) -> Optional[Job]:
+        data = self.client.get(self.prefix + job_id)
+        return json.loads(data) if data is not None else None
+
+    def delete(self, job_id: str) -> bool:
+        self.client.srem(self.unfinished_key, job_id)
+        return self.client.delete(self.prefix + job_id) > 0
+
+    def unfinished(self) -> List[Job]:
+        jobs = []
+        for job_id in self.client.smembers(self.unfinished_key):
+            job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+            job = self.get(job_id)
+            if job is None:
+                self.client.srem(self.unfinished_key, job_id)
+            else:
+                jobs.append(job)
+        return jobs
+
+
+def redis_client(url: str):
+    """
+    Create a Redis client for `url`, or the in-process stand-in for "local-redis"
+
+    Raises:
+        RuntimeError: If the redis package is not installed
+    """
+    if url == "local-redis":
+        from app.utils.local_redis import shared_local_redis
+        return shared_local_redis()
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError(f"The redis package is required for {url}: pip install redis")
+    return redis.Redis.from_url(url)
+
+
+def create_job_store(url: str = JOB_STORE) -> JobStore:
+    """
+    Create a job store from a JOB_STORE value
+
+    Raises:
+        ValueError: For an unknown store URL
+    """
+    if url == "memory":
+        return MemoryJobStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteJobStore(url[len("sqlite:///"):])
+    if url == "local-redis" or url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobStore(redis_client(url))
+    raise ValueError(f"Unknown job store '{url}'. Expected memory, sqlite:///path, redis://... or local-redis")
@@ -0,0 +1,386 @@
+"""
+Asynchronous jobs for the Object Detection API
+Submitting a job returns immediately; the work runs later through the
+admission controller (as batch priority by default), so it shares the
+inference pool with /detect without holding a client connection open.
+Finished jobs are kept in the job store for JOB_TTL_S seconds and can be
+announced to a webhook. Each job runs in the process that accepted it; that
+process renews a lease on its unfinished jobs, and jobs whose lease lapsed
+(the process died or restarted) are marked failed by whichever process sees
+them next
+"""
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from starlette.concurrency import run_in_threadpool
+
+from app.utils.admission import admission, AdmissionRejected
+from app.utils.job_store import Job, JobStore, create_job_store
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    """Refuse webhook redirects, which could point at hosts the URL check never saw"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        raise urllib.error.HTTPError(req.full_url, code, f"Redirect to {newurl} refused", headers, fp)
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirects)
+
+
+def _is_public(address: str) -> bool:
+    """Whether an IP address is globally routable (not loopback, private, link-local...)"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class JobsBusy(Exception):
+    """Raised when too many jobs are pending to accept another"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class JobManager:
+    """
+    Runs submitted jobs in the background and records their state
+
+    Args:
+        store: Where job state is kept
+        ttl: Seconds finished jobs are kept
+        concurrency: Jobs competing for admission at once; the rest wait
+                     here so bulk work does not fill the admission queue
+        max_pending: Jobs accepted but not finished before new ones get 429
+        webhook_timeout: Seconds per webhook attempt
+        webhook_retries: Webhook attempts before giving up
+        webhook_allowed_hosts: If given, the only webhook hosts accepted ("*.example.com"
+                               matches subdomains); these may also be internal
+        webhook_allow_private: Accept webhooks resolving to loopback, private or
+                               link-local addresses
+        lease: Seconds an unfinished job stays owned by this process without a
+               renewal; renewed every lease / 3 seconds
+    """
+
+    def __init__(self, store: JobStore, ttl: float = 3600.0, concurrency: int = 1,
+                 max_pending: int = 1000, webhook_timeout: float = 5.0, webhook_retries: int = 3,
+                 webhook_allowed_hosts: Optional[List[str]] = None, webhook_allow_private: bool = False,
+                 lease: float = 60.0):
+        self.store = store
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = webhook_retries
+        self.webhook_allowed_hosts = [host.lower() for host in webhook_allowed_hosts or []]
+        self.webhook_allow_private = webhook_allow_private
+        self.lease = lease
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._save_lock: Optional[asyncio.Lock] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._active: Dict[str, Job] = {}
+        self._purge_task: Optional[asyncio.Task] = None
+        self._lease_task: Optional[asyncio.Task] = None
+        self.counts = {"submitted": 0, SUCCEEDED: 0, FAILED: 0, "orphaned": 0,
+                       "webhooks_delivered": 0, "webhooks_failed": 0}
+
+    @classmethod
+    def from_env(cls) -> "JobManager":
+        """
+        Create a manager configured from environment variables
+
+        - JOB_STORE: memory (default), sqlite:///path, redis://... or local-redis
+        - JOB_TTL_S: seconds finished jobs are kept (default 3600)
+        - JOB_CONCURRENCY: jobs competing for admission at once (default 1)
+        - MAX_PENDING_JOBS: unfinished jobs accepted (default 1000)
+        - WEBHOOK_TIMEOUT_S / WEBHOOK_RETRIES: webhook delivery (defaults 5 and 3)
+        - WEBHOOK_ALLOWED_HOSTS: comma-separated webhook hosts accepted (default: any public host)
+        - WEBHOOK_ALLOW_PRIVATE: "1" to accept webhooks on loopback, private or
+          link-local addresses (default off)
+        - JOB_LEASE_S: seconds before an unfinished job of a vanished process is
+          marked failed (default 60)
+        """
+        return cls(
+            store=create_job_store(),
+            ttl=float(os.environ.get("JOB_TTL_S", "3600")),
+            concurrency=int(os.environ.get("JOB_CONCURRENCY", "1")),
+            max_pending=int(os.environ.get("MAX_PENDING_JOBS", "1000")),
+            webhook_timeout=float(os.environ.get("WEBHOOK_TIMEOUT_S", "5")),
+            webhook_retries=int(os.environ.get("WEBHOOK_RETRIES", "3")),
+            webhook_allowed_hosts=[
+                host.strip() for host in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+            ],
+            webhook_allow_private=os.environ.get("WEBHOOK_ALLOW_PRIVATE", "0") == "1",
+            lease=float(os.environ.get("JOB_LEASE_S", "60"))
+        )
+
+    def check_webhook(self, url: str):
+        """
+        Check that a webhook URL may be called (resolves its host; blocking)
+
+        Raises:
+            ValueError: If the URL is not http(s), its host is not allowed, or it
+                        resolves to a non-public address while those are refused
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("webhook_url must be an http(s) URL")
+        host = parts.hostname.lower()
+        if self.webhook_allowed_hosts:
+            if not any(host == allowed or (allowed.startswith("*.") and host.endswith(allowed[1:]))
+                       for allowed in self.webhook_allowed_hosts):
+                raise ValueError(f"Webhook host '{host}' is not allowed")
+            return
+        if self.webhook_allow_private:
+            return
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 80, proto=socket.IPPROTO_TCP)}
+        except (socket.gaierror, UnicodeError) as e:
+            raise ValueError(f"Cannot resolve webhook host '{host}': {e}")
+        if not all(_is_public(address) for address in addresses):
+            raise ValueError(f"Webhook host '{host}' resolves to a private or local address")
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def submit(
+        self,
+        work: Callable[[], Any],
+        kind: str = "detect",
+        priority: str = "batch",
+        webhook_url: Optional[str] = None,
+        **meta: Any
+    ) -> Job:
+        """
+        Record a job and schedule it
+
+        Args:
+            work: Blocking callable producing the JSON-serialisable result;
+                  runs in the threadpool once admitted
+            kind: Job type, for clients
+            priority: Admission priority class
+            webhook_url: URL to POST the finished job to
+            **meta: Extra fields stored with the job
+
+        Returns:
+            The queued job
+
+        Raises:
+            JobsBusy: If MAX_PENDING_JOBS jobs are already pending
+        """
+        if self.pending >= self.max_pending:
+            raise JobsBusy(f"{self.pending} jobs pending, try again later", retry_after=30)
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "priority": priority,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "webhook_url": webhook_url,
+            "webhook": None,
+            "worker": self.worker_id,
+            "lease_until": now + self.lease,
+            **meta
+        }
+        self._active[job["id"]] = job
+        await self._save(job)
+        self.counts["submitted"] += 1
+
+        task = asyncio.get_running_loop().create_task(self._run(job, work))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await run_in_threadpool(self.store.get, job_id)
+
+    def _store_lock(self) -> asyncio.Lock:
+        if self._save_lock is None:
+            self._save_lock = asyncio.Lock()
+        return self._save_lock
+
+    async def _save(self, job: Job, ttl: Optional[float] = None):
+        """Save a snapshot of the job; saves are serialised so a lease renewal never lands after the final save"""
+        async with self._store_lock():
+            await run_in_threadpool(self.store.save, dict(job), ttl)
+
+    async def _run(self, job: Job, work: Callable[[], Any]):
+        """Wait for a slot and admission, run the work and record the outcome"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self._slots:
+                while True:
+                    try:
+                        async with admission.admit(job["priority"], None):
+                            job.update(status=RUNNING, started_at=time.time(), updated_at=time.time())
+                            await self._save(job)
+                            result = await run_in_threadpool(work)
+                        break
+                    except AdmissionRejected as e:
+                        # Queue full of interactive traffic: wait our turn
+                        await asyncio.sleep(e.retry_after)
+            job.update(status=SUCCEEDED, result=result)
+        except Exception as e:
+            print(f"Job {job['id']} failed: {e}")
+            job.update(status=FAILED, error=str(e))
+        self._active.pop(job["id"], None)
+        await self._finish(job)
+
+    async def _finish(self, job: Job):
+        """Record a finished job with its TTL and announce it to its webhook"""
+        job.update(finished_at=time.time(), updated_at=time.time(), lease_until=None)
+        self.counts[job["status"]] += 1
+        await self._save(job, self.ttl)
+
+        if job.get("webhook_url"):
+            job["webhook"] = await run_in_threadpool(self._notify, job)
+            self.counts["webhooks_delivered" if job["webhook"]["delivered"] else "webhooks_failed"] += 1
+            await self._save(job, self.ttl)
+
+    async def renew_leases(self):
+        """Extend the lease of every job this process still has to finish"""
+        until = time.time() + self.lease
+        for job_id in list(self._active):
+            async with self._store_lock():
+                # Checked under the lock: a job that has finished meanwhile must keep its final record
+                job = self._active.get(job_id)
+                if job is None:
+                    continue
+                job["lease_until"] = until
+                await run_in_threadpool(self.store.save, dict(job))
+
+    async def fail_orphans(self) -> int:
+        """
+        Mark failed the unfinished jobs whose owner stopped renewing their lease
+
+        Their work only existed in the memory of a process that has died or
+        restarted, so nothing would ever finish them.
+
+        Returns:
+            Jobs marked failed
+        """
+        now = time.time()
+        orphans = [
+            job for job in await run_in_threadpool(self.store.unfinished)
+            if job["id"] not in self._active and (job.get("lease_until") or job["updated_at"] + self.lease) < now
+        ]
+        for job in orphans:
+            print(f"Job {job['id']} was orphaned by worker {job.get('worker')}; marking it failed")
+            job.update(status=FAILED, error="The worker running this job stopped before it finished")
+            self.counts["orphaned"] += 1
+            await self._finish(job)
+        return len(orphans)
+
+    def _notify(self, job: Job) -> Dict[str, Any]:
+        """POST the finished job to its webhook, retrying with backoff"""
+        body = json.dumps({key: value for key, value in job.items() if key != "webhook"}).encode()
+        status, error = None, None
+        for attempt in range(1, self.webhook_retries + 1):
+            try:
+                # Again at delivery: the host may resolve differently by now
+                self.check_webhook(job["webhook_url"])
+            except ValueError as e:
+                print(f"Webhook for job {job['id']} refused: {e}")
+                return {"delivered": False, "attempts": attempt - 1, "status": None, "error": str(e)}
+            request = urllib.request.Request(
+                job["webhook_url"], data=body, method="POST",
+                headers={"Content-Type": "application/json", "X-Job-Id": job["id"]}
+            )
+            try:
+                with _webhook_opener.open(request, timeout=self.webhook_timeout) as response:
+                    status = response.status
+                return {"delivered": True, "attempts": attempt, "status": status, "error": None}
+            except Exception as e:
+                status = getattr(e, "code", None)
+                error = str(e)
+                print(f"Webhook for job {job['id']} failed (attempt {attempt}): {e}")
+                if attempt < self.webhook_retries:
+                    time.sleep(2 ** (attempt - 1))
+        return {"delivered": False, "attempts": self.webhook_retries, "status": status, "error": error}
+
+    async def purge_loop(self, interval: float = 60.0):
+        """Periodically fail orphaned jobs and drop expired ones from the store"""
+        while True:
+            try:
+                await self.fail_orphans()
+            except Exception as e:
+                print(f"Error checking for orphaned jobs: {e}")
+            await asyncio.sleep(interval)
+            try:
+                removed = await run_in_threadpool(self.store.purge_expired)
+                if removed:
+                    print(f"Purged {removed} expired jobs")
+            except Exception as e:
+                print(f"Error purging expired jobs: {e}")
+
+    async def lease_loop(self):
+        """Renew this process's job leases every lease / 3 seconds"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.renew_leases()
+            except Exception as e:
+                print(f"Error renewing job leases: {e}")
+
+    async def drain(self, timeout: float = 30.0) -> int:
+        """
+        Wait for pending jobs to finish (call from a shutdown hook)
+
+        Returns:
+            Jobs still unfinished after `timeout` seconds
+        """
+        if self._tasks:
+            print(f"Waiting up to {timeout:.0f}s for {len(self._tasks)} pending jobs")
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        return len(self._tasks)
+
+    def start(self):
+        """Start background maintenance (call from a startup hook); orphaned jobs are failed right away"""
+        if self._purge_task is None:
+            self._purge_task = asyncio.get_running_loop().create_task(self.purge_loop())
+        if self._lease_task is None:
+            self._lease_task = asyncio.get_running_loop().create_task(self.lease_loop())
+
+    def stats(self) -> Dict:
+        return {
+            "store": type(self.store).__name__,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "concurrency": self.concurrency,
+            "ttl_s": self.ttl,
+            "lease_s": self.lease,
+            "worker": self.worker_id,
+            **self.counts
+        }
+
+
+# Shared job manager for this process
+jobs = JobManager.from_env()
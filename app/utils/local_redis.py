@@ -0,0 +1,269 @@
+"""
+In-process stand-in for the subset of the Redis client API we use
+Lets the Redis-backed components (job store, inference queue) run in
+development and tests without a Redis server. Strings are stored as bytes,
+keys expire like in Redis and blocking list pops wait on a condition
+variable. State lives in this process only
+"""
+import threading
+import time
+from collections import deque
+from fnmatch import fnmatchcase
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+Value = Union[bytes, str, int, float]
+
+
+def _encode(value: Value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class LocalRedis:
+    """Thread-safe in-memory key/value store mimicking redis.Redis"""
+
+    def __init__(self):
+        # key -> bytes (string), deque (list), set or dict (hash)
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+
+    def _alive(self, key: str) -> bool:
+        """Drop `key` if it has expired (lock held)"""
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._data.pop(key, None)
+            del self._expires[key]
+        return key in self._data
+
+    def _get(self, key: str, kind: type, create: bool = False):
+        """Value of `key`, which must be of type `kind` (lock held)"""
+        if not self._alive(key):
+            if not create:
+                return None
+            self._data[key] = kind()
+        value = self._data[key]
+        if not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _drop_if_empty(self, key: str):
+        """Remove an emptied list, set or hash like Redis does (lock held)"""
+        if key in self._data and not self._data[key]:
+            del self._data[key]
+            self._expires.pop(key, None)
+
+    def ping(self) -> bool:
+        return True
+
+    # Strings
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            return self._get(name, bytes)
+
+    def set(self, name: str, value: Value, ex: Optional[int] = None, px: Optional[int] = None,
+            nx: bool = False) -> Optional[bool]:
+        with self._lock:
+            if nx and self._alive(name):
+                return None
+            self._data[name] = _encode(value)
+            if ex is not None or px is not None:
+                self._expires[name] = time.time() + (ex if ex is not None else px / 1000)
+            else:
+                self._expires.pop(name, None)
+            return True
+
+    # Keys
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            removed = 0
+            for name in names:
+                if self._alive(name):
+                    del self._data[name]
+                    self._expires.pop(name, None)
+                    removed += 1
+            return removed
+
+    def exists(self, *names: str) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._alive(name))
+
+    def expire(self, name: str, time_seconds: int) -> bool:
+        return self.pexpire(name, int(time_seconds * 1000))
+
+    def pexpire(self, name: str, time_ms: int) -> bool:
+        with self._lock:
+            if not self._alive(name):
+                return False
+            self._expires[name] = time.time() + time_ms / 1000
+            return True
+
+    def ttl(self, name: str) -> int:
+        with self._lock:
+            if not self._alive(name):
+                return -2
+            expires = self._expires.get(name)
+            return -1 if expires is None else max(0, int(round(expires - time.time())))
+
+    def scan_iter(self, match: Optional[str] = None) -> Iterator[bytes]:
+        with self._lock:
+            keys = [key for key in list(self._data) if self._alive(key)]
+        for key in keys:
+            if match is None or fnmatchcase(key, match):
+                yield key.encode()
+
+    # Lists
+
+    def lpush(self, name: str, *values: Value) -> int:
+        with self._lock:
+            items: Deque[bytes] = self._get(name, deque, create=True)
+            items.extendleft(_encode(value) for value in values)
+            self._changed.notify_all()
+            return len(items)
+
+    def rpush(self, name: str, *values: Value) -> int:
+        with self._lock:
+            items: Deque[bytes] = self._get(name, deque, create=True)
+            items.extend(_encode(value) for value in values)
+            self._changed.notify_all()
+            return len(items)
+
+    def llen(self, name: str) -> int:
+        with self._lock:
+            items = self._get(name, deque)
+            return len(items) if items is not None else 0
+
+    def lrange(self, name: str, start: int, end: int) -> List[bytes]:
+        with self._lock:
+            items = list(self._get(name, deque) or ())
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def lrem(self, name: str, count: int, value: Value) -> int:
+        with self._lock:
+            items = self._get(name, deque)
+            if items is None:
+                return 0
+            value = _encode(value)
+            kept, removed = deque(), 0
+            for item in (items if count >= 0 else reversed(items)):
+                if item == value and (count == 0 or removed < abs(count)):
+                    removed += 1
+                else:
+                    kept.append(item)
+            if count < 0:
+                kept.reverse()
+            self._data[name] = kept
+            self._drop_if_empty(name)
+            return removed
+
+    def _pop(self, name: str, side: str) -> Optional[bytes]:
+        """Pop from the LEFT or RIGHT end of a list (lock held)"""
+        items = self._get(name, deque)
+        if not items:
+            return None
+        value = items.popleft() if side.upper() == "LEFT" else items.pop()
+        self._drop_if_empty(name)
+        return value
+
+    def lmove(self, first_list: str, second_list: str, src: str = "LEFT", dest: str = "RIGHT") -> Optional[bytes]:
+        with self._lock:
+            value = self._pop(first_list, src)
+            if value is not None:
+                target: Deque[bytes] = self._get(second_list, deque, create=True)
+                if dest.upper() == "LEFT":
+                    target.appendleft(value)
+                else:
+                    target.append(value)
+                self._changed.notify_all()
+            return value
+
+    def blmove(self, first_list: str, second_list: str, timeout: float,
+               src: str = "LEFT", dest: str = "RIGHT") -> Optional[bytes]:
+        deadline = time.time() + timeout if timeout else None
+        with self._lock:
+            while True:
+                value = self.lmove(first_list, second_list, src, dest)
+                if value is not None:
+                    return value
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def blpop(self, keys: Union[str, List[str]], timeout: float = 0) -> Optional[Tuple[bytes, bytes]]:
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        deadline = time.time() + timeout if timeout else None
+        with self._lock:
+            while True:
+                for key in keys:
+                    value = self._pop(key, "LEFT")
+                    if value is not None:
+                        return key.encode(), value
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    # Sets
+
+    def sadd(self, name: str, *values: Value) -> int:
+        with self._lock:
+            members: Set[bytes] = self._get(name, set, create=True)
+            before = len(members)
+            members.update(_encode(value) for value in values)
+            return len(members) - before
+
+    def srem(self, name: str, *values: Value) -> int:
+        with self._lock:
+            members = self._get(name, set)
+            if members is None:
+                return 0
+            before = len(members)
+            members.difference_update(_encode(value) for value in values)
+            removed = before - len(members)
+            self._drop_if_empty(name)
+            return removed
+
+    def smembers(self, name: str) -> Set[bytes]:
+        with self._lock:
+            return set(self._get(name, set) or ())
+
+    # Hashes
+
+    def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        with self._lock:
+            fields: Dict[bytes, bytes] = self._get(name, dict, create=True)
+            field = _encode(key)
+            value = int(fields.get(field, b"0")) + amount
+            fields[field] = _encode(value)
+            return value
+
+    def hdel(self, name: str, *keys: str) -> int:
+        with self._lock:
+            fields = self._get(name, dict)
+            if fields is None:
+                return 0
+            removed = sum(1 for key in keys if fields.pop(_encode(key), None) is not None)
+            self._drop_if_empty(name)
+            return removed
+
+    def info(self) -> Dict[str, Union[str, int]]:
+        with self._lock:
+            return {"redis_mode": "local", "keys": len(self._data)}
+
+
+_shared: Optional[LocalRedis] = None
+_shared_lock = threading.Lock()
+
+
+def shared_local_redis() -> LocalRedis:
+    """The process-wide stand-in, so every component using "local-redis" sees the same data"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LocalRedis()
+        return _shared
@@ -0,0 +1,289 @@
+"""
+Memory instrumentation and worker recycling for the Object Detection API
+Reports resident memory, Python heap and allocator statistics and, while
+tracing is on, which source lines allocated the memory that grew between
+two tracemalloc snapshots. Long-running workers can be recycled after a
+number of requests or once their RSS passes a threshold: the worker stops
+accepting connections, finishes its in-flight requests and jobs, and exits
+so its supervisor replaces it with a fresh process
+"""
+import ctypes
+import ctypes.util
+import gc
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Optional
+
+# Allocations made by these files are left out of tracemalloc reports
+_TRACE_IGNORE = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>")
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> Optional[int]:
+    """Resident set size of this process (cheap: one read of /proc/self/statm), None if unknown"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _MallInfo2(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_size_t) for name in (
+        "arena", "ordblks", "smblks", "hblks", "hblkhd", "usmblks", "fsmblks", "uordblks", "fordblks", "keepcost"
+    )]
+
+
+def malloc_stats() -> Optional[Dict[str, int]]:
+    """
+    glibc allocator statistics (mallinfo2), None on other C libraries
+
+    A large free_bytes next to a small in_use_bytes means the heap is
+    fragmented: memory freed by Python and libraries that malloc cannot
+    return to the OS.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        mallinfo2 = libc.mallinfo2
+    except (OSError, AttributeError):
+        return None
+    mallinfo2.restype = _MallInfo2
+    info = mallinfo2()
+    return {
+        "arena_bytes": info.arena,
+        "mmap_bytes": info.hblkhd,
+        "in_use_bytes": info.uordblks,
+        "free_bytes": info.fordblks,
+        "releasable_bytes": info.keepcost
+    }
+
+
+def heap_stats() -> Dict[str, Any]:
+    """Python garbage collector and object allocator statistics"""
+    return {
+        "gc_counts": gc.get_count(),
+        "gc_generations": gc.get_stats(),
+        "gc_frozen_objects": gc.get_freeze_count(),
+        "tracked_objects": len(gc.get_objects()),
+        "allocated_blocks": sys.getallocatedblocks(),
+        "malloc": malloc_stats()
+    }
+
+
+def torch_stats() -> Optional[Dict[str, Any]]:
+    """torch thread and CUDA allocator figures, None if torch has not been imported"""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return None
+    stats = {"threads": torch.get_num_threads(), "cuda": None}
+    if torch.cuda.is_initialized():
+        stats["cuda"] = {
+            "allocated_bytes": torch.cuda.memory_allocated(),
+            "reserved_bytes": torch.cuda.memory_reserved(),
+            "max_allocated_bytes": torch.cuda.max_memory_allocated()
+        }
+    return stats
+
+
+class MemoryTracer:
+    """
+    tracemalloc snapshots, each compared with the one before
+
+    Tracing slows allocations down noticeably, so it is off until started
+    (MEMORY_TRACE=1 or the admin endpoint).
+    """
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._previous_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        """Start tracing, keeping `frames` stack frames per allocation"""
+        with self._lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            tracemalloc.start(frames)
+            self._previous = None
+            self._previous_at = None
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+            self._previous_at = None
+
+    def diff(self, top: int = 20, key_type: str = "lineno") -> Dict[str, Any]:
+        """
+        Take a snapshot and list the allocation sites that grew most since the last one
+
+        Args:
+            top: Sites listed
+            key_type: "lineno", "filename" or "traceback"
+
+        Returns:
+            {"traced_bytes", "peak_bytes", "since" (time of the previous snapshot,
+             None for the first, whose "top" is then by size), "top": [...]}
+
+        Raises:
+            RuntimeError: If tracing is off
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc is not tracing (set MEMORY_TRACE=1 or start it first)")
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, pattern) for pattern in _TRACE_IGNORE]
+            )
+            current, peak = tracemalloc.get_traced_memory()
+            # The first snapshot is compared with an empty one, i.e. ranked by size
+            previous = self._previous or tracemalloc.Snapshot((), snapshot.traceback_limit)
+            entries = [{
+                "location": [str(frame) for frame in stat.traceback],
+                "size_bytes": stat.size,
+                "size_diff_bytes": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff
+            } for stat in snapshot.compare_to(previous, key_type)[:top]]
+            since = self._previous_at
+            self._previous, self._previous_at = snapshot, time.time()
+        return {"traced_bytes": current, "peak_bytes": peak, "since": since, "top": entries}
+
+
+def _terminate_self(reason: str):
+    """Default recycle action: ask the server in this process to shut down gracefully"""
+    from app.utils.prefork import notify_recycle
+
+    notify_recycle(reason)
+    # uvicorn stops accepting, waits for open requests and runs the shutdown hooks
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+class RecyclePolicy:
+    """
+    Decides when this worker should be replaced by a fresh process
+
+    Args:
+        max_requests: Recycle after this many requests (0: no limit)
+        jitter: Up to this many requests are added to max_requests at random,
+                so workers started together are not all recycled at once
+        max_rss_mb: Recycle once resident memory exceeds this (0: no limit)
+        check_interval: Seconds between two RSS checks
+        action: Called once with the reason when recycling starts
+    """
+
+    def __init__(self, max_requests: int = 0, jitter: int = 0, max_rss_mb: float = 0.0,
+                 check_interval: float = 5.0, action: Callable[[str], None] = _terminate_self):
+        self.base_max_requests = max_requests
+        self.jitter = jitter
+        self.max_rss_bytes = int(max_rss_mb * 1024 * 1024) if max_rss_mb else 0
+        self.check_interval = check_interval
+        self.action = action
+        self._lock = threading.Lock()
+        self.reset()
+
+    @classmethod
+    def from_env(cls) -> "RecyclePolicy":
+        """
+        Create a policy configured from environment variables
+
+        - WORKER_MAX_REQUESTS: requests before the worker is recycled (default 0: never)
+        - WORKER_MAX_REQUESTS_JITTER: random extra requests per worker (default 0)
+        - WORKER_MAX_RSS_MB: resident memory that triggers recycling (default 0: never)
+        - WORKER_RSS_CHECK_S: seconds between RSS checks (default 5)
+        """
+        return cls(
+            max_requests=int(os.environ.get("WORKER_MAX_REQUESTS", "0")),
+            jitter=int(os.environ.get("WORKER_MAX_REQUESTS_JITTER", "0")),
+            max_rss_mb=float(os.environ.get("WORKER_MAX_RSS_MB", "0")),
+            check_interval=float(os.environ.get("WORKER_RSS_CHECK_S", "5"))
+        )
+
+    def reset(self):
+        """Start counting afresh with a new jitter draw (e.g. in a newly forked worker)"""
+        jitter = random.randint(0, self.jitter) if self.base_max_requests and self.jitter > 0 else 0
+        self.max_requests = self.base_max_requests + jitter
+        self.requests = 0
+        self.reason: Optional[str] = None
+        self.recycling_at: Optional[float] = None
+        self.last_rss: Optional[int] = None
+        self._checked_at = float("-inf")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_requests or self.max_rss_bytes)
+
+    def request_done(self, count: int = 1, now: Optional[float] = None) -> Optional[str]:
+        """
+        Count finished requests and check the limits
+
+        Returns:
+            The recycle reason if this call started recycling, else None
+        """
+        with self._lock:
+            self.requests += count
+            if self.reason is not None:
+                return None
+            reason = None
+            if self.max_requests and self.requests >= self.max_requests:
+                reason = "max_requests"
+            else:
+                now = time.monotonic() if now is None else now
+                if self.max_rss_bytes and now - self._checked_at >= self.check_interval:
+                    self._checked_at = now
+                    self.last_rss = rss_bytes()
+                    if self.last_rss is not None and self.last_rss > self.max_rss_bytes:
+                        reason = "max_rss"
+            if reason is None:
+                return None
+            self.reason = reason
+            self.recycling_at = time.time()
+        print(f"Recycling worker {os.getpid()} ({reason}: {self.requests} requests, "
+              f"RSS {(self.last_rss or rss_bytes() or 0) / (1024 * 1024):.0f} MB)")
+        self.action(reason)
+        return reason
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "requests": self.requests,
+            "max_requests": self.max_requests or None,
+            "max_rss_mb": self.max_rss_bytes / (1024 * 1024) if self.max_rss_bytes else None,
+            "rss_bytes": rss_bytes(),
+            "recycling": self.reason,
+            "recycling_at": self.recycling_at
+        }
+
+
+class RecycleMiddleware:
+    """ASGI middleware counting finished HTTP requests against the recycle policy"""
+
+    def __init__(self, app, policy: Optional[RecyclePolicy] = None):
+        self.app = app
+        self.policy = policy or recycle_policy
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.policy.request_done()
+
+
+# Shared instances for this process
+memory_tracer = MemoryTracer()
+recycle_policy = RecyclePolicy.from_env()
+
+if os.environ.get("MEMORY_TRACE", "0") == "1":
+    memory_tracer.start(int(os.environ.get("MEMORY_TRACE_FRAMES", "1")))
@@ -0,0 +1,578 @@
+"""
+Component micro-benchmarks for the Object Detection API
+Times each stage of a request on its own (decode, preprocessing, the
+network forward pass, result extraction, rendering, JPEG encoding, the
+fallback detector, upload saving and cleanup of large directories), writes
+the figures as JSON and compares them with a stored baseline, failing when
+a stage got slower than the allowed percentage:
+
+    python -m app.utils.microbench run --output baseline.json
+    python -m app.utils.microbench run --baseline baseline.json --threshold 10
+    python -m app.utils.microbench compare current.json baseline.json --stage-threshold cleanup=25
+
+Stages whose dependencies or weights are missing are reported as skipped,
+and fail a comparison with a baseline that measured them unless
+--allow-skipped is given
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from app.models.yolo_model import DEFAULT_MODEL_PATH
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Default regression threshold in percent of the baseline median
+DEFAULT_THRESHOLD = float(os.environ.get("MICROBENCH_THRESHOLD_PCT", "10"))
+
+# Frame sizes the image stages run at
+FRAME_SIZES = {"720p": (1280, 720), "1080p": (1920, 1080), "4K": (3840, 2160)}
+
+# Fast stages repeat their call until one sample takes at least this long
+MIN_SAMPLE_S = 0.02
+
+
+class StageSkipped(Exception):
+    """Raised by a stage setup when the stage cannot run here (missing package or weights)"""
+
+
+class BenchContext:
+    """
+    Inputs shared by the stages, built on first use
+
+    Args:
+        frame_size: Key of FRAME_SIZES
+        model_path: Weights for the forward pass
+        boxes: Detections in the synthetic result used by extraction and rendering
+        files: Files in the directory the cleanup stage runs on
+        workdir: Scratch directory (removed by close)
+    """
+
+    def __init__(self, frame_size: str = "1080p", model_path: str = DEFAULT_MODEL_PATH, boxes: int = 20,
+                 files: int = 20000, workdir: Optional[str] = None):
+        self.frame_size = frame_size
+        self.model_path = model_path
+        self.boxes = boxes
+        self.files = files
+        self.workdir = workdir or tempfile.mkdtemp(prefix="microbench-")
+        self._cache: Dict[str, Any] = {}
+
+    def _get(self, key: str, build: Callable[[], Any]) -> Any:
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    @property
+    def jpeg(self) -> bytes:
+        from app.utils.decode import _encode_test_jpeg
+
+        return self._get("jpeg", lambda: _encode_test_jpeg(*FRAME_SIZES[self.frame_size]))
+
+    @property
+    def frame(self) -> "np.ndarray":
+        def build():
+            import cv2
+            import numpy as np
+
+            return cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        return self._get("frame", build)
+
+    @property
+    def yolo(self):
+        """A YOLOModel that has not loaded its weights (enough for result extraction)"""
+        from app.models.yolo_model import YOLOModel
+
+        return self._get("yolo", lambda: YOLOModel(self.model_path, buckets=[]))
+
+    @property
+    def result(self):
+        """An ultralytics Results with `boxes` detections of the supported classes"""
+        def build():
+            import numpy as np
+            import torch
+            from ultralytics.engine.results import Results
+            from app.models.yolo_model import YOLOModel
+
+            height, width = self.frame.shape[:2]
+            rng = np.random.default_rng(0)
+            corners = np.sort(rng.uniform(0, 1, (self.boxes, 2, 2)), axis=1) * [width, height]
+            class_ids = rng.choice(list(YOLOModel.CLASS_NAMES), self.boxes)
+            data = np.column_stack([corners.reshape(-1, 4), rng.uniform(0.25, 1, self.boxes), class_ids])
+            names = {class_id: str(class_id) for class_id in range(80)}
+            names.update(YOLOModel.CLASS_NAMES)
+            return Results(self.frame, "microbench.jpg", names, boxes=torch.as_tensor(data, dtype=torch.float32))
+
+        return self._get("result", build)
+
+    @property
+    def detections(self) -> List[Dict[str, Any]]:
+        return self._get("detections", lambda: self.yolo._extract_detections(self.result))
+
+    def close(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+@contextmanager
+def _working_directory(path: str) -> Iterator[None]:
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def _require(module: str):
+    try:
+        __import__(module)
+    except ImportError as e:
+        raise StageSkipped(f"{module} is not installed ({e})")
+
+
+# Each stage setup returns the call to time and optionally a call to run
+# (untimed) before every timed call, or raises StageSkipped
+
+
+def _stage_decode_pil(ctx: BenchContext):
+    _require("PIL")
+    from PIL import Image
+
+    data = ctx.jpeg
+
+    def decode():
+        with Image.open(io.BytesIO(data)) as image:
+            image.convert("RGB")
+
+    return decode, None
+
+
+def _stage_decode_cv2(ctx: BenchContext):
+    _require("cv2")
+    import cv2
+    import numpy as np
+
+    data = ctx.jpeg
+    return lambda: cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR), None
+
+
+def _stage_letterbox(ctx: BenchContext):
+    _require("cv2")
+    from app.models.buckets import letterbox
+
+    frame = ctx.frame
+    return lambda: letterbox(frame, (640, 640)), None
+
+
+def _stage_preprocess(ctx: BenchContext):
+    _require("torch")
+    from app.models.preprocess import buffer_pool
+
+    frame = ctx.frame
+
+    def preprocess():
+        with buffer_pool.preprocess([frame], (640, 640)):
+            pass
+
+    return preprocess, None
+
+
+def _stage_forward(ctx: BenchContext):
+    _require("torch")
+    _require("ultralytics")
+    import torch
+
+    model = ctx.yolo
+    model.warmup(640)
+    if model.is_fallback:
+        raise StageSkipped(f"YOLOv8 weights could not be loaded from {ctx.model_path}")
+    backend = model.model.predictor.model
+    batch = torch.zeros((1, 3, 640, 640), dtype=torch.float32, device=backend.device)
+
+    def forward():
+        with torch.inference_mode():
+            backend(batch)
+
+    return forward, None
+
+
+def _stage_extract(ctx: BenchContext):
+    _require("torch")
+    _require("ultralytics")
+    model, result = ctx.yolo, ctx.result
+    return lambda: model._extract_detections(result), None
+
+
+def _stage_plot(ctx: BenchContext):
+    _require("ultralytics")
+    result = ctx.result
+    return lambda: result.plot(), None
+
+
+def _stage_draw(ctx: BenchContext):
+    _require("cv2")
+    _require("ultralytics")  # For the synthetic result's detections
+    from app.utils.render import draw_detections
+
+    canvas, detections = ctx.frame.copy(), ctx.detections
+    return lambda: draw_detections(canvas, detections), None
+
+
+def _stage_encode(ctx: BenchContext):
+    _require("cv2")
+    from app.utils.render import encode_image
+
+    frame = ctx.frame
+    return lambda: encode_image(frame), None
+
+
+def _stage_simple_detection(ctx: BenchContext):
+    _require("cv2")
+    from app.utils.simple_detector import SimpleDetector
+
+    detector, frame = SimpleDetector(), ctx.frame
+    return lambda: detector._simple_detection(frame), None
+
+
+def _stage_save_upload(ctx: BenchContext):
+    from app.utils.utils import save_uploaded_file
+
+    # save_uploaded_file writes below the working directory
+    root = os.path.join(ctx.workdir, "save_upload")
+    os.makedirs(os.path.join(root, "app", "static", "uploads"))
+    upload, data = SimpleNamespace(filename="frame.jpg"), ctx.jpeg
+
+    def save():
+        with _working_directory(root):
+            save_uploaded_file(upload, data)
+
+    return save, None
+
+
+def _stage_cleanup(ctx: BenchContext):
+    from app.utils.cleanup import clean_old_files
+
+    # Each call finds `added` files over the limit: it scans and sorts the whole
+    # directory, then removes the oldest; they are replaced before the next call
+    directory = os.path.join(ctx.workdir, "cleanup")
+    os.makedirs(directory)
+    added = max(1, ctx.files // 100)
+    counter = iter(range(sys.maxsize))
+
+    def add_files(count: int):
+        for _ in range(count):
+            with open(os.path.join(directory, f"{next(counter):08d}.jpg"), "wb") as f:
+                f.write(b"\xff\xd8\xff\xd9")
+
+    add_files(ctx.files)
+    return lambda: clean_old_files(directory, max_age_days=1, max_files=ctx.files - added), lambda: add_files(added)
+
+
+# name -> (description, setup)
+STAGES: Dict[str, Tuple[str, Callable[[BenchContext], Tuple[Callable, Optional[Callable]]]]] = {
+    "decode_pil": ("PIL JPEG decode to RGB", _stage_decode_pil),
+    "decode_cv2": ("cv2.imdecode to BGR", _stage_decode_cv2),
+    "letterbox": ("Letterbox to 640x640 (buckets.letterbox)", _stage_letterbox),
+    "preprocess": ("Letterbox and normalise into the pooled tensor", _stage_preprocess),
+    "forward": ("Network forward pass on a 1x3x640x640 batch", _stage_forward),
+    "extract": ("YOLOModel._extract_detections on the synthetic result", _stage_extract),
+    "plot": ("ultralytics Results.plot() rendering", _stage_plot),
+    "draw": ("render.draw_detections (the renderer the API uses)", _stage_draw),
+    "encode": ("render.encode_image at RESULT_FORMAT/RESULT_QUALITY", _stage_encode),
+    "simple_detection": ("SimpleDetector._simple_detection", _stage_simple_detection),
+    "save_upload": ("save_uploaded_file of the test JPEG", _stage_save_upload),
+    "cleanup": ("cleanup.clean_old_files on a directory of --files files", _stage_cleanup),
+}
+
+
+def measure(fn: Callable, before: Optional[Callable] = None, samples: int = 15) -> Dict[str, Any]:
+    """
+    Time a call
+
+    Fast calls are looped until one sample takes at least MIN_SAMPLE_S; calls
+    with a `before` step are timed one at a time. The garbage collector is
+    off while timing, as in timeit.
+
+    Returns:
+        Per-call median, min, mean, p90 and standard deviation in ms, with
+        the sample count and calls per sample
+    """
+    fn()  # Warm-up (lazy imports, caches, buffer allocation)
+    loops = 1
+    if before is None:
+        while True:
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            if time.perf_counter() - start >= MIN_SAMPLE_S or loops >= 1 << 20:
+                break
+            loops *= 2
+
+    times = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(samples):
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn()
+            times.append((time.perf_counter() - start) * 1000 / loops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    times.sort()
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": times[0],
+        "mean_ms": statistics.fmean(times),
+        "p90_ms": times[min(len(times) - 1, int(0.9 * len(times)))],
+        "stdev_ms": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "samples": len(times),
+        "loops": loops
+    }
+
+
+def host_info() -> Dict[str, Any]:
+    """Where the figures were measured; baselines only compare well on the same host"""
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+        "torch": None,
+        "torch_threads": None
+    }
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    return info
+
+
+def run(stages: Optional[List[str]] = None, samples: int = 15, frame_size: str = "1080p",
+        model_path: str = DEFAULT_MODEL_PATH, boxes: int = 20, files: int = 20000) -> Dict[str, Any]:
+    """
+    Run the micro-benchmarks
+
+    Args:
+        stages: Stage names (default: all of STAGES)
+        samples: Timed samples per stage
+        frame_size: Key of FRAME_SIZES for the image stages
+        model_path: Weights for the forward pass
+        boxes: Detections in the synthetic result
+        files: Files in the cleanup directory
+
+    Returns:
+        {"created", "host", "settings", "stages": {name: figures or {"skipped": reason}}}
+
+    Raises:
+        ValueError: For unknown stage names or frame sizes
+    """
+    stages = list(stages or STAGES)
+    unknown = [name for name in stages if name not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown}. Available: {', '.join(STAGES)}")
+    if frame_size not in FRAME_SIZES:
+        raise ValueError(f"Unknown frame size '{frame_size}'. Available: {', '.join(FRAME_SIZES)}")
+
+    ctx = BenchContext(frame_size, model_path, boxes, files)
+    results = {}
+    try:
+        for name in stages:
+            description, setup = STAGES[name]
+            try:
+                fn, before = setup(ctx)
+                results[name] = {"description": description, **measure(fn, before, samples)}
+                print(f"{name:<17} {results[name]['median_ms']:>10.3f} ms")
+            except StageSkipped as e:
+                results[name] = {"description": description, "skipped": str(e)}
+                print(f"{name:<17} skipped: {e}")
+    finally:
+        ctx.close()
+    return {
+        "created": time.time(),
+        "host": host_info(),
+        "settings": {"samples": samples, "frame_size": frame_size, "model": model_path,
+                     "boxes": boxes, "files": files},
+        "stages": results
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD,
+            stage_thresholds: Optional[Dict[str, float]] = None, min_delta_ms: float = 0.0,
+            statistic: str = "median") -> List[Dict[str, Any]]:
+    """
+    Compare per-call times with a baseline
+
+    A stage regressed when its time exceeds the baseline's by more than its
+    threshold (percent) and by more than `min_delta_ms`, which keeps
+    sub-millisecond jitter from failing the run.
+
+    Args:
+        statistic: "median", or "min" on noisy shared hosts (the fastest
+                   sample is the least disturbed by other processes)
+
+    Returns:
+        One row per stage of either report: name, baseline and current
+        times, change in percent, threshold and status ("ok", "regressed",
+        "improved", "new", "missing" or "skipped"). baseline_ms is set for
+        every stage the baseline measured, including ones not measured now
+    """
+    key = f"{statistic}_ms"
+    stage_thresholds = stage_thresholds or {}
+    rows = []
+    for name in list(current["stages"]) + [name for name in baseline["stages"] if name not in current["stages"]]:
+        now, before = current["stages"].get(name), baseline["stages"].get(name)
+        limit = stage_thresholds.get(name, threshold)
+        row = {"stage": name, "baseline_ms": None, "current_ms": None, "change_pct": None, "threshold_pct": limit}
+        if now is not None:
+            row["current_ms"] = now.get(key)
+        if before is not None:
+            row["baseline_ms"] = before.get(key)
+        if now is None:
+            row["status"] = "missing"
+        elif before is None:
+            row["status"] = "new"
+        elif "skipped" in now or "skipped" in before:
+            row["status"] = "skipped"
+        else:
+            delta = now[key] - before[key]
+            row["change_pct"] = 100 * delta / before[key] if before[key] else 0.0
+            if row["change_pct"] > limit and delta > min_delta_ms:
+                row["status"] = "regressed"
+            elif row["change_pct"] < -limit:
+                row["status"] = "improved"
+            else:
+                row["status"] = "ok"
+        rows.append(row)
+    return rows
+
+
+def format_comparison(rows: List[Dict[str, Any]], allow_skipped: bool = False) -> str:
+    """Render compare() rows as a text table"""
+    def ms(value: Optional[float]) -> str:
+        return f"{value:>10.3f}" if value is not None else f"{'-':>10}"
+
+    lines = [f"{'stage':<17} {'baseline ms':>11} {'current ms':>10} {'change':>8} {'limit':>6}  status"]
+    for row in rows:
+        change = f"{row['change_pct']:>+7.1f}%" if row["change_pct"] is not None else f"{'-':>8}"
+        lines.append(f"{row['stage']:<17} {ms(row['baseline_ms']):>11} {ms(row['current_ms'])} {change} "
+                     f"{row['threshold_pct']:>5.0f}%  {row['status'].upper() if _failed(row, allow_skipped) else row['status']}")
+    return "\n".join(lines)
+
+
+def _failed(row: Dict[str, Any], allow_skipped: bool = False) -> bool:
+    """Whether a compare() row fails the check: a regression, or a baseline stage that was not measured"""
+    if row["status"] == "regressed":
+        return True
+    return not allow_skipped and row["status"] in ("missing", "skipped") and row["baseline_ms"] is not None
+
+
+def _parse_stage_thresholds(items: List[str]) -> Dict[str, float]:
+    thresholds = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        if name not in STAGES or not value:
+            raise ValueError(f"Invalid stage threshold '{item}', expected e.g. cleanup=25")
+        thresholds[name] = float(value)
+    return thresholds
+
+
+def _check(current: Dict[str, Any], baseline_path: str, args) -> int:
+    """Compare with the baseline file, print the table and return the exit status"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if getattr(args, "stages", None):
+        # Only the stages run this time
+        baseline["stages"] = {name: figures for name, figures in baseline["stages"].items() if name in args.stages}
+    if baseline.get("host", {}).get("cpus") != current["host"]["cpus"] or \
+            baseline.get("host", {}).get("machine") != current["host"]["machine"]:
+        print(f"Warning: the baseline was measured on a different host ({baseline.get('host')})")
+    rows = compare(current, baseline, args.threshold, _parse_stage_thresholds(args.stage_threshold),
+                   args.min_delta_ms, args.statistic)
+    print(format_comparison(rows, args.allow_skipped))
+    regressed = [row["stage"] for row in rows if row["status"] == "regressed"]
+    unmeasured = [row["stage"] for row in rows if row["status"] != "regressed" and _failed(row, args.allow_skipped)]
+    if regressed:
+        print(f"FAILED: {', '.join(regressed)} slower than the baseline by more than the threshold")
+    if unmeasured:
+        print(f"FAILED: {', '.join(unmeasured)} measured in the baseline but not in this run "
+              f"(--allow-skipped to accept)")
+    if regressed or unmeasured:
+        return 1
+    print("No regressions")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Component micro-benchmarks with baseline comparison")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_compare_options(command):
+        command.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                             help="Allowed slowdown in percent of the baseline median "
+                                  "(default from MICROBENCH_THRESHOLD_PCT, 10)")
+        command.add_argument("--stage-threshold", nargs="*", default=[], metavar="STAGE=PCT",
+                             help="Per-stage thresholds, e.g. cleanup=25 save_upload=30")
+        command.add_argument("--min-delta-ms", type=float, default=0.0,
+                             help="Ignore slowdowns smaller than this many milliseconds")
+        command.add_argument("--statistic", default="median", choices=["median", "min"],
+                             help="Per-call time compared (min is steadier on busy shared hosts)")
+        command.add_argument("--allow-skipped", action="store_true",
+                             help="Pass when a stage the baseline measured was skipped or not run")
+
+    bench = sub.add_parser("run", help="Run the benchmarks (and optionally compare with a baseline)")
+    bench.add_argument("--stages", nargs="+", default=None, help=f"Stages to run: {', '.join(STAGES)}")
+    bench.add_argument("--samples", type=int, default=15, help="Timed samples per stage")
+    bench.add_argument("--frame-size", default="1080p", choices=list(FRAME_SIZES), help="Test image size")
+    bench.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Weights for the forward pass")
+    bench.add_argument("--boxes", type=int, default=20, help="Detections in the synthetic result")
+    bench.add_argument("--files", type=int, default=20000, help="Files in the cleanup directory")
+    bench.add_argument("--output", default=None, help="Write the JSON results here")
+    bench.add_argument("--baseline", default=None, help="Baseline JSON to compare with")
+    add_compare_options(bench)
+
+    check = sub.add_parser("compare", help="Compare two result files")
+    check.add_argument("current", help="Results JSON")
+    check.add_argument("baseline", help="Baseline JSON")
+    add_compare_options(check)
+
+    args = parser.parse_args()
+    try:
+        _parse_stage_thresholds(args.stage_threshold)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.command == "compare":
+        with open(args.current) as f:
+            current = json.load(f)
+        sys.exit(_check(current, args.baseline, args))
+
+    try:
+        current = run(args.stages, args.samples, args.frame_size, args.model, args.boxes, args.files)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        sys.exit(_check(current, args.baseline, args))
+
+
+if __name__ == "__main__":
+    main()
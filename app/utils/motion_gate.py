@@ -0,0 +1,201 @@
+"""
+Per-stream motion gating for the Object Detection API
+Fixed cameras often send long runs of nearly identical frames. Each frame
+is compared, downscaled and blurred, with the frame of the stream's last
+real detection; when too little has changed the previous detections are
+returned instead of running the model. Detection is still forced every
+max_skip frames / max_interval seconds so slow changes are picked up
+"""
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+
+class _StreamState:
+    """Reference frame, last result and counters for one stream"""
+
+    def __init__(self):
+        self.reference = None       # Blurred gray frame of the last detection
+        self.params = None          # Detection parameters of the cached result
+        self.result = None          # Cached result of the last detection
+        self.detected_at = 0.0
+        self.since_detection = 0    # Frames skipped since the last detection
+        self.frames = 0
+        self.skipped = 0
+        self.forced = 0
+        self.last_motion = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "forced": self.forced,
+            "skip_ratio": self.skipped / self.frames if self.frames else 0.0,
+            "last_motion": self.last_motion
+        }
+
+
+class MotionGate:
+    """
+    Skip detection on frames that barely differ from the last detected one
+
+    Args:
+        threshold: Fraction of pixels that must change to run detection
+        pixel_delta: Gray level difference above which a pixel counts as changed
+        max_skip: Force detection after this many consecutive skipped frames
+        max_interval: Force detection when the cached result is this many seconds old
+        width: Width frames are downscaled to before comparing
+        max_streams: Streams tracked at once (least recently seen are dropped)
+    """
+
+    def __init__(self, threshold: float = 0.01, pixel_delta: int = 25, max_skip: int = 10,
+                 max_interval: float = 5.0, width: int = 160, max_streams: int = 1024):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.max_skip = max_skip
+        self.max_interval = max_interval
+        self.width = width
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[str, _StreamState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls) -> "MotionGate":
+        """
+        Create a gate configured from environment variables
+
+        - MOTION_THRESHOLD: changed pixel fraction that triggers detection (default 0.01)
+        - MOTION_PIXEL_DELTA: per-pixel gray level change threshold (default 25)
+        - MOTION_MAX_SKIP: max consecutive skipped frames (default 10)
+        - MOTION_MAX_INTERVAL_S: max age of a reused result in seconds (default 5)
+        - MOTION_MAX_STREAMS: streams tracked at once (default 1024)
+        """
+        return cls(
+            threshold=float(os.environ.get("MOTION_THRESHOLD", "0.01")),
+            pixel_delta=int(os.environ.get("MOTION_PIXEL_DELTA", "25")),
+            max_skip=int(os.environ.get("MOTION_MAX_SKIP", "10")),
+            max_interval=float(os.environ.get("MOTION_MAX_INTERVAL_S", "5")),
+            max_streams=int(os.environ.get("MOTION_MAX_STREAMS", "1024"))
+        )
+
+    def signature(self, image: Union["np.ndarray", "Image.Image"]) -> "np.ndarray":
+        """
+        Downscaled, blurred grayscale version of a frame used for comparison
+
+        Args:
+            image: BGR numpy array or PIL Image
+        """
+        import numpy as np
+        from app.utils.simple_detector import blurred_gray
+
+        if isinstance(image, np.ndarray):
+            return blurred_gray(image, self.width)
+
+        # Shrink with PIL first so the full frame is never converted
+        height = max(1, round(image.size[1] * self.width / image.size[0]))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        small = image.resize((self.width, height), reducing_gap=2.0).convert("RGB")
+        return blurred_gray(np.asarray(small)[:, :, ::-1])
+
+    def check(
+        self,
+        stream_id: str,
+        image: Union["np.ndarray", "Image.Image"],
+        params: Hashable = None
+    ) -> Tuple[Optional[Dict[str, Any]], "np.ndarray", Optional[float]]:
+        """
+        Decide whether a frame needs detection
+
+        Args:
+            stream_id: Camera/stream identifier
+            image: The new frame
+            params: Detection parameters (model, threshold, classes...); a
+                    cached result is only reused for identical parameters
+
+        Returns:
+            (cached result to reuse or None to run detection, frame signature
+             to pass to record, changed pixel fraction or None if unknown)
+        """
+        import cv2
+        import numpy as np
+
+        signature = self.signature(image)
+        now = time.time()
+        with self._lock:
+            state = self._streams.get(stream_id)
+            if state is None:
+                state = self._streams[stream_id] = _StreamState()
+                if len(self._streams) > self.max_streams:
+                    self._streams.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._streams.move_to_end(stream_id)
+            state.frames += 1
+
+            reference = state.reference
+            if reference is None or reference.shape != signature.shape or state.params != params:
+                state.last_motion = None
+                return None, signature, None
+
+            changed = np.count_nonzero(cv2.absdiff(signature, reference) > self.pixel_delta)
+            motion = changed / signature.size
+            state.last_motion = motion
+            if motion >= self.threshold:
+                return None, signature, motion
+            if state.since_detection >= self.max_skip or now - state.detected_at >= self.max_interval:
+                state.forced += 1
+                return None, signature, motion
+
+            state.skipped += 1
+            state.since_detection += 1
+            return copy.deepcopy(state.result), signature, motion
+
+    def record(self, stream_id: str, signature: "np.ndarray", params: Hashable, result: Dict[str, Any]):
+        """
+        Store a fresh detection as the stream's new reference
+
+        Args:
+            stream_id: Camera/stream identifier
+            signature: Signature returned by check for this frame
+            params: Detection parameters used
+            result: Result to reuse for following static frames
+        """
+        with self._lock:
+            state = self._streams.get(stream_id)
+            if state is None:
+                return
+            state.reference = signature
+            state.params = params
+            state.result = copy.deepcopy(result)
+            state.detected_at = time.time()
+            state.since_detection = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            streams = {stream_id: state.to_dict() for stream_id, state in self._streams.items()}
+            evicted = self.evicted
+        frames = sum(s["frames"] for s in streams.values())
+        skipped = sum(s["skipped"] for s in streams.values())
+        return {
+            "threshold": self.threshold,
+            "max_skip": self.max_skip,
+            "max_interval_s": self.max_interval,
+            "frames": frames,
+            "skipped": skipped,
+            "skip_ratio": skipped / frames if frames else 0.0,
+            "evicted_streams": evicted,
+            "streams": streams
+        }
+
+
+# Shared gate for this process
+motion_gate = MotionGate.from_env()
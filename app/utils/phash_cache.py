@@ -0,0 +1,278 @@
+"""
+Near-duplicate detection cache for the Object Detection API
+Images are keyed by a 64-bit perceptual hash (dHash or pHash), so re-encoded
+or slightly altered copies of an already processed image are found within
+a small Hamming distance. Lookups use multi-index hashing: the hash is split
+into max_distance + 1 chunks, and by the pigeonhole principle any hash within
+max_distance shares at least one chunk exactly, so only entries in the
+matching chunk buckets are compared
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+
+HASH_BITS = 64
+HASH_ALGORITHMS = ("dhash", "phash")
+
+_dct_matrix = None
+
+
+def _gray_thumbnail(image: Union["np.ndarray", "Image.Image"], width: int, height: int) -> "np.ndarray":
+    """Grayscale float32 thumbnail of a BGR array or PIL image"""
+    import numpy as np
+    from PIL import Image
+
+    if isinstance(image, np.ndarray):
+        # Same resampling as for PIL input, so both hash identically
+        image = Image.fromarray(np.ascontiguousarray(image[:, :, ::-1]) if image.ndim == 3 else image)
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    # Shrink first so the full frame is never converted
+    small = image.resize((width, height), Image.BILINEAR, reducing_gap=2.0).convert("L")
+    return np.asarray(small, dtype=np.float32)
+
+
+def _pack(bits: "np.ndarray") -> int:
+    """Pack a boolean array of HASH_BITS bits into an int"""
+    import numpy as np
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def dhash(image: Union["np.ndarray", "Image.Image"]) -> int:
+    """
+    Difference hash: whether each pixel of a 9x8 thumbnail is brighter than its right neighbour
+
+    Args:
+        image: BGR numpy array or PIL Image
+
+    Returns:
+        64-bit hash
+    """
+    pixels = _gray_thumbnail(image, 9, 8)
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image: Union["np.ndarray", "Image.Image"]) -> int:
+    """
+    DCT hash: whether each of the 8x8 lowest frequency DCT coefficients of a
+    32x32 thumbnail is above their median
+
+    Args:
+        image: BGR numpy array or PIL Image
+
+    Returns:
+        64-bit hash
+    """
+    import numpy as np
+
+    global _dct_matrix
+    if _dct_matrix is None:
+        n = np.arange(32)
+        matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / 64) * np.sqrt(2 / 32)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrix = matrix.astype(np.float32)
+
+    pixels = _gray_thumbnail(image, 32, 32)
+    low = (_dct_matrix @ pixels @ _dct_matrix.T)[:8, :8]
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+class _Entry:
+    __slots__ = ("key", "hash", "params", "width", "height", "result", "created")
+
+    def __init__(self, key: int, hash_value: int, params: Hashable, width: int, height: int,
+                 result: Dict[str, Any]):
+        self.key = key
+        self.hash = hash_value
+        self.params = params
+        self.width = width
+        self.height = height
+        self.result = result
+        self.created = time.time()
+
+
+class PerceptualCache:
+    """
+    Bounded LRU cache of detection results keyed by perceptual hash
+
+    Args:
+        max_distance: Largest Hamming distance treated as the same image
+        max_entries: Entries kept before the least recently used are evicted
+        ttl: Seconds an entry stays valid
+        algorithm: "dhash" or "phash"
+        max_aspect_diff: Relative aspect ratio difference still accepted as a match
+        enabled: Whether the API consults the cache
+    """
+
+    def __init__(self, max_distance: int = 4, max_entries: int = 10000, ttl: float = 3600.0,
+                 algorithm: str = "dhash", max_aspect_diff: float = 0.02, enabled: bool = True):
+        if algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm '{algorithm}'. Expected one of {HASH_ALGORITHMS}")
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.algorithm = algorithm
+        self.max_aspect_diff = max_aspect_diff
+        self._hash_fn = dhash if algorithm == "dhash" else phash
+
+        # Chunk boundaries for multi-index hashing
+        chunks = max_distance + 1
+        bounds = [round(i * HASH_BITS / chunks) for i in range(chunks + 1)]
+        self._chunks = [(start, end - start) for start, end in zip(bounds, bounds[1:])]
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in self._chunks]
+
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._hit_distance_total = 0
+
+    @classmethod
+    def from_env(cls) -> "PerceptualCache":
+        """
+        Create a cache configured from environment variables
+
+        - PHASH_CACHE: "1" to enable the cache (default off)
+        - PHASH_ALGORITHM: dhash (default) or phash
+        - PHASH_MAX_DISTANCE: Hamming distance for a match (default 4)
+        - PHASH_MAX_ENTRIES: cache size (default 10000)
+        - PHASH_TTL_S: entry lifetime in seconds (default 3600)
+        """
+        return cls(
+            enabled=os.environ.get("PHASH_CACHE", "0") == "1",
+            algorithm=os.environ.get("PHASH_ALGORITHM", "dhash").lower(),
+            max_distance=int(os.environ.get("PHASH_MAX_DISTANCE", "4")),
+            max_entries=int(os.environ.get("PHASH_MAX_ENTRIES", "10000")),
+            ttl=float(os.environ.get("PHASH_TTL_S", "3600"))
+        )
+
+    def hash(self, image: Union["np.ndarray", "Image.Image"]) -> int:
+        """Perceptual hash of an image with the configured algorithm"""
+        return self._hash_fn(image)
+
+    def _chunk_values(self, hash_value: int) -> List[int]:
+        return [(hash_value >> (HASH_BITS - start - size)) & ((1 << size) - 1)
+                for start, size in self._chunks]
+
+    def _remove(self, entry: _Entry):
+        """Drop an entry from the LRU and the chunk tables (lock held)"""
+        del self._entries[entry.key]
+        for table, value in zip(self._tables, self._chunk_values(entry.hash)):
+            keys = table.get(value)
+            if keys is not None:
+                keys.discard(entry.key)
+                if not keys:
+                    del table[value]
+
+    def get(
+        self,
+        hash_value: int,
+        width: int,
+        height: int,
+        params: Hashable = None
+    ) -> Optional[Tuple[Dict[str, Any], int]]:
+        """
+        Find the closest cached result for a near-identical image
+
+        Args:
+            hash_value: Perceptual hash of the request image
+            width, height: Request image size (detections are rescaled to it)
+            params: Detection parameters; only entries with equal params match
+
+        Returns:
+            (result with detections in the request's coordinates, Hamming
+             distance) or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for table, value in zip(self._tables, self._chunk_values(hash_value)):
+                candidates.update(table.get(value, ()))
+
+            best = None
+            best_distance = self.max_distance + 1
+            aspect = width / height
+            for key in candidates:
+                entry = self._entries[key]
+                if now - entry.created > self.ttl:
+                    self._remove(entry)
+                    self.expirations += 1
+                    continue
+                if entry.params != params:
+                    continue
+                if abs(entry.width / entry.height - aspect) > self.max_aspect_diff * aspect:
+                    continue
+                distance = bin(entry.hash ^ hash_value).count("1")
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+            if best is None:
+                return None
+
+            self._entries.move_to_end(best.key)
+            self.hits += 1
+            self._hit_distance_total += best_distance
+            result = best.result
+            scale_x, scale_y = width / best.width, height / best.height
+
+        detections = []
+        for det in result["detections"]:
+            bbox = det["bbox"]
+            x1, x2 = bbox["x1"] * scale_x, bbox["x2"] * scale_x
+            y1, y2 = bbox["y1"] * scale_y, bbox["y2"] * scale_y
+            detections.append(dict(det, bbox={
+                "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+                "width": x2 - x1, "height": y2 - y1
+            }))
+        return dict(result, detections=detections), best_distance
+
+    def put(self, hash_value: int, width: int, height: int, params: Hashable, result: Dict[str, Any]):
+        """
+        Cache a detection result
+
+        Args:
+            hash_value: Perceptual hash of the image
+            width, height: Image size the detections refer to
+            params: Detection parameters used
+            result: Result with a "detections" list (stored as given; do not mutate it afterwards)
+        """
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            entry = _Entry(key, hash_value, params, width, height, result)
+            self._entries[key] = entry
+            for table, value in zip(self._tables, self._chunk_values(hash_value)):
+                table.setdefault(value, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries.values())))
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "algorithm": self.algorithm,
+                "max_distance": self.max_distance,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "mean_hit_distance": self._hit_distance_total / self.hits if self.hits else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+# Shared cache for this process
+detection_cache = PerceptualCache.from_env()
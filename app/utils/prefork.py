@@ -0,0 +1,461 @@
+"""
+Pre-fork server for the Object Detection API
+Imports the app and loads the models once in a parent process, freezes the
+garbage-collected heap and forks uvicorn workers that share the parent's
+memory copy-on-write, instead of each worker importing torch and loading
+its own copy of the weights:
+
+    python -m app.utils.prefork serve --workers 4 --port 8000
+    python -m app.utils.prefork report <supervisor pid>
+
+The report lists each worker's unique (private) and shared resident memory,
+read from /proc/<pid>/smaps_rollup; it also works for `uvicorn --workers N`
+so both layouts can be compared on the same node
+"""
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Fields of /proc/<pid>/smaps_rollup used by the report (kB in the file)
+_SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+# Helper processes started by multiprocessing, left out of worker reports
+_HELPER_COMMANDS = ("multiprocessing.resource_tracker", "multiprocessing.forkserver")
+
+# Least time between two restarts of the same worker slot
+RESTART_DELAY = 1.0
+
+# Why the supervisor replaced workers: recycle reasons of app.utils.memory, or a crash
+REPLACE_REASONS = ("max_requests", "max_rss", "crashed")
+
+# Set in pre-forked workers: pipe to the supervisor, and its replacement counters
+# (shared memory, so every worker can report them)
+_notice_fd: Optional[int] = None
+_counters = None
+
+
+def notify_recycle(reason: str):
+    """Tell the pre-fork supervisor, if there is one, that this worker is about to recycle"""
+    if _notice_fd is None:
+        return
+    try:
+        os.write(_notice_fd, f"{os.getpid()} {reason}\n".encode())
+    except OSError as e:
+        print(f"Could not notify the supervisor: {e}")
+
+
+def supervisor_stats() -> Optional[Dict[str, int]]:
+    """Workers replaced by the pre-fork supervisor, per reason; None when not pre-forked"""
+    if _counters is None:
+        return None
+    return {reason: _counters[index] for index, reason in enumerate(REPLACE_REASONS)}
+
+
+def process_memory(pid: int) -> Dict[str, int]:
+    """
+    Resident memory of a process, split into unique and shared pages
+
+    Args:
+        pid: Process ID (Linux only)
+
+    Returns:
+        Bytes: rss, pss (shared pages divided among their sharers), unique
+        (pages only this process maps), shared (pages also mapped elsewhere) and swap
+
+    Raises:
+        OSError: If the process does not exist or /proc is not available
+    """
+    values = dict.fromkeys(_SMAPS_FIELDS, 0)
+    try:
+        path = f"/proc/{pid}/smaps_rollup"
+        handle = open(path)
+    except FileNotFoundError:
+        # Kernels before 4.14: sum the per-mapping entries
+        path = f"/proc/{pid}/smaps"
+        handle = open(path)
+    with handle:
+        for line in handle:
+            key, _, rest = line.partition(":")
+            if key in values:
+                values[key] += int(rest.split()[0]) * 1024
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "unique": values["Private_Clean"] + values["Private_Dirty"],
+        "shared": values["Shared_Clean"] + values["Shared_Dirty"],
+        "swap": values["Swap"]
+    }
+
+
+def worker_memory() -> Optional[Dict[str, int]]:
+    """Memory of the current process as in process_memory, or None where /proc is unavailable"""
+    try:
+        return {"pid": os.getpid(), **process_memory(os.getpid())}
+    except OSError:
+        return None
+
+
+def child_pids(parent: int) -> List[int]:
+    """PIDs of the live direct children of a process, found by scanning /proc"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue  # Exited while scanning
+        # The command name is in parentheses and may contain spaces
+        fields = stat.rsplit(")", 1)[1].split()
+        if int(fields[1]) == parent:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def _command_line(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+    except OSError:
+        return ""
+
+
+def memory_report(parent: int, workers: Optional[List[int]] = None) -> Dict:
+    """
+    Memory of a supervisor and its workers
+
+    Args:
+        parent: Supervisor PID
+        workers: Worker PIDs (default: live children of `parent`, except
+                 multiprocessing helper processes)
+
+    Returns:
+        {"parent", "workers": [...], "totals"}; totals.per_extra_worker is the
+        mean unique memory of a worker, i.e. roughly what one more worker costs
+    """
+    if workers is None:
+        workers = [pid for pid in child_pids(parent)
+                   if not any(helper in _command_line(pid) for helper in _HELPER_COMMANDS)]
+    rows = []
+    for pid in workers:
+        try:
+            rows.append({"pid": pid, "command": _command_line(pid), **process_memory(pid)})
+        except OSError:
+            continue  # Exited while reporting
+    parent_row = {"pid": parent, "command": _command_line(parent), **process_memory(parent)}
+    unique = sum(row["unique"] for row in rows)
+    return {
+        "parent": parent_row,
+        "workers": rows,
+        "totals": {
+            "workers": len(rows),
+            "rss": sum(row["rss"] for row in rows),
+            "pss": sum(row["pss"] for row in rows) + parent_row["pss"],
+            "unique": unique,
+            "per_extra_worker": unique // len(rows) if rows else 0
+        }
+    }
+
+
+def format_report(report: Dict) -> str:
+    """Render a memory report as a table in MB"""
+    def mb(value: int) -> str:
+        return f"{value / (1024 * 1024):8.1f}"
+
+    lines = [f"{'pid':>8} {'role':<8} {'rss MB':>8} {'pss MB':>8} {'unique':>8} {'shared':>8}"]
+    for role, row in [("parent", report["parent"])] + [("worker", row) for row in report["workers"]]:
+        lines.append(f"{row['pid']:>8} {role:<8} {mb(row['rss'])} {mb(row['pss'])} "
+                     f"{mb(row['unique'])} {mb(row['shared'])}")
+    totals = report["totals"]
+    lines.append(f"{totals['workers']} workers: {mb(totals['rss']).strip()} MB summed RSS, "
+                 f"{mb(totals['pss']).strip()} MB actually used (PSS incl. parent), "
+                 f"{mb(totals['per_extra_worker']).strip()} MB per extra worker")
+    return "\n".join(lines)
+
+
+class PreforkServer:
+    """
+    Loads the app once and serves it from forked uvicorn workers
+
+    The parent never runs a server itself: it preloads, binds the listening
+    socket, forks the workers, restarts any that die and forwards SIGTERM /
+    SIGINT to them. SIGUSR1 prints a memory report. A worker that recycles
+    itself (app.utils.memory) announces it first, and its replacement is
+    started while it drains.
+
+    Args:
+        app: Import path of the ASGI app, "module:attribute"
+        host: Address to bind
+        port: Port to bind
+        workers: Number of worker processes
+        models: Registered models to load before forking ("default", "all",
+                "none" or comma-separated names)
+        report_interval: Seconds between memory reports (0: only on SIGUSR1)
+        log_level: uvicorn log level of the workers
+    """
+
+    def __init__(
+        self,
+        app: str = "app.main:app",
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        workers: int = 2,
+        models: str = "default",
+        report_interval: float = 0.0,
+        log_level: str = "info"
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.models = models
+        self.report_interval = report_interval
+        self.log_level = log_level
+        self._asgi = None
+        self._socket: Optional[socket.socket] = None
+        self._children: Dict[int, int] = {}  # pid -> worker slot
+        self._draining: Dict[int, str] = {}  # pid -> recycle reason
+        self._notices: Optional[int] = None
+        self._notice_writer: Optional[int] = None
+        self._started: Dict[int, float] = {}  # slot -> last start time
+        self._stopping = False
+
+    def _model_names(self, registry) -> List[str]:
+        spec = self.models.strip().lower()
+        if spec == "none":
+            return []
+        if spec == "default":
+            return [registry.default]
+        if spec == "all":
+            return registry.names()
+        return [name.strip() for name in self.models.split(",") if name.strip()]
+
+    def preload(self):
+        """
+        Import the app and load the models in this (parent) process
+
+        Torch runs single-threaded here: OpenMP thread pools do not survive
+        fork(), and a worker inheriting one that was used would hang on its
+        first inference. Each worker applies its own CPU configuration.
+        """
+        # Avoid collections (and the freed holes they leave) while the shared heap is built
+        gc.disable()
+        start = time.time()
+        module, _, attribute = self.app.partition(":")
+        __import__(module)
+        self._asgi = getattr(sys.modules[module], attribute or "app")
+
+        from app.models.registry import registry
+        from app.utils.cpu_config import apply_cpu_config, load_cpu_config
+
+        # Size per-worker CPU slices (CPU_AFFINITY=auto) for this many workers
+        os.environ.setdefault("WORKERS", str(self.workers))
+        names = self._model_names(registry)
+        if names:
+            apply_cpu_config({**load_cpu_config(), "torch_num_threads": 1,
+                              "interop_threads": None, "cpu_affinity": "none"})
+            registry.verify_bundles()
+            for name in names:
+                if registry.get(name).device != "cpu":
+                    raise SystemExit(f"Model {name} runs on {registry.get(name).device}; pre-fork "
+                                     f"sharing is CPU-only (start one server per GPU instead)")
+                registry.warmup(name)
+
+        gc.collect()
+        # Move everything allocated so far out of the collector's reach, so
+        # collections in the workers do not write to (and copy) shared pages
+        gc.freeze()
+        print(f"Preloaded {self.app} and models {names or 'none'} in {time.time() - start:.2f}s "
+              f"({gc.get_freeze_count()} objects frozen)")
+
+    def bind(self) -> socket.socket:
+        """Create the listening socket the workers share"""
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        self._socket = sock
+        return sock
+
+    def _spawn(self, slot: int):
+        self._started[slot] = time.monotonic()
+        pid = os.fork()
+        if pid:
+            self._children[pid] = slot
+            print(f"Started worker {slot} (pid {pid})")
+            return
+        try:
+            self._serve(slot)
+            code = 0
+        except BaseException as e:
+            print(f"Worker {slot} (pid {os.getpid()}) failed: {e}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+        os._exit(code)
+
+    def _serve(self, slot: int):
+        """Worker process body: configure this worker and run uvicorn on the inherited socket"""
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        gc.enable()
+
+        global _notice_fd
+        os.close(self._notices)
+        _notice_fd = self._notice_writer
+        from app.utils.memory import recycle_policy
+        recycle_policy.reset()
+
+        # Each worker gets its own thread count and CPU slice
+        os.environ["WORKER_SLOT"] = str(slot)
+        from app.utils.cpu_config import apply_cpu_config, reset_cpu_config
+        if "torch" in sys.modules:
+            reset_cpu_config()
+            config = apply_cpu_config()
+            print(f"Worker {slot}: {config['effective_threads']} intra-op threads, "
+                  f"CPUs {config['pinned_cpus'] or 'unpinned'}")
+
+        import uvicorn
+        config = uvicorn.Config(self._asgi, host=self.host, port=self.port, log_level=self.log_level)
+        uvicorn.Server(config).run(sockets=[self._socket])
+
+    def _read_notices(self):
+        """Start replacements for workers that announced they are recycling"""
+        try:
+            data = os.read(self._notices, 65536).decode()
+        except BlockingIOError:
+            return
+        for line in data.splitlines():
+            pid, _, reason = line.partition(" ")
+            pid = int(pid)
+            if pid not in self._children or pid in self._draining or self._stopping:
+                continue
+            self._draining[pid] = reason
+            if reason in REPLACE_REASONS:
+                _counters[REPLACE_REASONS.index(reason)] += 1
+            slot = self._children[pid]
+            print(f"Worker {slot} (pid {pid}) is recycling ({reason}); starting its replacement")
+            self._spawn(slot)
+
+    def _signal_stop(self, signum, frame):
+        if self._stopping:
+            return
+        self._stopping = True
+        print(f"Received signal {signum}; stopping {len(self._children)} workers")
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _signal_report(self, signum, frame):
+        self.report()
+
+    def report(self) -> Dict:
+        """Print and return the memory report of this server"""
+        report = memory_report(os.getpid(), list(self._children))
+        print(format_report(report))
+        return report
+
+    def run(self):
+        """Preload, fork the workers and supervise them until stopped"""
+        self.preload()
+        self.bind()
+        threads = [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()]
+        if threads:
+            print(f"Warning: forking with running threads {threads}; their locks may be held in the workers")
+        print(f"Serving {self.app} on {self.host}:{self.port} with {self.workers} pre-forked workers "
+              f"(supervisor pid {os.getpid()})")
+
+        global _counters
+        from multiprocessing.sharedctypes import RawArray
+        _counters = RawArray("q", len(REPLACE_REASONS))
+        self._notices, self._notice_writer = os.pipe()
+        os.set_blocking(self._notices, False)
+
+        signal.signal(signal.SIGTERM, self._signal_stop)
+        signal.signal(signal.SIGINT, self._signal_stop)
+        signal.signal(signal.SIGUSR1, self._signal_report)
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        last_report = time.monotonic()
+        while self._children:
+            # Notices first, so a worker that recycled quickly is not taken for a crash
+            self._read_notices()
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid in self._children:
+                slot = self._children.pop(pid)
+                if pid in self._draining:
+                    print(f"Worker {slot} (pid {pid}) recycled ({self._draining.pop(pid)})")
+                elif not self._stopping:
+                    _counters[REPLACE_REASONS.index("crashed")] += 1
+                    print(f"Worker {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting")
+                    # Do not spin if a worker keeps dying at startup
+                    time.sleep(max(0.0, self._started[slot] + RESTART_DELAY - time.monotonic()))
+                    self._spawn(slot)
+                continue
+            if self.report_interval and time.monotonic() - last_report >= self.report_interval:
+                last_report = time.monotonic()
+                self.report()
+            time.sleep(0.5)
+        self._socket.close()
+        print("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing one model load")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Preload the app and models, then fork the workers")
+    serve.add_argument("--app", default="app.main:app", help="ASGI app as module:attribute")
+    serve.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"), help="Address to bind")
+    serve.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")), help="Port to bind")
+    serve.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", "2")),
+                       help="Worker processes (default: WORKERS or 2)")
+    serve.add_argument("--models", default="default",
+                       help="Models loaded before forking: default, all, none or comma-separated names")
+    serve.add_argument("--report-interval", type=float, default=0.0,
+                       help="Seconds between memory reports (default: only on SIGUSR1)")
+    serve.add_argument("--log-level", default="info", help="uvicorn log level")
+
+    report = commands.add_parser("report", help="Unique vs shared memory of a server's workers")
+    report.add_argument("pid", type=int, help="Supervisor PID (prefork server or `uvicorn --workers`)")
+    report.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+
+    args = parser.parse_args()
+    if args.command == "report":
+        try:
+            result = memory_report(args.pid)
+        except OSError as e:
+            print(f"FAILED: cannot read the memory of process {args.pid}: {e}")
+            sys.exit(1)
+        print(json.dumps(result, indent=2) if args.json else format_report(result))
+        return
+
+    PreforkServer(
+        app=args.app,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        models=args.models,
+        report_interval=args.report_interval,
+        log_level=args.log_level
+    ).run()
+
+
+if __name__ == "__main__":
+    # Run the importable copy of this module, whose notice pipe and counters
+    # are the ones the app sees in the workers
+    from app.utils.prefork import main as prefork_main
+    prefork_main()
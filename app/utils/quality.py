@@ -0,0 +1,216 @@
+"""
+Adaptive quality control for the Object Detection API
+When the admission queue builds up or recent latency climbs, requests are
+served at progressively cheaper quality levels (reduced input resolution,
+no annotated image, a lighter model) rather than left to time out. Load has
+to stay low for a while before quality is stepped back up, one level at a
+time, so the level does not flap around a threshold
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+class QualityLevel:
+    """
+    One way of serving a request
+
+    Args:
+        name: Reported in responses as quality_level
+        input_scale: Fraction of the configured network input size
+        render: Whether the annotated result image is produced
+        model: Registered model used instead of the default one (None: unchanged)
+    """
+
+    __slots__ = ("name", "input_scale", "render", "model")
+
+    def __init__(self, name: str, input_scale: float = 1.0, render: bool = True, model: Optional[str] = None):
+        self.name = name
+        self.input_scale = input_scale
+        self.render = render
+        self.model = model
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "input_scale": self.input_scale, "render": self.render, "model": self.model}
+
+
+def default_levels(reduced_scale: float = 0.75, min_scale: float = 0.5,
+                   light_model: Optional[str] = None) -> List[QualityLevel]:
+    """
+    The standard degradation ladder, from full quality to cheapest
+
+    full -> reduced (smaller input) -> fast (smallest input, no rendering)
+    -> light (also a lighter model, only if one is given)
+    """
+    levels = [
+        QualityLevel("full"),
+        QualityLevel("reduced", input_scale=reduced_scale),
+        QualityLevel("fast", input_scale=min_scale, render=False)
+    ]
+    if light_model:
+        levels.append(QualityLevel("light", input_scale=min_scale, render=False, model=light_model))
+    return levels
+
+
+class QualityController:
+    """
+    Chooses the quality level from queue depth and recent latency
+
+    Load is high when the queue depth or the recent p90 latency reaches its
+    degrade threshold, and low when both are at or below their recover
+    thresholds; in between the level is held. High load steps down one level
+    at most every `degrade_after` seconds. Low load has to last
+    `recover_after` seconds for each step back up.
+
+    Args:
+        levels: Quality levels from best to cheapest
+        enabled: Whether to adapt at all (if not, the first level is always used)
+        degrade_queue: Queue depth counted as high load
+        recover_queue: Queue depth counted as low load
+        degrade_latency_ms: p90 latency (queue wait + inference) counted as high load
+        recover_latency_ms: p90 latency counted as low load
+        degrade_after: Seconds between two step-downs
+        recover_after: Seconds of low load before each step up
+        window: Seconds of recent requests the latency percentile is taken over
+    """
+
+    def __init__(
+        self,
+        levels: Optional[List[QualityLevel]] = None,
+        enabled: bool = True,
+        degrade_queue: int = 8,
+        recover_queue: int = 1,
+        degrade_latency_ms: float = 1000.0,
+        recover_latency_ms: float = 300.0,
+        degrade_after: float = 2.0,
+        recover_after: float = 10.0,
+        window: float = 10.0
+    ):
+        self.levels = levels or default_levels()
+        self.enabled = enabled
+        self.degrade_queue = degrade_queue
+        self.recover_queue = recover_queue
+        self.degrade_latency_ms = degrade_latency_ms
+        self.recover_latency_ms = recover_latency_ms
+        self.degrade_after = degrade_after
+        self.recover_after = recover_after
+        self.window = window
+        # (time.monotonic(), latency in seconds) of recent requests
+        self._latencies: Deque[Tuple[float, float]] = deque(maxlen=1000)
+        self._index = 0
+        self._changed_at = float("-inf")
+        self._low_since: Optional[float] = None
+        self._lock = threading.Lock()
+        self.counts = {"degraded": 0, "recovered": 0}
+        self.served = {level.name: 0 for level in self.levels}
+
+    @classmethod
+    def from_env(cls) -> "QualityController":
+        """
+        Create a controller configured from environment variables
+
+        - ADAPTIVE_QUALITY: "1" to enable adaptation (default off)
+        - QUALITY_REDUCED_SCALE / QUALITY_MIN_SCALE: input scales of the reduced
+          and fast levels (default 0.75 and 0.5)
+        - QUALITY_LIGHT_MODEL: registered model for the light level (default: no light level)
+        - QUALITY_DEGRADE_QUEUE / QUALITY_RECOVER_QUEUE: queue depths (default 8 and 1)
+        - QUALITY_DEGRADE_LATENCY_MS / QUALITY_RECOVER_LATENCY_MS: p90 latencies (default 1000 and 300)
+        - QUALITY_DEGRADE_AFTER_S / QUALITY_RECOVER_AFTER_S: hysteresis delays (default 2 and 10)
+        - QUALITY_WINDOW_S: how far back latencies count (default 10)
+        """
+        return cls(
+            levels=default_levels(
+                reduced_scale=float(os.environ.get("QUALITY_REDUCED_SCALE", "0.75")),
+                min_scale=float(os.environ.get("QUALITY_MIN_SCALE", "0.5")),
+                light_model=os.environ.get("QUALITY_LIGHT_MODEL") or None
+            ),
+            enabled=os.environ.get("ADAPTIVE_QUALITY", "0") == "1",
+            degrade_queue=int(os.environ.get("QUALITY_DEGRADE_QUEUE", "8")),
+            recover_queue=int(os.environ.get("QUALITY_RECOVER_QUEUE", "1")),
+            degrade_latency_ms=float(os.environ.get("QUALITY_DEGRADE_LATENCY_MS", "1000")),
+            recover_latency_ms=float(os.environ.get("QUALITY_RECOVER_LATENCY_MS", "300")),
+            degrade_after=float(os.environ.get("QUALITY_DEGRADE_AFTER_S", "2")),
+            recover_after=float(os.environ.get("QUALITY_RECOVER_AFTER_S", "10")),
+            window=float(os.environ.get("QUALITY_WINDOW_S", "10"))
+        )
+
+    @property
+    def level(self) -> QualityLevel:
+        """The current quality level"""
+        return self.levels[self._index]
+
+    def _p90_latency_ms(self, now: float) -> float:
+        """p90 latency of the requests that finished within the window (lock held)"""
+        while self._latencies and self._latencies[0][0] < now - self.window:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0
+        latencies = sorted(latency for _, latency in self._latencies)
+        return latencies[min(len(latencies) - 1, int(0.9 * len(latencies)))] * 1000
+
+    def select(self, queue_depth: int, now: Optional[float] = None) -> QualityLevel:
+        """
+        Update the level from the current load and return it for a request about to run
+
+        Args:
+            queue_depth: Requests waiting for admission
+            now: time.monotonic() (for tests)
+        """
+        if not self.enabled:
+            level = self.levels[0]
+            self.served[level.name] += 1
+            return level
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            latency = self._p90_latency_ms(now)
+            if queue_depth >= self.degrade_queue or latency >= self.degrade_latency_ms:
+                self._low_since = None
+                if self._index < len(self.levels) - 1 and now - self._changed_at >= self.degrade_after:
+                    self._index += 1
+                    self._changed_at = now
+                    self.counts["degraded"] += 1
+                    print(f"Load high (queue {queue_depth}, p90 {latency:.0f} ms): quality -> {self.level.name}")
+            elif queue_depth <= self.recover_queue and latency <= self.recover_latency_ms:
+                if self._low_since is None:
+                    self._low_since = now
+                elif self._index > 0 and now - self._low_since >= self.recover_after:
+                    self._index -= 1
+                    self._changed_at = now
+                    # Each further step up needs its own quiet period
+                    self._low_since = now
+                    self.counts["recovered"] += 1
+                    print(f"Load low (queue {queue_depth}, p90 {latency:.0f} ms): quality -> {self.level.name}")
+            else:
+                self._low_since = None
+            level = self.level
+            self.served[level.name] += 1
+            return level
+
+    def record(self, latency: float, now: Optional[float] = None):
+        """Record the latency in seconds (queue wait + inference) of a finished request"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._latencies.append((now, latency))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "level": self.level.name,
+                "levels": [level.to_dict() for level in self.levels],
+                "p90_latency_ms": self._p90_latency_ms(time.monotonic()),
+                "thresholds": {
+                    "degrade_queue": self.degrade_queue,
+                    "recover_queue": self.recover_queue,
+                    "degrade_latency_ms": self.degrade_latency_ms,
+                    "recover_latency_ms": self.recover_latency_ms
+                },
+                "served": dict(self.served),
+                **self.counts
+            }
+
+
+# Shared controller for this process
+quality = QualityController.from_env()
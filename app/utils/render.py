@@ -0,0 +1,187 @@
+"""
+Result image renderer for the Object Detection API
+Draws the returned detections directly onto the decoded BGR image with
+OpenCV and encodes it with cv2.imencode (or libjpeg-turbo if available)
+"""
+import os
+import uuid
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+
+from app.utils.result_cache import RESULTS_DIR, result_cache
+
+# OpenCV is imported inside the functions so the API can import the format
+# constants here without loading it
+if TYPE_CHECKING:
+    import numpy as np
+
+# Defaults (overridable through the environment)
+RESULT_FORMAT = os.environ.get("RESULT_FORMAT", "jpeg").lower()
+RESULT_QUALITY = int(os.environ.get("RESULT_QUALITY", "85"))
+USE_TURBOJPEG = os.environ.get("USE_TURBOJPEG", "0") == "1"
+
+FORMAT_EXTENSIONS = {
+    "jpeg": ".jpg",
+    "jpg": ".jpg",
+    "webp": ".webp"
+}
+
+# Box colors per class (BGR)
+CLASS_COLORS = {
+    0: (56, 56, 255),     # person
+    2: (255, 112, 31),    # car
+    5: (0, 194, 255),     # bus
+    7: (151, 157, 255)    # truck
+}
+DEFAULT_COLOR = (0, 255, 0)
+
+_turbojpeg = None
+
+
+def _get_turbojpeg():
+    """Return a TurboJPEG encoder if PyTurboJPEG is installed, else None"""
+    global _turbojpeg
+    if _turbojpeg is None:
+        try:
+            from turbojpeg import TurboJPEG
+            _turbojpeg = TurboJPEG()
+        except Exception as e:
+            print(f"libjpeg-turbo not available, using cv2.imencode: {e}")
+            _turbojpeg = False
+    return _turbojpeg or None
+
+
+def validate_render_options(
+    fmt: Optional[str] = None,
+    quality: Optional[int] = None,
+    preview_width: Optional[int] = None
+):
+    """
+    Check per-request rendering options
+
+    Raises:
+        ValueError: With a message suitable for a 400 response
+    """
+    if fmt is not None and fmt.lower() not in FORMAT_EXTENSIONS:
+        raise ValueError("result_format must be jpeg or webp")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("result_quality must be between 1 and 100")
+    if preview_width is not None and preview_width < 16:
+        raise ValueError("preview_width must be at least 16")
+
+
+def draw_detections(img: "np.ndarray", detections: List[Dict[str, Any]], scale: float = 1.0) -> "np.ndarray":
+    """
+    Draw boxes and labels onto a BGR image in place
+
+    Args:
+        img: BGR image (modified in place)
+        detections: Detections in the simplified format returned by the models
+        scale: Factor applied to box coordinates (for downscaled previews)
+
+    Returns:
+        The same image
+    """
+    import cv2
+
+    thickness = max(1, round(max(img.shape[:2]) / 400))
+    font_scale = thickness / 3
+    for det in detections:
+        bbox = det["bbox"]
+        color = CLASS_COLORS.get(det["class_id"], DEFAULT_COLOR)
+        x1, y1 = int(bbox["x1"] * scale), int(bbox["y1"] * scale)
+        x2, y2 = int(bbox["x2"] * scale), int(bbox["y2"] * scale)
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness, cv2.LINE_AA)
+
+        label = f"{det['class_name']} {det['confidence']:.2f}"
+        (text_w, text_h), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
+        # Put the label above the box, or inside it if there is no room
+        top = y1 - text_h - baseline if y1 - text_h - baseline >= 0 else y1
+        cv2.rectangle(img, (x1, top), (x1 + text_w, top + text_h + baseline), color, -1)
+        cv2.putText(img, label, (x1, top + text_h), cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale, (255, 255, 255), 1, cv2.LINE_AA)
+    return img
+
+
+def encode_image(img: "np.ndarray", fmt: str = RESULT_FORMAT, quality: int = RESULT_QUALITY) -> bytes:
+    """
+    Encode a BGR image as JPEG or WebP
+
+    Args:
+        img: BGR image
+        fmt: "jpeg" or "webp"
+        quality: Encoder quality (1-100)
+
+    Returns:
+        Encoded bytes
+    """
+    import cv2
+
+    fmt = fmt.lower()
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unsupported result format '{fmt}'. Expected jpeg or webp")
+
+    if fmt == "webp":
+        ok, encoded = cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    else:
+        turbo = _get_turbojpeg() if USE_TURBOJPEG else None
+        if turbo is not None:
+            return turbo.encode(img, quality=quality)
+        ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError(f"Could not encode result image as {fmt}")
+    return encoded.tobytes()
+
+
+def render_result(
+    img: "np.ndarray",
+    detections: List[Dict[str, Any]],
+    fmt: Optional[str] = None,
+    quality: Optional[int] = None,
+    preview_width: Optional[int] = None,
+    suffix: str = "",
+    results_dir: str = RESULTS_DIR
+) -> str:
+    """
+    Draw detections on a BGR image and save it to the results directory
+
+    Without a preview width the boxes are drawn on `img` in place, avoiding a
+    copy. With one, the image is first downscaled and boxes are drawn on the
+    smaller image.
+
+    Args:
+        img: BGR image the detections refer to
+        detections: Detections to draw
+        fmt: "jpeg" or "webp" (default: RESULT_FORMAT)
+        quality: Encoder quality (default: RESULT_QUALITY)
+        preview_width: Downscale the output to this width if smaller than the image
+        suffix: Appended to the generated file name (e.g. "_simple")
+        results_dir: Directory to save to
+
+    Returns:
+        Path of the saved result image
+    """
+    import cv2
+
+    fmt = (fmt or RESULT_FORMAT).lower()
+    quality = quality or RESULT_QUALITY
+    extension = FORMAT_EXTENSIONS.get(fmt)
+    if extension is None:
+        raise ValueError(f"Unsupported result format '{fmt}'. Expected jpeg or webp")
+
+    scale = 1.0
+    if preview_width and preview_width < img.shape[1]:
+        scale = preview_width / img.shape[1]
+        height = max(1, round(img.shape[0] * scale))
+        img = cv2.resize(img, (preview_width, height), interpolation=cv2.INTER_AREA)
+
+    draw_detections(img, detections, scale)
+    data = encode_image(img, fmt, quality)
+
+    os.makedirs(results_dir, exist_ok=True)
+    result_path = os.path.join(results_dir, f"{uuid.uuid4()}{suffix}{extension}")
+    with open(result_path, "wb") as f:
+        f.write(data)
+    if results_dir == RESULTS_DIR:
+        # It is about to be requested: serve it from memory
+        result_cache.put(result_path, data)
+    return result_path
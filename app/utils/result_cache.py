@@ -0,0 +1,317 @@
+"""
+Serving of result images for the Object Detection API
+Result file names are UUIDs and never rewritten, so responses carry
+immutable caching headers and an ETag, and revalidations are answered with
+304 from a stat() alone. Recently produced results and resized variants
+(?w=320) are kept in a bounded in-memory LRU so monitoring walls that poll
+constantly are served without disk reads or re-encoding. Single byte ranges
+are supported
+"""
+import io
+import os
+import re
+import stat
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Dict, Optional, Sequence, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, QueryParams
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+RESULTS_DIR = "app/static/results"
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Encoder quality of resized variants
+VARIANT_QUALITY = 80
+
+MEDIA_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp", ".png": "image/png"}
+PIL_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP", ".png": "PNG"}
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _Entry:
+    __slots__ = ("data", "etag", "media_type")
+
+    def __init__(self, data: bytes, etag: str, media_type: str):
+        self.data = data
+        self.etag = etag
+        self.media_type = media_type
+
+
+def _etag(stat_result: os.stat_result, width: Optional[int]) -> str:
+    tag = f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+    return f'"{tag}-w{width}"' if width else f'"{tag}"'
+
+
+class ResultCache:
+    """
+    Bounded LRU of result images and their resized variants
+
+    Args:
+        max_bytes: Total image bytes kept in memory
+        widths: Variant widths offered; requested widths are rounded up to one
+                of them, so arbitrary ?w= values cannot fill the cache
+        results_dir: Directory results are served from
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, widths: Sequence[int] = (160, 320, 640, 1280),
+                 results_dir: str = RESULTS_DIR):
+        self.max_bytes = max_bytes
+        self.widths = sorted(widths)
+        self.results_dir = results_dir
+        self._entries: "OrderedDict[Tuple[str, Optional[int]], _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "not_modified": 0, "disk_reads": 0,
+                       "variants_generated": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """
+        Create a cache configured from environment variables
+
+        - RESULT_CACHE_MB: memory for cached images (default 64, 0 disables)
+        - RESULT_VARIANT_WIDTHS: comma-separated widths offered for ?w= (default 160,320,640,1280)
+        """
+        widths = os.environ.get("RESULT_VARIANT_WIDTHS", "160,320,640,1280")
+        return cls(
+            max_bytes=int(float(os.environ.get("RESULT_CACHE_MB", "64")) * 1024 * 1024),
+            widths=[int(w) for w in widths.split(",") if w.strip()]
+        )
+
+    def variant_width(self, requested: Optional[str]) -> Optional[int]:
+        """
+        Width of the variant to serve for a ?w= value (None: the original)
+
+        Raises:
+            ValueError: If the value is not a positive integer
+        """
+        if requested is None:
+            return None
+        width = int(requested)
+        if width <= 0:
+            raise ValueError("w must be a positive integer")
+        for offered in self.widths:
+            if offered >= width:
+                return offered
+        return None
+
+    def _store(self, key: Tuple[str, Optional[int]], entry: _Entry):
+        """Insert an entry and evict the least recently used beyond max_bytes (lock held)"""
+        if len(entry.data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old.data)
+        self._entries[key] = entry
+        self._bytes += len(entry.data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.data)
+            self.counts["evictions"] += 1
+
+    def put(self, path: str, data: bytes):
+        """Keep a freshly written result in memory (called by render_result)"""
+        name = os.path.basename(path)
+        extension = os.path.splitext(name)[1].lower()
+        if self.max_bytes <= 0 or extension not in MEDIA_TYPES:
+            return
+        stat_result = os.stat(path)
+        entry = _Entry(data, _etag(stat_result, None), MEDIA_TYPES[extension])
+        with self._lock:
+            self._store((name, None), entry)
+
+    def stat(self, name: str) -> Optional[os.stat_result]:
+        """stat() a result file, or None if it does not exist"""
+        try:
+            stat_result = os.stat(os.path.join(self.results_dir, name))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return stat_result if stat.S_ISREG(stat_result.st_mode) else None
+
+    def get(self, name: str, width: Optional[int], stat_result: os.stat_result) -> _Entry:
+        """
+        Return a result image or its variant, reading or generating it on a miss (blocking)
+
+        Args:
+            name: File name in the results directory
+            width: Variant width (PIL_FORMATS files only), or None for the original
+            stat_result: Current stat() of the file, to validate cached entries
+        """
+        etag = _etag(stat_result, width)
+        key = (name, width)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.etag == etag:
+                self._entries.move_to_end(key)
+                self.counts["hits"] += 1
+                return entry
+            self.counts["misses"] += 1
+            original = self._entries.get((name, None))
+
+        extension = os.path.splitext(name)[1].lower()
+        media_type = MEDIA_TYPES.get(extension, "application/octet-stream")
+        if original is not None and original.etag == _etag(stat_result, None):
+            data = original.data
+        else:
+            with open(os.path.join(self.results_dir, name), "rb") as f:
+                data = f.read()
+            self.counts["disk_reads"] += 1
+            original = _Entry(data, _etag(stat_result, None), media_type)
+
+        entry = original
+        if width is not None:
+            entry = _Entry(self._resize(data, width, PIL_FORMATS[extension]), etag, media_type)
+            self.counts["variants_generated"] += 1
+
+        if self.max_bytes > 0:
+            with self._lock:
+                self._store((name, None), original)
+                self._store(key, entry)
+        return entry
+
+    @staticmethod
+    def _resize(data: bytes, width: int, pil_format: str) -> bytes:
+        """Downscale an encoded image to `width` (never upscaling), in the same format"""
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(data))
+        if image.width <= width:
+            return data
+        height = max(1, round(image.height * width / image.width))
+        if pil_format == "JPEG":
+            # Let the decoder skip detail we are about to throw away
+            image.draft("RGB", (width, height))
+        image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        output = io.BytesIO()
+        options = {"quality": VARIANT_QUALITY} if pil_format in ("JPEG", "WEBP") else {}
+        image.save(output, format=pil_format, **options)
+        return output.getvalue()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "widths": self.widths,
+                **self.counts
+            }
+
+
+def _not_modified(request_headers: Headers, etag: str) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _byte_range(request_headers: Headers, etag: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header into inclusive (start, end)
+
+    Returns None to serve the whole file (no range, several ranges, or a
+    stale If-Range).
+
+    Raises:
+        ValueError: For an unsatisfiable range
+    """
+    value = request_headers.get("range")
+    if value is None:
+        return None
+    if_range = request_headers.get("if-range")
+    if if_range is not None and if_range != etag:
+        return None
+    match = _RANGE.match(value.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            raise ValueError("Empty suffix range")
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range starts beyond {size} bytes")
+    return start, end
+
+
+async def result_response(name: str, request_headers: Headers, query: QueryParams, method: str = "GET") -> Response:
+    """
+    Build the response for a result image with caching headers, 304s, ranges and ?w= variants
+
+    Raises:
+        HTTPException: 404 if the result does not exist, 400 for a bad w, 416 for a bad range
+    """
+    if os.path.basename(name) != name or name.startswith("."):
+        raise HTTPException(status_code=404)
+    try:
+        width = result_cache.variant_width(query.get("w"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="w must be a positive integer")
+    if os.path.splitext(name)[1].lower() not in PIL_FORMATS:
+        width = None
+
+    stat_result = await run_in_threadpool(result_cache.stat, name)
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="Result image not found")
+
+    etag = _etag(stat_result, width)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CACHE_CONTROL,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes"
+    }
+    if _not_modified(request_headers, etag):
+        result_cache.counts["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+
+    entry = await run_in_threadpool(result_cache.get, name, width, stat_result)
+    size = len(entry.data)
+    try:
+        byte_range = _byte_range(request_headers, etag, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    status_code, body = 200, entry.data
+    if byte_range is not None:
+        start, end = byte_range
+        status_code, body = 206, entry.data[start:end + 1]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(len(body))
+    return Response(
+        content=b"" if method == "HEAD" else body,
+        status_code=status_code,
+        headers=headers,
+        media_type=entry.media_type
+    )
+
+
+class ResultFiles(StaticFiles):
+    """StaticFiles for the results directory, served through result_response"""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        return await result_response(
+            path,
+            Headers(scope=scope),
+            QueryParams(scope.get("query_string", b"")),
+            scope["method"]
+        )
+
+
+# Shared cache for this process
+result_cache = ResultCache.from_env()
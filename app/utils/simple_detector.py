@@ -2,14 +2,37 @@
 Simple object detector based on basic computer vision techniques
 Used as a fallback when YOLOv8 can't be loaded
 """
-import os
-import uuid
 import sys
 import numpy as np
-from PIL import Image, ImageDraw
+from PIL import Image
 import cv2
 from pathlib import Path
 
+from app.utils.render import render_result
+
+
+def blurred_gray(img, width=None):
+    """
+    Grayscale + Gaussian blur, the cheap first step of our simple detection
+    
+    Args:
+        img: OpenCV image in BGR format
+        width: If set, downscale to this width first (keeping the aspect ratio)
+        
+    Returns:
+        Blurred single-channel uint8 image
+    """
+    if width is not None and img.shape[1] > width:
+        height = max(1, round(img.shape[0] * width / img.shape[1]))
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    
+    # Convert to grayscale
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    
+    # Apply Gaussian blur
+    return cv2.GaussianBlur(gray, (5, 5), 0)
+
+
 class SimpleDetector:
     """
     A very basic object detector using color-based segmentation
@@ -26,7 +49,8 @@ class SimpleDetector:
             7: "truck"
         }
     
-    def detect(self, image_input, conf_threshold=0.25, classes=None):
+    def detect(self, image_input, conf_threshold=0.25, classes=None,
+               fmt=None, quality=None, preview_width=None, render=True):
         """
         Detect objects in an image using basic computer vision techniques
         
@@ -34,6 +58,10 @@ class SimpleDetector:
             image_input: Path to an image file or PIL Image or numpy array
             conf_threshold: Confidence threshold (ignored in simple detector)
             classes: Classes to detect (ignored in simple detector)
+            fmt: Annotated image format, "jpeg" or "webp"
+            quality: Annotated image encoder quality
+            preview_width: Downscale the annotated image to this width
+            render: Whether to draw and save the annotated image
             
         Returns:
             Dict with detections and result image path
@@ -65,42 +93,21 @@ class SimpleDetector:
                 print(f"Unsupported image input type: {type(image_input)}")
                 return {"detections": [], "image_path": None}
             
-            # Create a copy for drawing
-            result_img = img.copy()
-            
             # Perform simple detection (just a placeholder)
             detections = self._simple_detection(img)
             
-            # Draw bounding boxes on result image
-            for det in detections:
-                bbox = det["bbox"]
-                label = f"{det['class_name']} ({det['confidence']:.2f})"
-                
-                # Draw rectangle
-                cv2.rectangle(
-                    result_img,
-                    (int(bbox["x1"]), int(bbox["y1"])),
-                    (int(bbox["x2"]), int(bbox["y2"])),
-                    (0, 255, 0),
-                    2
-                )
-                
-                # Draw label
-                cv2.putText(
-                    result_img,
-                    label,
-                    (int(bbox["x1"]), int(bbox["y1"] - 10)),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    (0, 255, 0),
-                    2
+            # Draw bounding boxes onto our private copy and save the result
+            result_path = None
+            if render:
+                result_path = render_result(
+                    img,
+                    detections,
+                    fmt=fmt,
+                    quality=quality,
+                    preview_width=preview_width,
+                    suffix="_simple"
                 )
             
-            # Save the result image
-            result_filename = f"{uuid.uuid4()}_simple.jpg"
-            result_path = f"app/static/results/{result_filename}"
-            cv2.imwrite(result_path, result_img)
-            
             return {
                 "detections": detections,
                 "image_path": result_path
@@ -126,11 +133,8 @@ class SimpleDetector:
         """
         detections = []
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply Gaussian blur
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        # Grayscale + blur
+        blurred = blurred_gray(img)
         
         # Apply Canny edge detection
         edges = cv2.Canny(blurred, 50, 150)
@@ -0,0 +1,112 @@
+"""
+Startup-time report for the Object Detection API
+Runs a fresh interpreter with `python -X importtime`, imports a target module
+and summarises where the import time went
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+# Modules that should only be imported by inference code, never at startup
+HEAVY_MODULES = ["torch", "ultralytics", "cv2", "PIL", "numpy"]
+
+
+def measure_imports(target: str = "app.main", python: str = sys.executable) -> List[Dict]:
+    """
+    Import a module in a fresh interpreter and collect `-X importtime` data
+
+    Args:
+        target: Dotted module path to import
+        python: Interpreter to run
+
+    Returns:
+        List of {"module", "self_us", "cumulative_us", "depth"} entries in import order
+    """
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True,
+        text=True,
+        cwd=os.getcwd()
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {target} failed:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        # Format: "import time: <self> | <cumulative> | <indent><module>"
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # Header line
+        name = parts[2].rstrip()
+        module = name.lstrip()
+        entries.append({
+            "module": module,
+            "self_us": int(parts[0]),
+            "cumulative_us": int(parts[1]),
+            "depth": (len(name) - len(module)) // 2
+        })
+    return entries
+
+
+def summarize(entries: List[Dict], top: int = 15) -> Dict:
+    """
+    Summarise import timings
+
+    Args:
+        entries: Output of measure_imports
+        top: Number of slowest top-level packages to report
+
+    Returns:
+        Dictionary with total time, slowest packages and heavy modules loaded
+    """
+    # Aggregate self time per top-level package
+    packages: Dict[str, int] = {}
+    for entry in entries:
+        package = entry["module"].split(".")[0]
+        packages[package] = packages.get(package, 0) + entry["self_us"]
+
+    loaded = {entry["module"] for entry in entries}
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    return {
+        "total_ms": sum(entry["self_us"] for entry in entries) / 1000,
+        "modules_imported": len(entries),
+        "slowest_packages": [
+            {"package": name, "ms": us / 1000} for name, us in slowest
+        ],
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in loaded]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import time of the API at startup")
+    parser.add_argument("--target", default="app.main", help="Module to import")
+    parser.add_argument("--top", type=int, default=15, help="Number of packages to list")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--strict", action="store_true",
+                        help="Exit non-zero if any heavy inference module is imported")
+
+    args = parser.parse_args()
+    report = summarize(measure_imports(args.target), args.top)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Importing {args.target}: {report['total_ms']:.1f} ms "
+              f"({report['modules_imported']} modules)")
+        for item in report["slowest_packages"]:
+            print(f"  {item['ms']:9.1f} ms  {item['package']}")
+        heavy = report["heavy_modules_loaded"]
+        print(f"Heavy modules loaded at startup: {', '.join(heavy) if heavy else 'none'}")
+
+    if args.strict and report["heavy_modules_loaded"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Per-stream detection count aggregation for the Object Detection API
+Every frame served for a stream_id adds its per-class object counts to
+fixed-size ring buffers at several resolutions (by default 1 second for an
+hour, 1 minute for a day and 1 hour for 30 days), so dashboards can query
+counts over time without pulling every /detect response. A slot is reused
+once its time has passed out of the ring, so the memory of a stream is
+fixed when it is first seen and does not grow with uptime
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from app.models.yolo_model import YOLOModel
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Seconds per unit in resolution specs such as "1m:1440"
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Per-frame peaks are stored as uint16
+_MAX_PEAK = 65535
+
+
+def parse_resolutions(spec: str) -> List[Tuple[str, int, int]]:
+    """
+    Parse a resolution spec such as "1s:3600,1m:1440,1h:720"
+
+    Returns:
+        [(name, seconds per bucket, buckets kept), ...] from finest to coarsest
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    resolutions = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, slots = item.partition(":")
+        name = name.strip().lower()
+        if not slots or name[-1:] not in _UNITS or not name[:-1].isdigit():
+            raise ValueError(f"Invalid resolution '{item}', expected e.g. 1m:1440")
+        step = int(name[:-1]) * _UNITS[name[-1]]
+        if step <= 0 or int(slots) <= 0:
+            raise ValueError(f"Invalid resolution '{item}'")
+        resolutions.append((name, step, int(slots)))
+    if not resolutions:
+        raise ValueError("At least one resolution is required")
+    return sorted(resolutions, key=lambda resolution: resolution[1])
+
+
+class _Ring:
+    """
+    Fixed-size ring of time buckets for one stream at one resolution
+
+    Slot i holds bucket number stamps[i] (time // step): the frames counted
+    in it, the summed per-class counts and the largest per-class count seen
+    in a single frame. A slot whose stamp is not the bucket asked for is stale.
+    """
+
+    __slots__ = ("step", "stamps", "frames", "sums", "peaks")
+
+    def __init__(self, step: int, slots: int, columns: int):
+        import numpy as np
+
+        self.step = step
+        self.stamps = np.full(slots, -1, dtype=np.int64)
+        self.frames = np.zeros(slots, dtype=np.int32)
+        self.sums = np.zeros((slots, columns), dtype=np.int32)
+        self.peaks = np.zeros((slots, columns), dtype=np.uint16)
+
+    @property
+    def nbytes(self) -> int:
+        return self.stamps.nbytes + self.frames.nbytes + self.sums.nbytes + self.peaks.nbytes
+
+    def add(self, now: float, counts: "np.ndarray"):
+        import numpy as np
+
+        bucket = int(now // self.step)
+        index = bucket % len(self.stamps)
+        stamp = self.stamps[index]
+        if stamp > bucket:
+            return  # Older than the ring reaches (clock stepped back)
+        if stamp != bucket:
+            self.stamps[index] = bucket
+            self.frames[index] = 0
+            self.sums[index] = 0
+            self.peaks[index] = 0
+        self.frames[index] += 1
+        self.sums[index] += counts
+        self.peaks[index] = np.maximum(self.peaks[index], np.minimum(counts, _MAX_PEAK))
+
+    def window(self, first: int, last: int) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """Frames, sums and peaks of buckets first..last (inclusive), zero where nothing was recorded"""
+        import numpy as np
+
+        buckets = np.arange(first, last + 1, dtype=np.int64)
+        indices = buckets % len(self.stamps)
+        valid = self.stamps[indices] == buckets
+        frames = np.where(valid, self.frames[indices], 0)
+        sums = np.where(valid[:, None], self.sums[indices], 0)
+        peaks = np.where(valid[:, None], self.peaks[indices], 0)
+        return frames, sums, peaks
+
+
+class StreamStats:
+    """
+    Per-stream, per-class detection counts at several time resolutions
+
+    Args:
+        resolutions: (name, seconds per bucket, buckets kept) from parse_resolutions
+        enabled: Whether frames are recorded at all
+        max_streams: Streams tracked at once (least recently seen are dropped)
+    """
+
+    def __init__(self, resolutions: Optional[List[Tuple[str, int, int]]] = None, enabled: bool = True,
+                 max_streams: int = 256):
+        self.resolutions = resolutions or parse_resolutions("1s:3600,1m:1440,1h:720")
+        self.enabled = enabled
+        self.max_streams = max_streams
+        self.class_ids = list(YOLOModel.CLASS_NAMES)
+        self.class_names = [YOLOModel.CLASS_NAMES[class_id] for class_id in self.class_ids]
+        self._columns = {class_id: column for column, class_id in enumerate(self.class_ids)}
+        self._streams: "OrderedDict[str, Dict[str, _Ring]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls) -> "StreamStats":
+        """
+        Create an aggregator configured from environment variables
+
+        - STREAM_STATS: "0" to stop aggregating counts (default on)
+        - STREAM_STATS_RESOLUTIONS: bucket size and buckets kept per resolution
+          (default "1s:3600,1m:1440,1h:720": an hour, a day and 30 days)
+        - STREAM_STATS_MAX_STREAMS: streams tracked at once (default 256)
+        """
+        return cls(
+            resolutions=parse_resolutions(os.environ.get("STREAM_STATS_RESOLUTIONS", "1s:3600,1m:1440,1h:720")),
+            enabled=os.environ.get("STREAM_STATS", "1") == "1",
+            max_streams=int(os.environ.get("STREAM_STATS_MAX_STREAMS", "256"))
+        )
+
+    def _resolution(self, name: Optional[str]) -> Tuple[str, int, int]:
+        if name is None:
+            return self.resolutions[0]
+        for resolution in self.resolutions:
+            if resolution[0] == name.lower():
+                return resolution
+        raise ValueError(f"Unknown resolution '{name}'. Available: "
+                         f"{', '.join(resolution[0] for resolution in self.resolutions)}")
+
+    def record(self, stream_id: str, detections: List[Dict[str, Any]], now: Optional[float] = None):
+        """
+        Count one frame's detections for a stream
+
+        Args:
+            stream_id: Camera/stream identifier
+            detections: Detections of the frame (dicts with "class_id")
+            now: Frame time as time.time() (default: now)
+        """
+        if not self.enabled:
+            return
+        import numpy as np
+
+        counts = np.zeros(len(self.class_ids), dtype=np.int32)
+        for detection in detections:
+            column = self._columns.get(detection.get("class_id"))
+            if column is not None:
+                counts[column] += 1
+        now = time.time() if now is None else now
+        with self._lock:
+            rings = self._streams.get(stream_id)
+            if rings is None:
+                rings = self._streams[stream_id] = {
+                    name: _Ring(step, slots, len(self.class_ids)) for name, step, slots in self.resolutions
+                }
+                if len(self._streams) > self.max_streams:
+                    self._streams.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._streams.move_to_end(stream_id)
+            for ring in rings.values():
+                ring.add(now, counts)
+            self.recorded += 1
+
+    def query(self, stream_id: str, resolution: Optional[str] = None, start: Optional[float] = None,
+              end: Optional[float] = None, limit: int = 60) -> Dict[str, Any]:
+        """
+        Aggregated counts of a stream over a time window
+
+        Buckets are returned oldest first as parallel arrays, including
+        buckets in which nothing was recorded (zero frames).
+
+        Args:
+            stream_id: Camera/stream identifier
+            resolution: Resolution name such as "1m" (default: the finest)
+            start: Window start as epoch seconds (default: `limit` buckets before `end`)
+            end: Window end as epoch seconds (default: now)
+            limit: Buckets returned when `start` is not given
+
+        Returns:
+            {"stream_id", "resolution", "step_s", "start", "classes", "frames",
+             "counts" (per class: objects summed over the bucket's frames),
+             "max" (per class: most objects in one frame of the bucket)}
+
+        Raises:
+            KeyError: If the stream has not been seen (or was evicted)
+            ValueError: For an unknown resolution or an empty window
+        """
+        name, step, slots = self._resolution(resolution)
+        last = int((time.time() if end is None else end) // step)
+        first = int(start // step) if start is not None else last - max(1, limit) + 1
+        if first > last:
+            raise ValueError("start must not be after end")
+        # Older buckets have been overwritten
+        first = max(first, last - slots + 1)
+        with self._lock:
+            rings = self._streams.get(stream_id)
+            if rings is None:
+                raise KeyError(stream_id)
+            frames, sums, peaks = rings[name].window(first, last)
+        return {
+            "stream_id": stream_id,
+            "resolution": name,
+            "step_s": step,
+            "start": first * step,
+            "classes": self.class_names,
+            "frames": frames.tolist(),
+            "counts": {class_name: sums[:, column].tolist() for column, class_name in enumerate(self.class_names)},
+            "max": {class_name: peaks[:, column].tolist() for column, class_name in enumerate(self.class_names)}
+        }
+
+    def streams(self) -> List[str]:
+        with self._lock:
+            return list(self._streams)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            streams = len(self._streams)
+            per_stream = sum(ring.nbytes for ring in next(iter(self._streams.values())).values()) if streams else 0
+        return {
+            "enabled": self.enabled,
+            "resolutions": {name: {"step_s": step, "buckets": slots} for name, step, slots in self.resolutions},
+            "streams": streams,
+            "max_streams": self.max_streams,
+            "recorded_frames": self.recorded,
+            "evicted_streams": self.evicted,
+            "bytes_per_stream": per_stream,
+            "memory_bytes": per_stream * streams
+        }
+
+
+# Shared aggregator for this process
+stream_stats = StreamStats.from_env()
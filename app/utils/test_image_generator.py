@@ -32,11 +32,9 @@ def generate_test_image(width=640, height=480, num_shapes=5, output_path='test_i
         (128, 128, 128) # Gray
     ]
     
-    # Add a background pattern
-    for i in range(0, width, 40):
-        cv2.line(img, (i, 0), (i, height), (240, 240, 240), 1)
-    for i in range(0, height, 40):
-        cv2.line(img, (0, i), (width, i), (240, 240, 240), 1)
+    # Add a background pattern (one-pixel grid lines every 40 px)
+    img[:, ::40] = 240
+    img[::40, :] = 240
     
     # Draw random shapes
     for _ in range(num_shapes):
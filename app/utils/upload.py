@@ -0,0 +1,254 @@
+"""
+Upload ingestion for the Object Detection API
+Caps request bodies per route as they stream in, sniffs the image format
+from the first bytes and checks image dimensions before anything is decoded
+"""
+import io
+import json
+import os
+from typing import BinaryIO, Dict, Optional, Tuple, TYPE_CHECKING
+
+from fastapi import UploadFile
+
+from app.utils.decode import reduced_decode
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Limits (overridable through the environment)
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+# Whole multi-file submission to /jobs
+MAX_JOB_UPLOAD_BYTES = int(float(os.environ.get("MAX_JOB_UPLOAD_MB", "200")) * 1024 * 1024)
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(64 * 1024 * 1024)))
+MAX_IMAGE_SIDE = int(os.environ.get("MAX_IMAGE_SIDE", "4096"))
+CHUNK_SIZE = 64 * 1024
+
+# Magic numbers of the formats we accept
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF")
+]
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is refused; carries the HTTP status to return"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """
+    Identify an image format from its first bytes
+
+    Args:
+        header: At least the first 12 bytes of the file
+
+    Returns:
+        Format name (as used by PIL) or None if it is not a supported image
+    """
+    if len(header) >= 12 and header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+async def read_upload(
+    file: UploadFile,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    chunk_size: int = CHUNK_SIZE
+) -> Tuple[BinaryIO, str]:
+    """
+    Validate an upload and return its spooled file without copying it
+
+    By the time this runs Starlette has parsed the body into a spooled file,
+    and UploadSizeLimitMiddleware has capped the request as it streamed in.
+    Here the single file is checked against `max_bytes` and its format is
+    sniffed from the first bytes; the client's Content-Type header is not
+    trusted.
+
+    Args:
+        file: The uploaded file object
+        max_bytes: Maximum accepted size in bytes
+        chunk_size: Bytes read to sniff the format
+
+    Returns:
+        (the upload's file object positioned at 0, sniffed image format)
+
+    Raises:
+        UploadRejected: 413 when too large, 415 when not a supported image
+    """
+    buffer = file.file
+    size = file.size
+    if size is None:
+        size = buffer.seek(0, io.SEEK_END)
+    if size > max_bytes:
+        raise UploadRejected(413, f"Upload exceeds the {max_bytes} byte limit")
+
+    buffer.seek(0)
+    image_format = sniff_image_format(buffer.read(chunk_size))
+    if image_format is None:
+        raise UploadRejected(415, "Uploaded file is not a supported image (JPEG, PNG, GIF, BMP, TIFF, WEBP)")
+
+    buffer.seek(0)
+    return buffer, image_format
+
+
+def read_all(buffer: BinaryIO) -> bytes:
+    """The whole content of an upload file object, leaving it positioned at 0"""
+    buffer.seek(0)
+    try:
+        return buffer.read()
+    finally:
+        buffer.seek(0)
+
+
+def open_image(
+    buffer: io.BytesIO,
+    max_pixels: int = MAX_IMAGE_PIXELS,
+    max_side: int = MAX_IMAGE_SIDE,
+    target_side: Optional[int] = None
+) -> Tuple["Image.Image", float]:
+    """
+    Open an image, checking its dimensions from the header before decoding
+
+    Images above `max_pixels` are rejected. Images whose longest side exceeds
+    `max_side` are downscaled; JPEGs use draft mode so the DCT decoder only
+    produces the reduced resolution instead of decoding at full size.
+
+    Args:
+        buffer: Encoded image bytes
+        max_pixels: Maximum width * height accepted
+        max_side: Longest side kept before downscaling
+        target_side: If set, decode JPEGs directly near this size (the model
+                     input size) instead of at full resolution
+
+    Returns:
+        (image, scale) where scale = original size / returned size (>= 1.0)
+
+    Raises:
+        UploadRejected: 400 if the image cannot be parsed, 413 if it is too large
+    """
+    from PIL import Image
+
+    try:
+        # Only the header is parsed here; pixel data is decoded lazily
+        image = Image.open(buffer)
+    except Exception as e:
+        raise UploadRejected(400, f"Invalid image file: {str(e)}")
+
+    width, height = image.size
+    if width * height > max_pixels:
+        raise UploadRejected(
+            413, f"Image is {width}x{height}, above the {max_pixels} pixel limit"
+        )
+
+    if target_side is not None:
+        image, _ = reduced_decode(image, target_side)
+
+    if max(image.size) > max_side:
+        factor = max(image.size) / max_side
+        target = (int(image.size[0] / factor), int(image.size[1] / factor))
+        if image.format == "JPEG":
+            # Decode at 1/2, 1/4 or 1/8 resolution directly in the DCT domain
+            image.draft("RGB", target)
+        try:
+            image.thumbnail(target)
+        except Exception as e:
+            raise UploadRejected(400, f"Invalid image file: {str(e)}")
+
+    return image, width / image.size[0]
+
+
+class RequestBodyTooLarge(Exception):
+    """Raised to the application when its request body passes the route's cap"""
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware capping POST/PUT bodies per route while they stream in
+
+    A Content-Length above the cap is rejected before anything is read. The
+    received bytes are counted too, so chunked bodies without a length are
+    stopped as soon as they pass the cap, before the multipart parser has
+    spooled them. Paths in `limits` get their own cap (e.g. multi-file job
+    submissions); other paths get `max_bytes`.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, limits: Optional[Dict[str, int]] = None,
+                 overhead: int = 64 * 1024):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits or {}
+        # Allow some room for multipart boundaries and the other form fields
+        self.overhead = overhead
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+
+        max_body = self.limits.get(scope["path"], self.max_bytes) + self.overhead
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > max_body
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    await self._reject(send)
+                    return
+                break
+
+        received = 0
+        started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    if not started:
+                        await self._reject(send)
+                    rejected = True
+                    raise RequestBodyTooLarge(f"Request body exceeds {max_body} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if rejected:
+                # The 413 has gone out; drop whatever the app answers to the aborted read
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+    @staticmethod
+    async def _reject(send):
+        body = json.dumps({"error": "Request body too large"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
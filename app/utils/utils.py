@@ -1,16 +1,19 @@
+import hmac
 import os
+import shutil
 import uuid
 from pathlib import Path
-from typing import Dict, Any, List, Union
-from fastapi import UploadFile
+from typing import Dict, Any, BinaryIO, List, Union
+from fastapi import Request, UploadFile
 
-def save_uploaded_file(file: UploadFile, file_content: bytes) -> str:
+def save_uploaded_file(file: UploadFile, file_content: Union[bytes, memoryview, BinaryIO]) -> str:
     """
     Save an uploaded file to the uploads directory
     
     Args:
         file: The uploaded file object
-        file_content: The file content as bytes
+        file_content: The file content as bytes, or a file object (e.g. the
+                      upload's spooled file) copied from its start
     
     Returns:
         The path where the file was saved
@@ -22,10 +25,34 @@ def save_uploaded_file(file: UploadFile, file_content: bytes) -> str:
     
     # Save the file
     with open(file_path, "wb") as f:
-        f.write(file_content)
+        if hasattr(file_content, "read"):
+            file_content.seek(0)
+            shutil.copyfileobj(file_content, f)
+            file_content.seek(0)
+        else:
+            f.write(file_content)
     
     return file_path
 
+def rescale_detections(detections: List[Dict[str, Any]], scale: float) -> List[Dict[str, Any]]:
+    """
+    Map detection boxes from a downscaled image back to the original image
+    
+    Args:
+        detections: Detections in the simplified format returned by the models
+        scale: Original size / inference size
+    
+    Returns:
+        The same list, with bbox coordinates multiplied by scale in place
+    """
+    if scale == 1.0:
+        return detections
+    for det in detections:
+        bbox = det["bbox"]
+        for key in ("x1", "y1", "x2", "y2", "width", "height"):
+            bbox[key] = float(bbox[key] * scale)
+    return detections
+
 def clean_old_files(directory: str, max_files: int = 100):
     """
     Remove old files from a directory when the number of files exceeds max_files
@@ -46,4 +73,18 @@ def clean_old_files(directory: str, max_files: int = 100):
             try:
                 file.unlink()
             except Exception as e:
-                print(f"Error removing file {file}: {e}") 
\ No newline at end of file
+                print(f"Error removing file {file}: {e}") 
+
+def has_bearer_token(request: Request, token: str) -> bool:
+    """
+    Check a request's `Authorization: Bearer <token>` header in constant time
+    
+    Args:
+        request: The incoming request
+        token: The expected token
+    
+    Returns:
+        True if the header carries exactly this token
+    """
+    scheme, _, value = request.headers.get("authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(value.strip().encode(), token.encode())
@@ -0,0 +1,234 @@
+"""
+Inference worker for the distributed inference queue
+Claims detection tasks from the broker in batches, runs them through the
+model registry with batched inference and publishes the results. Start one
+per host or per core group:
+
+    python -m app.utils.worker --broker redis://broker:6379/0 --batch-size 8
+"""
+import argparse
+import io
+import itertools
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from app.utils.broker import InferenceQueue, Task, default_worker_id
+
+if TYPE_CHECKING:
+    from app.utils.memory import RecyclePolicy
+
+
+def _params_key(item: Tuple[bytes, Task, bytes]) -> str:
+    """Grouping key: tasks with equal parameters share a forward pass"""
+    return repr(sorted(item[1]["params"].items()))
+
+
+class InferenceWorker:
+    """
+    Consumes detection tasks from an InferenceQueue
+
+    Args:
+        queue: Queue to consume
+        worker_id: Unique name (default: host, PID and a random suffix)
+        batch_size: Most tasks claimed at once
+        heartbeat_interval: Seconds between heartbeats (keep well below the queue's heartbeat_ttl)
+        poll_timeout: Seconds to block waiting for work before checking for shutdown
+        recycle: Policy after which the worker stops, once its current batch is
+                 done, so a supervisor can start a fresh process (app.utils.memory)
+    """
+
+    def __init__(self, queue: InferenceQueue, worker_id: Optional[str] = None, batch_size: int = 8,
+                 heartbeat_interval: float = 5.0, poll_timeout: float = 1.0,
+                 recycle: Optional["RecyclePolicy"] = None):
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_size = batch_size
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_timeout = poll_timeout
+        self.stop_event = threading.Event()
+        self.started_at = time.time()
+        self.counts = {"batches": 0, "processed": 0, "failed": 0, "abandoned": 0, "requeued": 0}
+        self.recycle = recycle
+        if recycle is not None:
+            recycle.action = lambda reason: self.stop()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "batch_size": self.batch_size,
+            "started_at": self.started_at,
+            "heartbeat_at": time.time(),
+            "recycle": self.recycle.stats() if self.recycle is not None else None,
+            **self.counts
+        }
+
+    def _heartbeat_loop(self):
+        """Report liveness and requeue the work of dead workers"""
+        while not self.stop_event.is_set():
+            try:
+                self.queue.heartbeat(self.worker_id, self.info())
+                self.counts["requeued"] += self.queue.requeue_dead_workers()
+            except Exception as e:
+                print(f"Worker {self.worker_id} heartbeat failed: {e}")
+            self.stop_event.wait(self.heartbeat_interval)
+
+    def run(self):
+        """Process tasks until stop() is called"""
+        print(f"Worker {self.worker_id} consuming {self.queue.queue_key} in batches of {self.batch_size}")
+        self.queue.heartbeat(self.worker_id, self.info())
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name=f"heartbeat-{self.worker_id}", daemon=True)
+        heartbeat.start()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    claimed = self.queue.claim(self.worker_id, self.batch_size, self.poll_timeout)
+                except Exception as e:
+                    print(f"Worker {self.worker_id} could not claim tasks: {e}")
+                    self.stop_event.wait(self.poll_timeout)
+                    continue
+                if claimed:
+                    self.process(claimed)
+                    if self.recycle is not None:
+                        self.recycle.request_done(len(claimed))
+        finally:
+            self.stop_event.set()
+            self.queue.deregister(self.worker_id)
+            print(f"Worker {self.worker_id} stopped")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def process(self, claimed: List[bytes]):
+        """Run a batch of claimed tasks, one batched inference per group of equal parameters"""
+        self.counts["batches"] += 1
+        runnable: List[Tuple[bytes, Task, bytes]] = []
+        for raw in claimed:
+            task, image, attempt = self.queue.load(raw)
+            if image is None:
+                # The client gave up or the task expired
+                self.counts["abandoned"] += 1
+                self.queue.complete(self.worker_id, raw, task)
+            elif attempt > self.queue.max_attempts:
+                self.counts["failed"] += 1
+                self.queue.complete(self.worker_id, raw, task, {
+                    "error": f"Task failed after {attempt - 1} deliveries"
+                })
+            else:
+                runnable.append((raw, task, image))
+
+        for _, group in itertools.groupby(sorted(runnable, key=_params_key), key=_params_key):
+            self._run_group(list(group))
+
+    def _run_group(self, group: List[Tuple[bytes, Task, bytes]]):
+        """Decode and detect a group of tasks sharing model and options"""
+        from app.models.registry import registry
+        from app.utils.upload import open_image, UploadRejected
+
+        params = group[0][1]["params"]
+        decoded = []
+        for raw, task, payload in group:
+            try:
+                image, scale = open_image(io.BytesIO(payload), **task["decode"])
+            except UploadRejected as e:
+                self.counts["failed"] += 1
+                self.queue.complete(self.worker_id, raw, task, {"error": e.message})
+                continue
+            decoded.append((raw, task, image, scale))
+        if not decoded:
+            return
+
+        options = dict(
+            conf_threshold=params["conf"],
+            classes=params["classes"],
+            result_format=params["result_format"],
+            result_quality=params["result_quality"],
+            preview_width=params["preview_width"],
+            render=params.get("render", True),
+            input_scale=params.get("input_scale", 1.0)
+        )
+        start = time.time()
+        try:
+            with registry.acquire(params["model"]) as detector:
+                images = [image for _, _, image, _ in decoded]
+                if len(images) == 1:
+                    results = [detector.detect(images[0], **options)]
+                else:
+                    results = detector.detect_batch(images, **options)
+        except Exception as e:
+            print(f"Worker {self.worker_id} batch failed: {e}")
+            self.counts["failed"] += len(decoded)
+            for raw, task, _, _ in decoded:
+                self.queue.complete(self.worker_id, raw, task, {"error": str(e)})
+            return
+        inference_time = time.time() - start
+
+        for (raw, task, _, scale), result in zip(decoded, results):
+            rendered = None
+            image_path = result.get("image_path")
+            if image_path:
+                # The image is shipped back through the broker; the API host serves it
+                with open(image_path, "rb") as f:
+                    rendered = f.read()
+                os.remove(image_path)
+            self.queue.complete(self.worker_id, raw, task, {
+                "detections": result["detections"],
+                "image_scale": scale,
+                "result_extension": os.path.splitext(image_path)[1] if image_path else None,
+                "inference_time": inference_time,
+                "batch_size": len(decoded),
+                "worker": self.worker_id
+            }, rendered)
+            self.counts["processed"] += 1
+
+
+def start_local_workers(queue: InferenceQueue, count: int, batch_size: int = 8) -> List[InferenceWorker]:
+    """Run `count` workers on daemon threads of this process (for the in-process broker)"""
+    workers = []
+    for index in range(count):
+        worker = InferenceWorker(queue, worker_id=f"{default_worker_id()}-{index}", batch_size=batch_size)
+        threading.Thread(target=worker.run, name=f"inference-worker-{index}", daemon=True).start()
+        workers.append(worker)
+    return workers
+
+
+def main():
+    from app.models.yolo_model import BATCH_SIZE
+
+    parser = argparse.ArgumentParser(description="Consume detection tasks from the inference broker")
+    parser.add_argument("--broker", default=os.environ.get("BROKER_URL"),
+                        help="Broker URL, e.g. redis://localhost:6379/0 (default: BROKER_URL)")
+    parser.add_argument("--worker-id", default=None, help="Unique worker name (default: host-pid-random)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Most tasks claimed per batch")
+    parser.add_argument("--heartbeat", type=float, default=5.0, help="Seconds between heartbeats")
+    parser.add_argument("--preload", action="store_true", help="Load and warm up the default model before consuming")
+    args = parser.parse_args()
+
+    if not args.broker or args.broker == "local-redis":
+        parser.error("--broker (or BROKER_URL) must name a Redis server shared with the API")
+
+    from app.models.registry import registry
+    from app.utils.memory import recycle_policy
+    registry.verify_bundles()
+    if args.preload:
+        registry.warmup()
+
+    # WORKER_MAX_REQUESTS counts tasks here; run under a supervisor that restarts the worker
+    worker = InferenceWorker(
+        InferenceQueue.from_env(args.broker),
+        worker_id=args.worker_id,
+        batch_size=args.batch_size,
+        heartbeat_interval=args.heartbeat,
+        recycle=recycle_policy if recycle_policy.enabled else None
+    )
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
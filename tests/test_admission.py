@@ -0,0 +1,122 @@
+"""
+Tests for the admission controller: priority order, load shedding with
+Retry-After and dropping queued work whose deadline has passed
+"""
+import asyncio
+import io
+import time
+
+import pytest
+
+from app.utils.admission import AdmissionController, AdmissionRejected, DeadlineExceeded
+
+
+async def hold(controller: AdmissionController, release: asyncio.Event):
+    """Take an inference slot until `release` is set"""
+    async with controller.admit("live"):
+        await release.wait()
+
+
+def test_queued_work_is_served_by_priority_then_fifo():
+    async def scenario():
+        controller = AdmissionController(concurrency=1)
+        release = asyncio.Event()
+        order = []
+
+        async def request(name, priority):
+            async with controller.admit(priority):
+                order.append(name)
+
+        holder = asyncio.create_task(hold(controller, release))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(request(name, priority))
+            for name, priority in [("batch-1", "batch"), ("live-1", "live"), ("batch-2", "batch"), ("live-2", "live")]
+        ]
+        await asyncio.sleep(0.01)
+        assert controller.queue_depth() == 4
+        release.set()
+        await asyncio.gather(holder, *waiting)
+        return order, controller.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["live-1", "live-2", "batch-1", "batch-2"]
+    assert stats["active"] == 0
+    assert stats["queue_depth"] == 0
+
+
+@pytest.mark.parametrize("priority, status_code", [("live", 503), ("batch", 429)])
+def test_full_queue_is_rejected_with_retry_after(priority, status_code):
+    async def scenario():
+        controller = AdmissionController(concurrency=1, max_queue={priority: 1})
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(controller, release))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(controller.admit(priority).__aenter__())
+        await asyncio.sleep(0.01)
+        try:
+            async with controller.admit(priority):
+                pass
+        finally:
+            release.set()
+            await holder
+            await queued
+        raise AssertionError("the third request was admitted")
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(scenario())
+    assert rejected.value.status_code == status_code
+    assert rejected.value.retry_after >= 1
+
+
+def test_expired_work_is_dropped_from_the_queue():
+    async def scenario():
+        controller = AdmissionController(concurrency=1)
+        release = asyncio.Event()
+        ran = []
+
+        async def request(name, deadline):
+            async with controller.admit("live", deadline):
+                ran.append(name)
+
+        holder = asyncio.create_task(hold(controller, release))
+        await asyncio.sleep(0)
+        expiring = asyncio.create_task(request("expiring", time.time() + 0.05))
+        patient = asyncio.create_task(request("patient", None))
+        await asyncio.sleep(0.1)
+        release.set()
+        results = await asyncio.gather(holder, expiring, patient, return_exceptions=True)
+        return ran, results, controller.stats()
+
+    ran, results, stats = asyncio.run(scenario())
+    assert ran == ["patient"]
+    assert isinstance(results[1], DeadlineExceeded)
+    assert stats["classes"]["live"]["expired"] == 1
+    assert stats["active"] == 0
+
+
+def test_past_deadline_is_refused_immediately():
+    async def scenario():
+        async with AdmissionController().admit("live", time.time() - 1):
+            pass
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(scenario())
+
+
+def test_detect_endpoint_sheds_load_with_retry_after(monkeypatch):
+    from fastapi.testclient import TestClient
+    from PIL import Image
+
+    from app.main import app
+    from app.utils.admission import admission
+
+    image = io.BytesIO()
+    Image.new("RGB", (64, 48)).save(image, format="JPEG")
+    monkeypatch.setattr(admission, "_active", admission.concurrency)
+    monkeypatch.setitem(admission.max_queue, "live", 0)
+
+    response = TestClient(app).post("/detect", files={"file": ("a.jpg", image.getvalue(), "image/jpeg")})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert "error" in response.json()
@@ -0,0 +1,113 @@
+"""
+Tests for the distributed inference queue on the in-process Redis stand-in:
+at-least-once redelivery, requeueing the tasks of dead workers and max_attempts
+"""
+import threading
+import time
+
+import pytest
+
+from app.utils.broker import InferenceQueue
+from app.utils.local_redis import LocalRedis
+from app.utils.worker import InferenceWorker
+
+PARAMS = {"params": {"model": "yolov8n", "conf": 0.25}, "decode": {}}
+
+
+@pytest.fixture
+def queue():
+    return InferenceQueue(LocalRedis(), prefix="test", heartbeat_ttl=0.05, max_attempts=2)
+
+
+def test_claimed_task_is_redelivered_after_worker_dies(queue):
+    task_id = queue.submit(PARAMS, b"image")
+
+    # Worker a claims the task and dies before completing it
+    queue.heartbeat("a", {})
+    claimed = queue.claim("a", batch_size=4, timeout=0.1)
+    task, payload, attempt = queue.load(claimed[0])
+    assert (task["id"], payload, attempt) == (task_id, b"image", 1)
+    assert queue.claim("b", batch_size=4, timeout=0.01) == []
+
+    time.sleep(0.1)
+    assert queue.requeue_dead_workers() == 1
+    assert queue.stats()["workers"] == {}
+
+    # Worker b gets the same task again and finishes it
+    redelivered = queue.claim("b", batch_size=4, timeout=0.1)
+    assert redelivered == claimed
+    task, payload, attempt = queue.load(redelivered[0])
+    assert attempt == 2
+    queue.complete("b", redelivered[0], task, {"detections": [], "worker": "b"})
+
+    reply, image = queue.wait(task_id, timeout=1)
+    assert reply == {"detections": [], "worker": "b"}
+    assert image is None
+    assert queue.stats()["queue_depth"] == 0
+    assert queue.client.llen("test:processing:b") == 0
+
+
+def test_live_workers_keep_their_tasks(queue):
+    queue.heartbeat_ttl = 10
+    queue.submit(PARAMS, b"image")
+    queue.heartbeat("a", {})
+    queue.claim("a", batch_size=1, timeout=0.1)
+
+    assert queue.requeue_dead_workers() == 0
+    assert queue.stats()["workers"]["a"]["in_flight"] == 1
+
+
+def test_deregister_returns_claimed_tasks(queue):
+    queue.submit(PARAMS, b"one")
+    queue.submit(PARAMS, b"two")
+    queue.heartbeat("a", {})
+    assert len(queue.claim("a", batch_size=8, timeout=0.1)) == 2
+
+    queue.deregister("a")
+    assert queue.stats()["queue_depth"] == 2
+    assert queue.stats()["workers"] == {}
+
+
+def test_task_fails_after_max_attempts(queue):
+    task_id = queue.submit(PARAMS, b"image")
+    # Two deliveries to workers that die
+    for attempt in range(queue.max_attempts):
+        claimed = queue.claim(f"dead-{attempt}", batch_size=1, timeout=0.1)
+        queue.load(claimed[0])
+        queue.requeue(f"dead-{attempt}")
+
+    worker = InferenceWorker(queue, worker_id="c")
+    worker.process(queue.claim("c", batch_size=1, timeout=0.1))
+
+    reply, _ = queue.wait(task_id, timeout=1)
+    assert reply == {"error": f"Task failed after {queue.max_attempts} deliveries"}
+    assert worker.counts["failed"] == 1
+    assert queue.client.llen("test:processing:c") == 0
+
+
+def test_detect_many_raises_on_worker_error(queue):
+    # Every delivery is used up before a worker sees the task
+    def exhaust_and_process():
+        claimed = queue.claim("c", batch_size=1, timeout=1)
+        for _ in range(queue.max_attempts):
+            queue.load(claimed[0])
+        InferenceWorker(queue, worker_id="c").process(claimed)
+
+    thread = threading.Thread(target=exhaust_and_process)
+    thread.start()
+    with pytest.raises(RuntimeError, match="failed after"):
+        queue.detect_many([b"image"], PARAMS["params"], PARAMS["decode"], timeout=2)
+    thread.join()
+
+
+def test_abandoned_task_is_acknowledged_without_result(queue):
+    task_id = queue.submit(PARAMS, b"image")
+    with pytest.raises(TimeoutError):
+        queue.wait(task_id, timeout=0.01)
+
+    worker = InferenceWorker(queue, worker_id="c")
+    worker.process(queue.claim("c", batch_size=1, timeout=0.1))
+    assert worker.counts["abandoned"] == 1
+    assert queue.client.llen("test:processing:c") == 0
+    assert queue.client.get(f"test:reply:{task_id}") is None
+
@@ -0,0 +1,106 @@
+"""
+Tests for the accuracy scoring of the evaluation harness: COCO greedy
+matching, 101-point AP and per-class aggregation against known values
+"""
+import numpy as np
+import pytest
+
+from app.models.evaluate import IOU_THRESHOLDS, average_precision, match_detections, parse_grid, score
+
+GT_BOX = np.array([[0, 0, 10, 10]], dtype=np.float32)
+
+
+def boxes(*rows):
+    return np.array(rows, dtype=np.float32).reshape(-1, 4)
+
+
+def test_exact_box_is_correct_at_every_threshold():
+    correct = match_detections(boxes([0, 0, 10, 10]), np.array([0.9]), np.array([2]), GT_BOX, np.array([2]))
+    assert correct.shape == (1, len(IOU_THRESHOLDS))
+    assert correct.all()
+
+
+def test_partial_overlap_only_passes_lower_thresholds():
+    # IoU 0.57: true positive at 0.50 and 0.55 only
+    correct = match_detections(boxes([0, 0, 10, 5.7]), np.array([0.9]), np.array([2]), GT_BOX, np.array([2]))
+    assert correct[0].tolist() == [True, True] + [False] * 8
+
+
+def test_class_mismatch_never_matches():
+    correct = match_detections(boxes([0, 0, 10, 10]), np.array([0.9]), np.array([7]), GT_BOX, np.array([2]))
+    assert not correct.any()
+
+
+def test_lower_confidence_duplicate_is_a_false_positive():
+    detections = boxes([0, 0, 10, 8], [0, 0, 10, 10])
+    correct = match_detections(detections, np.array([0.6, 0.9]), np.array([2, 2]), GT_BOX, np.array([2]))
+    assert not correct[0].any()
+    assert correct[1].all()
+
+
+def test_greedy_order_follows_confidence_per_threshold():
+    # The IoU 0.8 box is visited first and takes the ground truth up to 0.80;
+    # above that the exact box is still free to match
+    detections = boxes([0, 0, 10, 8], [0, 0, 10, 10])
+    correct = match_detections(detections, np.array([0.9, 0.6]), np.array([2, 2]), GT_BOX, np.array([2]))
+    below = np.array(IOU_THRESHOLDS) <= 0.8
+    assert correct[0].tolist() == below.tolist()
+    assert correct[1].tolist() == (~below).tolist()
+
+
+def test_empty_inputs():
+    assert match_detections(boxes(), np.zeros(0), np.zeros(0, int), GT_BOX, np.array([2])).shape == (0, 10)
+    correct = match_detections(boxes([0, 0, 10, 10]), np.array([0.9]), np.array([2]), boxes(), np.zeros(0, int))
+    assert not correct.any()
+
+
+def test_perfect_detections_score_one():
+    ap, recall, precision = average_precision(np.array([0.9, 0.8]), np.ones((2, 3), bool), 2)
+    np.testing.assert_allclose(ap, 1.0)
+    np.testing.assert_allclose(recall, 1.0)
+    np.testing.assert_allclose(precision, 1.0)
+
+
+@pytest.mark.parametrize("scores, correct, n_gt, expected_ap, expected_recall, expected_precision", [
+    # Precision envelope 1 up to recall 0.5 (51 points), then 2/3 (50 points)
+    ([0.9, 0.8, 0.7], [True, False, True], 2, (51 + 50 * 2 / 3) / 101, 1.0, 2 / 3),
+    # Recall never passes 0.5: the remaining 50 points count as 0
+    ([0.9], [True], 2, 51 / 101, 0.5, 1.0),
+    # Ranking matters: the false positive first caps the envelope at 2/3
+    ([0.8, 0.9, 0.7], [True, False, True], 2, 2 / 3, 1.0, 2 / 3),
+])
+def test_known_average_precision(scores, correct, n_gt, expected_ap, expected_recall, expected_precision):
+    ap, recall, precision = average_precision(np.array(scores), np.array(correct)[:, None], n_gt)
+    assert ap[0] == pytest.approx(expected_ap)
+    assert recall[0] == pytest.approx(expected_recall)
+    assert precision[0] == pytest.approx(expected_precision)
+
+
+def test_no_ground_truth_or_detections_gives_zeros():
+    for scores, correct, n_gt in [(np.array([0.9]), np.ones((1, 10), bool), 0), (np.zeros(0), np.zeros((0, 10), bool), 3)]:
+        ap, recall, precision = average_precision(scores, correct, n_gt)
+        assert ap.shape == recall.shape == precision.shape == (10,)
+        assert not ap.any() and not recall.any() and not precision.any()
+
+
+def test_score_averages_over_classes_present_in_ground_truth():
+    predictions = [(boxes([0, 0, 10, 10], [50, 50, 60, 60]), np.array([0.9, 0.8]), np.array([2, 5]))]
+    ground_truth = [(boxes([0, 0, 10, 10], [20, 20, 30, 30]), np.array([2, 0]))]
+    report = score(predictions, ground_truth)
+
+    assert report["per_class"]["car"]["map50_95"] == pytest.approx(1.0)
+    assert report["per_class"]["person"]["map50"] == 0.0
+    assert report["per_class"]["bus"] == {"instances": 0, "detections": 1, "map50": 0.0, "map50_95": 0.0,
+                                          "recall50": 0.0, "precision50": 0.0}
+    # The unmatched bus detection has no ground truth and is left out of the mean
+    assert report["map50_95"] == pytest.approx(0.5)
+    assert report["recall50"] == pytest.approx(0.5)
+
+
+def test_parse_grid_expands_the_product():
+    configs = parse_grid(["imgsz=320,640", "conf=0.25,0.4", "pooled=true"])
+    assert len(configs) == 4
+    assert {(c["imgsz"], c["conf"]) for c in configs} == {(320, 0.25), (320, 0.4), (640, 0.25), (640, 0.4)}
+    assert all(c["pooled"] is True and c["optimize"] == "eager" for c in configs)
+    with pytest.raises(ValueError):
+        parse_grid(["batch=4"])
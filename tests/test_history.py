@@ -0,0 +1,121 @@
+"""
+Tests for the detection history: batched writes, class/confidence/region
+filters on both query plans and cursor pagination
+"""
+import time
+
+import pytest
+
+from app.utils.history import DetectionHistory
+
+T0 = 1_700_000_000.0
+
+
+def detection(class_id, x1, y1, x2, y2, confidence=0.9):
+    return {"class_id": class_id, "confidence": confidence, "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}}
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = DetectionHistory(str(tmp_path / "history.db"), flush_interval=0.01, retention_days=0)
+    # Frame i at T0 + i: a car on the left on even frames, a truck on the right on odd ones
+    for i in range(10):
+        box = detection(2, 10, 10, 50, 50) if i % 2 == 0 else detection(7, 500, 300, 600, 400, confidence=0.4)
+        history.record("cam-a" if i < 8 else "cam-b", [box, detection(0, 200, 200, 220, 260)],
+                       source="detect", model="yolov8n", now=T0 + i)
+    history.record("cam-a", [], source="binary", now=T0 + 10)
+    history.close()
+    yield history
+    history.close()
+
+
+def ids(result):
+    return [int(frame["time"] - T0) for frame in result["frames"]]
+
+
+def test_frames_are_written_in_batches(history):
+    stats = history.stats()
+    assert stats["recorded"] == stats["written"] == 11
+    assert stats["batches"] < 11
+    assert stats["dropped"] == stats["errors"] == 0
+
+
+def test_frames_come_back_newest_first_with_their_detections(history):
+    result = history.query(stream_id="cam-a", limit=3)
+    assert ids(result) == [10, 7, 6]
+    frame = result["frames"][2]
+    assert frame["stream_id"] == "cam-a"
+    assert frame["model"] == "yolov8n"
+    assert frame["objects"] == 2
+    assert [d["class_name"] for d in frame["objects_detected"]] == ["car", "person"]
+    assert frame["objects_detected"][0]["bbox"] == {"x1": 10, "y1": 10, "x2": 50, "y2": 50, "width": 40, "height": 40}
+
+
+def test_class_confidence_and_time_filters(history):
+    assert ids(history.query(classes=[7])) == [9, 7, 5, 3, 1]
+    assert ids(history.query(classes=[7], min_confidence=0.5)) == []
+    assert ids(history.query(classes=[2, 7], start=T0 + 3, end=T0 + 5)) == [5, 4, 3]
+    assert ids(history.query(stream_id="cam-b")) == [9, 8]
+
+
+@pytest.mark.parametrize("stream_id", [None, "cam-a"])
+def test_region_matches_overlapping_boxes(history, stream_id):
+    # Without a stream or start the R-tree is searched first; with one, each frame is checked
+    right, left = ([9, 7, 5, 3, 1], [8, 6, 4, 2, 0]) if stream_id is None else ([7, 5, 3, 1], [6, 4, 2, 0])
+    assert ids(history.query(stream_id=stream_id, region=(590, 390, 800, 600))) == right
+    # Touching edges count as overlap
+    assert ids(history.query(stream_id=stream_id, region=(0, 0, 10, 10))) == left
+    # A region touching nothing but the person box needs the person class to match
+    assert ids(history.query(stream_id=stream_id, region=(205, 205, 210, 210), classes=[2])) == []
+    assert ids(history.query(stream_id=stream_id, region=(700, 0, 800, 100))) == []
+
+
+def test_invalid_region_is_rejected(history):
+    with pytest.raises(ValueError):
+        history.query(region=(100, 100, 0, 0))
+
+
+def test_cursor_pages_through_every_frame_once(history):
+    pages, cursor = [], None
+    while True:
+        result = history.query(classes=[0], limit=3, cursor=cursor)
+        pages.append(ids(result))
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == [[9, 8, 7], [6, 5, 4], [3, 2, 1], [0]]
+
+
+def test_cursor_breaks_timestamp_ties_by_id(tmp_path):
+    history = DetectionHistory(str(tmp_path / "ties.db"), flush_interval=0.01, retention_days=0)
+    for _ in range(5):
+        history.record("cam", [], source="detect", now=T0)
+    history.close()
+
+    first = history.query(limit=2)
+    second = history.query(limit=2, cursor=first["next_cursor"])
+    third = history.query(limit=2, cursor=second["next_cursor"])
+    seen = [frame["id"] for page in (first, second, third) for frame in page["frames"]]
+    assert seen == [5, 4, 3, 2, 1]
+    assert third["next_cursor"] is None
+    with pytest.raises(ValueError):
+        history.query(cursor="yesterday")
+
+
+def test_old_frames_are_purged(tmp_path):
+    history = DetectionHistory(str(tmp_path / "purge.db"), flush_interval=0.01, retention_days=1)
+    history.record("cam", [detection(2, 0, 0, 10, 10)], source="detect", now=time.time() - 2 * 86400)
+    history.record("cam", [detection(2, 0, 0, 10, 10)], source="detect")
+    history.close()
+    history._purge(history._open())
+
+    assert history.stats()["purged"] == 1
+    assert len(history.query()["frames"]) == 1
+    assert len(history.query(region=(0, 0, 5, 5))["frames"]) == 1
+
+
+def test_disabled_history():
+    history = DetectionHistory(None)
+    assert history.record("cam", [], source="detect") is False
+    with pytest.raises(RuntimeError):
+        history.query()
@@ -0,0 +1,203 @@
+"""
+Tests for the asynchronous job API: submit, poll, webhook delivery, job expiry
+and orphaned jobs
+Webhooks are delivered to a local HTTP stub
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.utils.job_store import MemoryJobStore, RedisJobStore, SQLiteJobStore
+from app.utils.jobs import FAILED, SUCCEEDED, JobManager
+from app.utils.local_redis import LocalRedis
+
+
+class WebhookStub:
+    """HTTP server on 127.0.0.1 recording the POSTs it receives"""
+
+    def __init__(self, status: int = 200, location: str = None):
+        self.received = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.received.append({"path": self.path, "headers": dict(self.headers), "job": json.loads(body)})
+                self.send_response(status)
+                if location:
+                    self.send_header("Location", location)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = WebhookStub()
+    yield server
+    server.close()
+
+
+def run_job(manager: JobManager, work, webhook_url=None, timeout: float = 10.0):
+    """Submit a job, then poll it until it is finished and its webhook (if any) settled"""
+    async def scenario():
+        job = await manager.submit(work, webhook_url=webhook_url, images=1)
+        assert job["status"] == "queued"
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            polled = await manager.get(job["id"])
+            if polled["status"] in (SUCCEEDED, FAILED) and (webhook_url is None or polled["webhook"]):
+                return polled
+            await asyncio.sleep(0.02)
+        raise AssertionError(f"Job {job['id']} did not finish in {timeout}s")
+
+    return asyncio.run(scenario())
+
+
+def test_submit_poll_and_webhook(stub):
+    manager = JobManager(MemoryJobStore(), webhook_retries=1, webhook_allowed_hosts=["127.0.0.1"])
+    job = run_job(manager, lambda: {"objects": 3}, webhook_url=stub.url + "/hook")
+
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"objects": 3}
+    assert job["webhook"] == {"delivered": True, "attempts": 1, "status": 200, "error": None}
+    assert len(stub.received) == 1
+    delivery = stub.received[0]
+    assert delivery["path"] == "/hook"
+    assert delivery["headers"]["X-Job-Id"] == job["id"]
+    assert delivery["job"]["status"] == SUCCEEDED and delivery["job"]["result"] == {"objects": 3}
+    assert manager.counts["webhooks_delivered"] == 1
+
+
+def test_failed_job_is_reported():
+    def work():
+        raise ValueError("broken image")
+
+    job = run_job(JobManager(MemoryJobStore()), work)
+    assert job["status"] == FAILED
+    assert job["error"] == "broken image"
+
+
+def test_webhook_to_private_address_is_refused(stub):
+    manager = JobManager(MemoryJobStore(), webhook_retries=1)
+    with pytest.raises(ValueError, match="private or local"):
+        manager.check_webhook(stub.url)
+
+    job = run_job(manager, lambda: {}, webhook_url=stub.url)
+    assert job["webhook"]["delivered"] is False
+    assert stub.received == []
+
+
+def test_webhook_host_allow_list():
+    manager = JobManager(MemoryJobStore(), webhook_allowed_hosts=["*.example.com"])
+    manager.check_webhook("https://hooks.example.com/x")
+    for url in ("https://example.org/x", "https://evilexample.com/x", "ftp://hooks.example.com/x"):
+        with pytest.raises(ValueError):
+            manager.check_webhook(url)
+
+
+def test_webhook_redirect_is_not_followed():
+    redirecting = WebhookStub(status=307, location="http://169.254.169.254/latest/meta-data")
+    try:
+        manager = JobManager(MemoryJobStore(), webhook_retries=1, webhook_allow_private=True)
+        job = run_job(manager, lambda: {}, webhook_url=redirecting.url)
+    finally:
+        redirecting.close()
+    assert job["webhook"]["delivered"] is False
+    assert job["webhook"]["status"] == 307
+    assert len(redirecting.received) == 1
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobStore()
+    if request.param == "sqlite":
+        return SQLiteJobStore(str(tmp_path / "jobs.db"))
+    return RedisJobStore(LocalRedis())
+
+
+def test_job_store_ttl_expiry(store):
+    store.save({"id": "kept", "status": "queued"})
+    store.save({"id": "short", "status": SUCCEEDED}, ttl=0.05)
+    assert store.get("short")["status"] == SUCCEEDED
+
+    time.sleep(0.1)
+    store.purge_expired()
+    assert store.get("short") is None
+    assert store.get("kept") == {"id": "kept", "status": "queued"}
+
+
+def test_job_store_lists_unfinished_jobs(store):
+    store.save({"id": "running", "status": "running"})
+    store.save({"id": "done", "status": SUCCEEDED}, ttl=60)
+    assert [job["id"] for job in store.unfinished()] == ["running"]
+
+    store.save({"id": "running", "status": SUCCEEDED}, ttl=60)
+    assert store.unfinished() == []
+
+
+def test_orphaned_jobs_are_failed_by_another_process(store, stub):
+    now = time.time()
+    store.save({"id": "orphan", "status": "running", "updated_at": now - 120, "lease_until": now - 1,
+                "worker": "gone:1", "webhook_url": stub.url})
+    store.save({"id": "leased", "status": "queued", "updated_at": now, "lease_until": now + 60, "worker": "alive:2"})
+    manager = JobManager(store, webhook_retries=1, webhook_allowed_hosts=["127.0.0.1"])
+
+    assert asyncio.run(manager.fail_orphans()) == 1
+    orphan = store.get("orphan")
+    assert orphan["status"] == FAILED
+    assert "stopped" in orphan["error"]
+    assert orphan["webhook"]["delivered"]
+    assert stub.received[0]["job"]["id"] == "orphan"
+    assert store.get("leased")["status"] == "queued"
+    assert [job["id"] for job in store.unfinished()] == ["leased"]
+
+
+def test_running_jobs_keep_their_lease(tmp_path):
+    async def scenario():
+        owner = JobManager(SQLiteJobStore(str(tmp_path / "jobs.db")), lease=0.15)
+        other = JobManager(SQLiteJobStore(str(tmp_path / "jobs.db")), lease=0.15)
+        owner.start()
+        job = await owner.submit(lambda: time.sleep(0.5) or {"objects": 1})
+        await asyncio.sleep(0.4)
+        assert await other.fail_orphans() == 0
+        await owner.drain(5)
+        return await other.get(job["id"])
+
+    assert asyncio.run(scenario())["status"] == SUCCEEDED
+
+
+def test_finished_jobs_expire_after_ttl():
+    manager = JobManager(MemoryJobStore(), ttl=0.05)
+    job = run_job(manager, lambda: {"objects": 0})
+    assert job["status"] == SUCCEEDED
+    time.sleep(0.1)
+    assert asyncio.run(manager.get(job["id"])) is None
+
+
+def test_submit_endpoint_rejects_private_webhook():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    response = TestClient(app).post(
+        "/jobs",
+        files=[("files", ("a.jpg", b"\xff\xd8\xff\xd9", "image/jpeg"))],
+        data={"webhook_url": "http://169.254.169.254/latest/meta-data"}
+    )
+    assert response.status_code == 400
+    assert "private or local" in response.json()["error"]
@@ -0,0 +1,118 @@
+"""
+Tests for micro-benchmark baseline comparison: row statuses, thresholds and
+the rules that fail a check
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils.microbench import _check, _failed, _parse_stage_thresholds, compare, format_comparison, measure
+
+HOST = {"cpus": 4, "machine": "x86_64"}
+
+
+def report(**stages):
+    figures = {
+        name: {"skipped": value} if isinstance(value, str) else {"median_ms": value[0], "min_ms": value[1]}
+        for name, value in stages.items()
+    }
+    return {"host": HOST, "stages": figures}
+
+
+def statuses(rows):
+    return {row["stage"]: row["status"] for row in rows}
+
+
+def test_statuses():
+    baseline = report(decode_pil=(10.0, 9.0), letterbox=(10.0, 9.0), encode=(10.0, 9.0), plot=(1.0, 1.0),
+                      forward="weights missing", cleanup=(50.0, 45.0))
+    current = report(decode_pil=(10.5, 9.0), letterbox=(12.0, 9.0), encode=(8.0, 7.0), plot=(1.0, 1.0),
+                     forward=(30.0, 28.0), draw=(2.0, 2.0))
+    rows = compare(current, baseline, threshold=10)
+
+    assert statuses(rows) == {"decode_pil": "ok", "letterbox": "regressed", "encode": "improved", "plot": "ok",
+                              "forward": "skipped", "draw": "new", "cleanup": "missing"}
+    letterbox = next(row for row in rows if row["stage"] == "letterbox")
+    assert letterbox["change_pct"] == pytest.approx(20.0)
+    assert (letterbox["baseline_ms"], letterbox["current_ms"], letterbox["threshold_pct"]) == (10.0, 12.0, 10)
+    # Stages of the baseline come after the current ones, with their baseline time
+    assert rows[-1] == {"stage": "cleanup", "baseline_ms": 50.0, "current_ms": None, "change_pct": None,
+                        "threshold_pct": 10, "status": "missing"}
+
+
+def test_stage_thresholds_min_delta_and_statistic():
+    baseline = report(letterbox=(1.0, 1.0), cleanup=(100.0, 80.0))
+    current = report(letterbox=(1.5, 1.0), cleanup=(120.0, 80.0))
+
+    assert statuses(compare(current, baseline, 10)) == {"letterbox": "regressed", "cleanup": "regressed"}
+    assert statuses(compare(current, baseline, 10, {"cleanup": 25})) == {"letterbox": "regressed", "cleanup": "ok"}
+    # A 0.5 ms slowdown is jitter at min_delta_ms=1, the 20 ms one is not
+    assert statuses(compare(current, baseline, 10, min_delta_ms=1)) == {"letterbox": "ok", "cleanup": "regressed"}
+    assert statuses(compare(current, baseline, 10, statistic="min")) == {"letterbox": "ok", "cleanup": "ok"}
+
+
+@pytest.mark.parametrize("status, baseline_ms, allow_skipped, failed", [
+    ("regressed", 1.0, True, True),
+    ("ok", 1.0, False, False),
+    ("improved", 1.0, False, False),
+    ("new", None, False, False),
+    ("missing", 1.0, False, True),
+    ("missing", 1.0, True, False),
+    ("skipped", 1.0, False, True),
+    ("skipped", 1.0, True, False),
+    # Skipped in the baseline too: nothing was lost
+    ("skipped", None, False, False),
+])
+def test_failure_rules(status, baseline_ms, allow_skipped, failed):
+    assert _failed({"status": status, "baseline_ms": baseline_ms}, allow_skipped) == failed
+
+
+def test_table_uppercases_only_failing_rows():
+    rows = compare(report(letterbox=(12.0, 9.0), forward="no weights"),
+                   report(letterbox=(10.0, 9.0), forward=(30.0, 28.0)))
+    assert "REGRESSED" in format_comparison(rows)
+    assert "SKIPPED" in format_comparison(rows)
+    table = format_comparison(rows, allow_skipped=True)
+    assert "REGRESSED" in table
+    assert "SKIPPED" not in table and "skipped" in table
+
+
+def check(tmp_path, current, baseline, **options):
+    path = tmp_path / "baseline.json"
+    path.write_text(json.dumps(baseline))
+    args = SimpleNamespace(**{"threshold": 10, "stage_threshold": [], "min_delta_ms": 0.0, "statistic": "median",
+                              "allow_skipped": False, "stages": None, **options})
+    return _check(current, str(path), args)
+
+
+def test_check_exit_status(tmp_path, capsys):
+    baseline = report(letterbox=(10.0, 9.0), forward=(30.0, 28.0))
+    assert check(tmp_path, report(letterbox=(10.5, 9.0), forward=(30.0, 28.0)), baseline) == 0
+    assert "No regressions" in capsys.readouterr().out
+
+    assert check(tmp_path, report(letterbox=(20.0, 9.0), forward=(30.0, 28.0)), baseline) == 1
+    assert check(tmp_path, report(letterbox=(20.0, 9.0)), baseline, stage_threshold=["letterbox=150"]) == 1
+    output = capsys.readouterr().out
+    assert "forward measured in the baseline but not in this run" in output
+
+    unmeasured = report(letterbox=(10.0, 9.0), forward="no weights")
+    assert check(tmp_path, unmeasured, baseline) == 1
+    assert check(tmp_path, unmeasured, baseline, allow_skipped=True) == 0
+    # Stages not run this time are left out of the baseline
+    assert check(tmp_path, report(letterbox=(10.0, 9.0)), baseline, stages=["letterbox"]) == 0
+
+
+def test_stage_threshold_parsing():
+    assert _parse_stage_thresholds(["cleanup=25", "save_upload=30"]) == {"cleanup": 25.0, "save_upload": 30.0}
+    for item in ("cleanup", "cleanup=", "unknown=5"):
+        with pytest.raises(ValueError):
+            _parse_stage_thresholds([item])
+
+
+def test_measure_reports_per_call_figures():
+    calls = []
+    figures = measure(lambda: calls.append(1), samples=5)
+    assert figures["samples"] == 5
+    assert figures["min_ms"] <= figures["median_ms"]
+    assert len(calls) > 5
@@ -0,0 +1,83 @@
+"""
+Tests for the per-stream motion gate: static frames reuse the last result,
+motion, new parameters and the skip/age limits force detection
+"""
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.utils.motion_gate import MotionGate
+
+RESULT = {"objects_detected": [{"class_id": 2, "confidence": 0.9}]}
+
+
+def scene(shift: int = 0) -> np.ndarray:
+    frame = np.full((240, 320, 3), 60, dtype=np.uint8)
+    frame[80:160, 40 + shift:140 + shift] = 220
+    return frame
+
+
+def detect(gate: MotionGate, stream: str, frame, params="p"):
+    """check(), recording a fresh result when the gate asks for detection"""
+    cached, signature, motion = gate.check(stream, frame, params)
+    if cached is None:
+        gate.record(stream, signature, params, RESULT)
+    return cached, motion
+
+
+def test_static_frames_reuse_the_last_result():
+    gate = MotionGate(max_skip=100, max_interval=60)
+    assert detect(gate, "cam", scene()) == (None, None)
+
+    cached, motion = detect(gate, "cam", scene())
+    assert cached == RESULT
+    assert motion == 0.0
+    cached["objects_detected"].clear()
+    assert detect(gate, "cam", scene())[0] == RESULT
+    assert gate.stats()["streams"]["cam"]["skipped"] == 2
+
+
+def test_motion_triggers_detection():
+    gate = MotionGate(max_skip=100, max_interval=60)
+    detect(gate, "cam", scene())
+    cached, motion = detect(gate, "cam", scene(shift=60))
+    assert cached is None
+    assert motion >= gate.threshold
+
+
+def test_changed_parameters_and_streams_are_separate():
+    gate = MotionGate(max_skip=100, max_interval=60)
+    detect(gate, "cam", scene(), params="conf=0.25")
+    assert detect(gate, "cam", scene(), params="conf=0.5")[0] is None
+    assert detect(gate, "other", scene(), params="conf=0.5")[0] is None
+
+
+def test_detection_is_forced_after_max_skip_and_max_interval():
+    gate = MotionGate(max_skip=2, max_interval=60)
+    detect(gate, "cam", scene())
+    outcomes = [detect(gate, "cam", scene())[0] is None for _ in range(4)]
+    assert outcomes == [False, False, True, False]
+    assert gate.stats()["streams"]["cam"]["forced"] == 1
+
+    gate = MotionGate(max_skip=100, max_interval=0.05)
+    detect(gate, "cam", scene())
+    time.sleep(0.06)
+    assert detect(gate, "cam", scene())[0] is None
+
+
+def test_pil_and_array_frames_compare_alike():
+    gate = MotionGate(max_skip=100, max_interval=60)
+    detect(gate, "cam", scene())
+    pil_frame = Image.fromarray(scene()[:, :, ::-1])
+    cached, motion = detect(gate, "cam", pil_frame)
+    assert cached == RESULT
+    assert motion < gate.threshold
+
+
+def test_least_recently_seen_streams_are_dropped():
+    gate = MotionGate(max_streams=2)
+    for stream in ("a", "b", "a", "c"):
+        detect(gate, stream, scene())
+    assert sorted(gate.stats()["streams"]) == ["a", "c"]
+    assert gate.stats()["evicted_streams"] == 1
@@ -0,0 +1,125 @@
+"""
+Tests for the perceptual-hash near-duplicate cache: hashing, multi-index
+lookup within the Hamming distance, rescaling, LRU eviction and expiry
+"""
+import io
+import random
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.utils.phash_cache import HASH_BITS, PerceptualCache, dhash, phash
+
+DETECTION = {"class_id": 2, "class_name": "car", "confidence": 0.9,
+             "bbox": {"x1": 10.0, "y1": 20.0, "x2": 110.0, "y2": 70.0, "width": 100.0, "height": 50.0}}
+
+
+def result():
+    return {"detections": [dict(DETECTION)]}
+
+
+def flip(hash_value: int, bits: int, seed: int = 0) -> int:
+    """Flip `bits` distinct bits of a hash"""
+    for bit in random.Random(seed).sample(range(HASH_BITS), bits):
+        hash_value ^= 1 << bit
+    return hash_value
+
+
+def street(seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    for _ in range(12):
+        x, y = rng.integers(0, 280), rng.integers(0, 200)
+        frame[y:y + 40, x:x + 40] = rng.integers(0, 255, 3)
+    return frame
+
+
+@pytest.mark.parametrize("hash_fn", [dhash, phash])
+def test_reencoded_copies_hash_close_and_other_images_far(hash_fn):
+    original = street()
+    buffer = io.BytesIO()
+    Image.fromarray(original[:, :, ::-1]).resize((160, 120)).save(buffer, format="JPEG", quality=60)
+    copy = Image.open(io.BytesIO(buffer.getvalue()))
+
+    assert hash_fn(original) < 2 ** HASH_BITS
+    assert bin(hash_fn(original) ^ hash_fn(copy)).count("1") <= 4
+    assert bin(hash_fn(original) ^ hash_fn(street(seed=1))).count("1") > 10
+
+
+def test_array_and_pil_input_hash_identically():
+    frame = street()
+    assert dhash(frame) == dhash(Image.fromarray(frame[:, :, ::-1]))
+
+
+@pytest.mark.parametrize("distance, found", [(0, True), (2, True), (4, True), (5, False), (12, False)])
+def test_lookup_within_max_distance(distance, found):
+    cache = PerceptualCache(max_distance=4)
+    cache.put(0x0123456789ABCDEF, 320, 240, "p", result())
+    hit = cache.get(flip(0x0123456789ABCDEF, distance), 320, 240, "p")
+    assert (hit is not None) == found
+    if found:
+        assert hit[1] == distance
+
+
+def test_multi_index_lookup_matches_brute_force():
+    rng = random.Random(1)
+    cache = PerceptualCache(max_distance=6)
+    stored = [rng.getrandbits(HASH_BITS) for _ in range(300)]
+    # Some near neighbours so there is something to find
+    stored += [flip(value, rng.randint(0, 8), seed=i) for i, value in enumerate(stored[:100])]
+    for value in stored:
+        cache.put(value, 100, 100, None, result())
+
+    for i in range(200):
+        query = flip(stored[i], rng.randint(0, 8), seed=1000 + i)
+        nearest = min(bin(value ^ query).count("1") for value in stored)
+        hit = cache.get(query, 100, 100)
+        if nearest <= 6:
+            assert hit is not None and hit[1] == nearest
+        else:
+            assert hit is None
+
+
+def test_params_and_aspect_ratio_must_match():
+    cache = PerceptualCache()
+    cache.put(42, 320, 240, ("yolov8n", 0.25), result())
+    assert cache.get(42, 320, 240, ("yolov8n", 0.5)) is None
+    assert cache.get(42, 320, 180, ("yolov8n", 0.25)) is None
+    assert cache.get(42, 640, 480, ("yolov8n", 0.25)) is not None
+
+
+def test_hit_is_rescaled_to_the_request_size():
+    cache = PerceptualCache()
+    cache.put(42, 320, 240, None, result())
+    hit, _ = cache.get(42, 640, 480)
+    assert hit["detections"][0]["bbox"] == {"x1": 20.0, "y1": 40.0, "x2": 220.0, "y2": 140.0,
+                                            "width": 200.0, "height": 100.0}
+    # The cached entry is untouched
+    assert cache.get(42, 320, 240)[0]["detections"][0]["bbox"] == DETECTION["bbox"]
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = PerceptualCache(max_distance=0, max_entries=2)
+    cache.put(1, 100, 100, None, result())
+    cache.put(2, 100, 100, None, result())
+    assert cache.get(1, 100, 100) is not None
+    cache.put(3, 100, 100, None, result())
+
+    assert cache.get(2, 100, 100) is None
+    assert cache.get(1, 100, 100) is not None
+    assert cache.get(3, 100, 100) is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert all(not keys or len(keys) <= 2 for table in cache._tables for keys in table.values())
+
+
+def test_expired_entries_are_dropped():
+    cache = PerceptualCache(ttl=0.05)
+    cache.put(42, 100, 100, None, result())
+    time.sleep(0.06)
+    assert cache.get(42, 100, 100) is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,62 @@
+"""
+Tests for pooled preprocessing: output identical to the reference letterbox
+and no allocations once the pool is warm
+"""
+import numpy as np
+import pytest
+
+from app.models.buckets import letterbox
+from app.models.preprocess import BufferPool
+
+
+def frames(*sizes):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for height, width in sizes]
+
+
+@pytest.mark.parametrize("size", [(480, 640), (640, 480), (384, 640), (100, 333)])
+def test_matches_reference_letterbox(size):
+    pool = BufferPool()
+    frame = frames(size)[0]
+    expected, ratio, padding = letterbox(frame, (384, 640))
+
+    with pool.preprocess([frame], (384, 640)) as (batch, boxes):
+        assert tuple(batch.shape) == (1, 3, 384, 640)
+        assert boxes == [(ratio, padding)]
+        rgb = expected[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255
+        np.testing.assert_allclose(batch[0].numpy(), rgb, atol=1e-6)
+
+
+def test_warm_pool_does_not_allocate():
+    pool = BufferPool()
+    with pool.preprocess(frames((480, 640), (480, 640)), (384, 640)):
+        pass
+    allocations = pool.stats()["allocations"]
+
+    for count in (2, 1, 2):
+        with pool.preprocess(frames(*[(480, 640)] * count), (384, 640)) as (batch, _):
+            assert batch.shape[0] == count
+    stats = pool.stats()
+    assert stats["allocations"] == allocations == 1
+    assert stats["batches"] == 4
+    assert stats["images"] == 7
+
+
+def test_larger_batch_replaces_the_smaller_buffers():
+    pool = BufferPool()
+    with pool.preprocess(frames((480, 640)), (384, 640)):
+        pass
+    resident = pool.stats()["resident_bytes"]
+    with pool.preprocess(frames(*[(480, 640)] * 3), (384, 640)):
+        pass
+    stats = pool.stats()
+    assert stats["allocations"] == 2
+    assert stats["resident_bytes"] == 3 * resident
+
+
+def test_concurrent_checkouts_get_separate_buffers():
+    pool = BufferPool()
+    with pool.preprocess(frames((480, 640)), (384, 640)) as (first, _):
+        with pool.preprocess(frames((480, 640)), (384, 640)) as (second, _):
+            assert first.data_ptr() != second.data_ptr()
+    assert pool.stats()["allocations"] == 2
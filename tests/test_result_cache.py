@@ -0,0 +1,137 @@
+"""
+Tests for result image serving: ETag revalidation, single byte ranges, ?w=
+variants and the bounded in-memory cache
+"""
+import io
+
+import pytest
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+from app.utils import result_cache as result_cache_module
+from app.utils.result_cache import ResultCache, ResultFiles
+
+NAME = "0b5e9c1e-result.jpg"
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    image = Image.new("RGB", (800, 600), (30, 120, 200))
+    image.save(tmp_path / NAME, format="JPEG", quality=95)
+    cache = ResultCache(max_bytes=10 * 1024 * 1024, widths=(160, 320), results_dir=str(tmp_path))
+    monkeypatch.setattr(result_cache_module, "result_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def client(cache):
+    app = Starlette()
+    app.mount("/static/results", ResultFiles(directory=cache.results_dir), name="results")
+    return TestClient(app)
+
+
+def test_serves_with_immutable_caching_headers(client, cache):
+    response = client.get(f"/static/results/{NAME}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["cache-control"] == result_cache_module.CACHE_CONTROL
+    assert response.headers["accept-ranges"] == "bytes"
+    with open(f"{cache.results_dir}/{NAME}", "rb") as f:
+        assert response.content == f.read()
+
+    client.get(f"/static/results/{NAME}")
+    assert cache.stats()["disk_reads"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_matching_etag_is_answered_with_304(client, cache):
+    etag = client.get(f"/static/results/{NAME}").headers["etag"]
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        response = client.get(f"/static/results/{NAME}", headers={"If-None-Match": header})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+    assert cache.stats()["not_modified"] == 4
+
+    response = client.get(f"/static/results/{NAME}", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=100-", 100, None),
+    ("bytes=-50", -50, None),
+    ("bytes=10-999999", 10, None),
+])
+def test_single_ranges_return_206(client, header, start, end):
+    full = client.get(f"/static/results/{NAME}").content
+    size = len(full)
+    expected = full[start:end + 1] if end is not None else full[start:]
+
+    response = client.get(f"/static/results/{NAME}", headers={"Range": header})
+    assert response.status_code == 206
+    assert response.content == expected
+    first = start if start >= 0 else size + start
+    assert response.headers["content-range"] == f"bytes {first}-{first + len(expected) - 1}/{size}"
+    assert response.headers["content-length"] == str(len(expected))
+
+
+def test_unsatisfiable_and_unsupported_ranges(client):
+    size = len(client.get(f"/static/results/{NAME}").content)
+
+    response = client.get(f"/static/results/{NAME}", headers={"Range": f"bytes={size}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{size}"
+    # Multiple ranges and a stale If-Range fall back to the whole file
+    assert client.get(f"/static/results/{NAME}", headers={"Range": "bytes=0-1,5-9"}).status_code == 200
+    response = client.get(f"/static/results/{NAME}", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert len(response.content) == size
+
+
+@pytest.mark.parametrize("requested, width", [("100", 160), ("160", 160), ("200", 320), ("5000", 800)])
+def test_width_is_rounded_up_to_an_offered_variant(client, requested, width):
+    response = client.get(f"/static/results/{NAME}?w={requested}")
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.content)).size == (width, width * 3 // 4)
+
+
+def test_variants_have_their_own_etag_and_are_cached(client, cache):
+    original = client.get(f"/static/results/{NAME}").headers["etag"]
+    variant = client.get(f"/static/results/{NAME}?w=320")
+    assert variant.headers["etag"] != original
+    assert variant.headers["etag"].endswith('-w320"')
+
+    again = client.get(f"/static/results/{NAME}?w=300", headers={"If-None-Match": variant.headers["etag"]})
+    assert again.status_code == 304
+    client.get(f"/static/results/{NAME}?w=320")
+    stats = cache.stats()
+    assert stats["variants_generated"] == 1
+    assert stats["disk_reads"] == 1
+
+
+@pytest.mark.parametrize("path, status_code", [
+    (f"{NAME}?w=0", 400),
+    (f"{NAME}?w=wide", 400),
+    ("missing.jpg", 404),
+    ("..%2Fsecret.jpg", 404),
+])
+def test_bad_requests(client, path, status_code):
+    assert client.get(f"/static/results/{path}").status_code == status_code
+
+
+def test_least_recently_used_images_are_evicted(tmp_path):
+    names = []
+    for i in range(3):
+        names.append(f"{i}.png")
+        Image.new("RGB", (64, 64), (200, 0, 0)).save(tmp_path / names[-1])
+    size = (tmp_path / names[0]).stat().st_size
+    cache = ResultCache(max_bytes=2 * size + 10, results_dir=str(tmp_path))
+
+    for name in (names[0], names[1], names[0], names[2]):
+        cache.get(name, None, cache.stat(name))
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert {name for name, _ in cache._entries} == {names[0], names[2]}
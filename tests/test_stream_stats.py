@@ -0,0 +1,106 @@
+"""
+Tests for per-stream count aggregation: bucketing at several resolutions,
+query windows, ring wrap-around and stream eviction
+"""
+import pytest
+
+from app.utils.stream_stats import StreamStats, parse_resolutions
+
+T0 = 1_699_999_980  # A multiple of 60
+
+
+def frame(*class_ids):
+    return [{"class_id": class_id} for class_id in class_ids]
+
+
+@pytest.fixture
+def stats():
+    return StreamStats(parse_resolutions("1s:10,1m:5"))
+
+
+def test_parse_resolutions_sorts_and_validates():
+    assert parse_resolutions("1h:720, 1s:3600,1m:1440") == [("1s", 1, 3600), ("1m", 60, 1440), ("1h", 3600, 720)]
+    for spec in ("", "1x:10", "m:10", "1m", "0s:10", "1s:0"):
+        with pytest.raises(ValueError):
+            parse_resolutions(spec)
+
+
+def test_frames_are_bucketed_per_resolution(stats):
+    stats.record("cam", frame(2, 2, 0), now=T0 + 0.2)
+    stats.record("cam", frame(2), now=T0 + 0.9)
+    stats.record("cam", frame(7, 99), now=T0 + 2.5)
+    stats.record("cam", frame(0), now=T0 + 61)
+
+    seconds = stats.query("cam", "1s", start=T0, end=T0 + 3)
+    assert seconds["start"] == T0
+    assert seconds["step_s"] == 1
+    assert seconds["frames"] == [2, 0, 1, 0]
+    assert seconds["counts"]["car"] == [3, 0, 0, 0]
+    assert seconds["max"]["car"] == [2, 0, 0, 0]
+    assert seconds["counts"]["truck"] == [0, 0, 1, 0]
+    assert seconds["counts"]["person"] == [1, 0, 0, 0]
+
+    minutes = stats.query("cam", "1m", start=T0, end=T0 + 61)
+    assert minutes["frames"] == [3, 1]
+    assert minutes["counts"]["car"] == [3, 0]
+    assert minutes["counts"]["person"] == [1, 1]
+
+
+def test_default_window_is_limit_buckets_before_end(stats):
+    stats.record("cam", frame(2), now=T0 + 5)
+    result = stats.query("cam", end=T0 + 5, limit=3)
+    assert result["resolution"] == "1s"
+    assert result["start"] == T0 + 3
+    assert result["frames"] == [0, 0, 1]
+
+
+def test_window_is_clipped_to_the_ring(stats):
+    for second in range(15):
+        stats.record("cam", frame(2), now=T0 + second)
+
+    result = stats.query("cam", "1s", start=T0, end=T0 + 14)
+    # Ten slots: seconds 0-4 have been overwritten by 10-14
+    assert result["start"] == T0 + 5
+    assert result["frames"] == [1] * 10
+
+
+def test_stale_slots_read_as_empty(stats):
+    stats.record("cam", frame(2), now=T0)
+    stats.record("cam", frame(2, 2), now=T0 + 10)  # Same slot, ten seconds later
+
+    assert stats.query("cam", "1s", start=T0 + 10, end=T0 + 10)["counts"]["car"] == [2]
+    # Second 0 would map to the same slot; it no longer holds that bucket
+    assert stats.query("cam", "1s", start=T0 + 1, end=T0 + 10)["frames"] == [0] * 9 + [1]
+
+
+def test_frames_older_than_the_slot_are_dropped(stats):
+    stats.record("cam", frame(2), now=T0 + 10)
+    stats.record("cam", frame(2), now=T0)  # Clock stepped back a full ring
+    assert stats.query("cam", "1s", start=T0 + 10, end=T0 + 10)["frames"] == [1]
+
+
+def test_query_errors(stats):
+    with pytest.raises(KeyError):
+        stats.query("unknown")
+    stats.record("cam", frame(2), now=T0)
+    with pytest.raises(ValueError):
+        stats.query("cam", "5m")
+    with pytest.raises(ValueError):
+        stats.query("cam", start=T0 + 10, end=T0)
+
+
+def test_least_recently_seen_streams_are_evicted():
+    stats = StreamStats(parse_resolutions("1s:10"), max_streams=2)
+    for stream in ("a", "b", "a", "c"):
+        stats.record(stream, frame(2), now=T0)
+    assert stats.streams() == ["a", "c"]
+    summary = stats.stats()
+    assert summary["evicted_streams"] == 1
+    assert summary["recorded_frames"] == 4
+    assert summary["memory_bytes"] == 2 * summary["bytes_per_stream"] > 0
+
+
+def test_disabled_aggregator_records_nothing():
+    stats = StreamStats(enabled=False)
+    stats.record("cam", frame(2), now=T0)
+    assert stats.streams() == []
@@ -0,0 +1,131 @@
+"""
+Tests for upload ingestion: format sniffing, size and dimension limits, and
+the per-route body cap on the request stream
+"""
+import asyncio
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from app.utils.upload import (
+    UploadRejected, UploadSizeLimitMiddleware, open_image, read_upload, sniff_image_format
+)
+
+
+def encoded(image_format: str, size=(64, 48)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG", "GIF", "BMP", "TIFF", "WEBP"])
+def test_sniffs_supported_formats(image_format):
+    assert sniff_image_format(encoded(image_format)[:12]) == image_format
+
+
+@pytest.mark.parametrize("header", [b"", b"hello world!", b"%PDF-1.7\n...", b"RIFF\x00\x00\x00\x00WAVE"])
+def test_rejects_other_content(header):
+    assert sniff_image_format(header) is None
+
+
+class FakeUpload:
+    """The parts of starlette's UploadFile that read_upload uses"""
+
+    def __init__(self, data: bytes, size=None):
+        self.file = io.BytesIO(data)
+        self.size = size
+
+
+def test_read_upload_returns_the_spooled_file():
+    upload = FakeUpload(encoded("PNG"))
+    buffer, image_format = asyncio.run(read_upload(upload))
+    assert buffer is upload.file
+    assert buffer.tell() == 0
+    assert image_format == "PNG"
+
+
+@pytest.mark.parametrize("size", [None, 2000])
+def test_read_upload_enforces_the_size_cap(size):
+    with pytest.raises(UploadRejected) as rejected:
+        asyncio.run(read_upload(FakeUpload(encoded("JPEG") + b"\0" * 2000, size), max_bytes=1000))
+    assert rejected.value.status_code == 413
+
+
+def test_read_upload_ignores_the_claimed_content_type():
+    with pytest.raises(UploadRejected) as rejected:
+        asyncio.run(read_upload(FakeUpload(b"#!/bin/sh\necho not an image\n")))
+    assert rejected.value.status_code == 415
+
+
+def test_open_image_limits_pixels_and_downscales():
+    with pytest.raises(UploadRejected) as rejected:
+        open_image(io.BytesIO(encoded("PNG", (100, 100))), max_pixels=5000)
+    assert rejected.value.status_code == 413
+
+    image, scale = open_image(io.BytesIO(encoded("JPEG", (800, 400))), max_side=200)
+    assert max(image.size) <= 200
+    assert scale == pytest.approx(800 / image.size[0])
+
+
+def run_middleware(body_chunks, path="/detect", headers=(), limits=None, max_bytes=100):
+    """Send a POST through the middleware; returns (status, bytes the app read, app completed)"""
+    state = {"read": 0, "completed": False}
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            state["read"] += len(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        state["completed"] = True
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def scenario():
+        middleware = UploadSizeLimitMiddleware(app, max_bytes=max_bytes, limits=limits, overhead=0)
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": i < len(body_chunks) - 1}
+            for i, chunk in enumerate(body_chunks)
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": path, "headers": list(headers)}
+        await middleware(scope, receive, send)
+        return sent
+
+    sent = asyncio.run(scenario())
+    starts = [message for message in sent if message["type"] == "http.response.start"]
+    assert len(starts) == 1
+    return starts[0]["status"], state["read"], state["completed"], sent
+
+
+def test_middleware_rejects_a_large_content_length_without_reading():
+    status, read, completed, _ = run_middleware([b"x" * 10], headers=[(b"content-length", b"1000")])
+    assert (status, read, completed) == (413, 0, False)
+
+
+def test_middleware_stops_chunked_bodies_at_the_cap():
+    status, read, completed, sent = run_middleware([b"x" * 40] * 10)
+    assert status == 413
+    assert not completed
+    assert read <= 80
+    assert json.loads(sent[-1]["body"]) == {"error": "Request body too large"}
+
+
+def test_middleware_passes_bodies_under_the_cap():
+    status, read, completed, _ = run_middleware([b"x" * 40, b"x" * 40])
+    assert (status, read, completed) == (200, 80, True)
+
+
+def test_middleware_caps_per_route():
+    chunks = [b"x" * 40] * 10
+    assert run_middleware(chunks, path="/jobs", limits={"/jobs": 1000})[0] == 200
+    assert run_middleware(chunks, path="/detect", limits={"/jobs": 1000})[0] == 413